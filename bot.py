@@ -6,6 +6,19 @@ import os
 import sys
 import time
 import signal
+import hmac
+import json
+import secrets
+import socket
+import threading
+import functools
+import collections
+import contextvars
+import hashlib
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -15,9 +28,16 @@ from telegram.ext import (
     CallbackQueryHandler,
     ConversationHandler,
     ContextTypes,
+    TypeHandler,
+    BasePersistence,
+    BaseRateLimiter,
+    PersistenceInput,
 )
 from telegram.helpers import escape_markdown
+from telegram.request import HTTPXRequest
 import telegram.error
+
+import storage
 from typing import Union, Any
 
 # --- Logging Configuration ---
@@ -48,6 +68,7 @@ def cleanup_on_exit():
     try:
         if os.path.exists(BOT_STATUS_FILE):
             os.remove(BOT_STATUS_FILE)
+        db.close()
     except Exception as e:
         logger.error(f"Error during cleanup: {e}")
 
@@ -57,19 +78,315 @@ def signal_handler(signum, frame):
     cleanup_on_exit()
     sys.exit(0)
 
+# --- Metrics ---
+METRICS_FILE = os.path.join("logs", "bot_metrics.json")
+METRICS_EXPORT_INTERVAL = 60  # seconds
+
+# Name of the handler currently running in this task; DB time is charged to it.
+current_handler: contextvars.ContextVar[Union[str, None]] = contextvars.ContextVar("current_handler", default=None)
+
+
+class Stat:
+    """Count, error count and latency totals for one handler or API method."""
+
+    __slots__ = ("count", "errors", "floods", "total", "max", "db_count", "db_total")
+
+    def __init__(self):
+        self.count = self.errors = self.floods = self.db_count = 0
+        self.total = self.max = self.db_total = 0.0
+
+    def observe(self, elapsed: float) -> None:
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "floods": self.floods,
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 2),
+            "total_s": round(self.total, 3),
+            "db_queries": self.db_count,
+            "db_s": round(self.db_total, 3),
+        }
+
+
+class BotMetrics:
+    """In-process aggregates for handlers, SQLite statements and Bot API calls.
+
+    Everything is updated from the event loop thread, so plain counters are
+    enough. Totals are cumulative since start; the snapshot is shown by
+    /metrics and written to METRICS_FILE periodically.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.handlers = collections.defaultdict(Stat)
+        self.api = collections.defaultdict(Stat)
+        self.db = Stat()
+
+    def observe_db(self, elapsed: float) -> None:
+        self.db.observe(elapsed)
+        handler = current_handler.get()
+        if handler is not None:
+            stat = self.handlers[handler]
+            stat.db_count += 1
+            stat.db_total += elapsed
+
+    def snapshot(self) -> dict:
+        return {
+            "uptime_s": round(time.time() - self.started),
+            "db": self.db.as_dict(),
+            "handlers": {name: stat.as_dict() for name, stat in self.handlers.items()},
+            "api": {name: stat.as_dict() for name, stat in self.api.items()},
+        }
+
+    def export(self) -> None:
+        """Writes the snapshot atomically so readers never see a partial file."""
+        try:
+            os.makedirs(os.path.dirname(METRICS_FILE), exist_ok=True)
+            tmp_path = METRICS_FILE + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f, indent=2)
+            os.replace(tmp_path, METRICS_FILE)
+        except OSError as e:
+            logger.error(f"Failed to export metrics: {e}")
+
+    async def export_job(self, context) -> None:
+        """JobQueue callback: exports off the event loop (JobQueue awaits its callbacks)."""
+        await asyncio.to_thread(self.export)
+
+
+metrics = BotMetrics()
+
+
+def instrument(name: str, callback):
+    """Wraps a handler callback to record its latency, errors and DB time."""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        token = current_handler.set(name)
+        start_time = time.perf_counter()
+        stat = metrics.handlers[name]
+        try:
+            return await callback(update, context)
+        except Exception:
+            stat.errors += 1
+            raise
+        finally:
+            stat.observe(time.perf_counter() - start_time)
+            current_handler.reset(token)
+    return wrapper
+
+
+def instrument_handlers(handlers) -> None:
+    """Instruments handlers in place, descending into ConversationHandlers."""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        elif not hasattr(handler.callback, "__wrapped__"):
+            handler.callback = instrument(handler.callback.__name__, handler.callback)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records Bot API calls per method.
+
+    Status 429 is counted as a flood, other non-2xx codes and transport
+    failures as errors.
+    """
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> tuple:
+        stat = metrics.api[url.rsplit('/', 1)[-1]]
+        start_time = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            stat.errors += 1
+            raise
+        finally:
+            stat.observe(time.perf_counter() - start_time)
+        if code == 429:
+            stat.floods += 1
+        elif code >= 300:
+            stat.errors += 1
+        return code, payload
+
 # --- Database Management ---
-DB_FILE = "rootzsu_bot_v3.db"
+DB_FILE = os.getenv("BOT_DB_FILE", "rootzsu_bot_v3.db")
+
+# Pragmas applied once to every connection the bot opens.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",       # ~16 MB page cache
+    "PRAGMA mmap_size = 268435456",     # 256 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+SQLITE_STATEMENT_CACHE = 256
+
+
+class Database:
+    """Long-lived SQLite connections for the bot.
+
+    Each thread gets one persistent connection (opened lazily and tuned once),
+    so handlers reuse the same connection and its prepared-statement cache
+    instead of reconnecting on every update.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            isolation_level=None,  # autocommit; explicit BEGIN in transaction()
+            cached_statements=SQLITE_STATEMENT_CACHE,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Returns the calling thread's persistent connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+        return conn
+
+    def fetchone(self, sql: str, params: tuple = ()) -> Union[sqlite3.Row, None]:
+        return self.connection().execute(sql, params).fetchone()
+
+    def fetchall(self, sql: str, params: tuple = ()) -> list:
+        return self.connection().execute(sql, params).fetchall()
+
+    def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        """Runs a single write statement (committed immediately)."""
+        return self.connection().execute(sql, params)
+
+    def executemany(self, sql: str, seq_of_params) -> sqlite3.Cursor:
+        with self.transaction() as conn:
+            return conn.executemany(sql, seq_of_params)
+
+    @contextmanager
+    def transaction(self):
+        """Groups several statements into one write transaction."""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def close(self) -> None:
+        """Closes every connection opened by this instance."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Error closing database connection: {e}")
+        self._local = threading.local()
+
+
+class AsyncDatabase:
+    """Awaitable facade over Database for use inside handlers.
+
+    Statements run on executor threads so a slow query or a write-lock wait
+    never blocks the event loop. Writes are queued onto a single writer
+    thread (one writer, no lock contention between handlers); reads run on a
+    small pool of reader threads, each with its own WAL connection.
+    """
+
+    def __init__(self, database: Database, readers: int = 2):
+        self.database = database
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+
+    async def _submit(self, executor: ThreadPoolExecutor, fn, *args):
+        loop = asyncio.get_running_loop()
+        start_time = time.perf_counter()
+        try:
+            return await loop.run_in_executor(executor, functools.partial(fn, *args))
+        finally:
+            metrics.observe_db(time.perf_counter() - start_time)
+
+    async def fetchone(self, sql: str, params: tuple = ()) -> Union[sqlite3.Row, None]:
+        return await self._submit(self._readers, self.database.fetchone, sql, params)
 
-def get_db_connection():
-    """Establishes and returns a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    async def fetchall(self, sql: str, params: tuple = ()) -> list:
+        return await self._submit(self._readers, self.database.fetchall, sql, params)
+
+    async def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        return await self._submit(self._writer, self.database.execute, sql, params)
+
+    async def executemany(self, sql: str, seq_of_params) -> sqlite3.Cursor:
+        return await self._submit(self._writer, self.database.executemany, sql, list(seq_of_params))
+
+    async def read(self, fn, *args):
+        """Runs fn(conn, *args) on a reader thread."""
+        return await self._submit(self._readers, lambda: fn(self.database.connection(), *args))
+
+    async def write(self, fn, *args):
+        """Runs fn(conn, *args) inside one transaction on the writer thread."""
+        def run():
+            with self.database.transaction() as conn:
+                return fn(conn, *args)
+        return await self._submit(self._writer, run)
+
+    def close(self) -> None:
+        """Waits for queued statements, then closes all connections."""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.database.close()
+
+
+database = Database(DB_FILE)
+db = AsyncDatabase(database)
 
 def setup_database(initial_admin_id: int):
-    """Initializes the database schema and adds the first admin."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """Migrates the database schema and adds the first admin and default services."""
+    run_migrations(database.connection())
+    with database.transaction() as conn:
+        _seed_defaults(conn, initial_admin_id)
+
+def run_migrations(conn: sqlite3.Connection) -> None:
+    """Applies pending MIGRATIONS, each in its own transaction.
+
+    The schema version is stored in PRAGMA user_version, which is updated in
+    the same transaction as the migration itself.
+    """
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {version}")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        logger.info(f"Database migrated to version {version} ({migration.__name__}).")
+
+def _migration_1_base_schema(cursor: sqlite3.Cursor) -> None:
+    """Base schema; also upgrades databases created before versioning."""
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS users (
         user_id INTEGER PRIMARY KEY, username TEXT, first_name TEXT, last_name TEXT,
@@ -117,7 +434,223 @@ CREATE TABLE IF NOT EXISTS payment_proofs (
     if 'price_uah' not in columns:
         cursor.execute("ALTER TABLE services ADD COLUMN price_uah REAL")
         logger.info("Added 'price_uah' column to 'services' table.")
+
+    cursor.execute("PRAGMA table_info(users)")
+    if 'last_refreshed' not in [row['name'] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE users ADD COLUMN last_refreshed TEXT")
+        logger.info("Added 'last_refreshed' column to 'users' table.")
     
+    # --- Cache versions: bumped by triggers so in-memory caches notice outside edits ---
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS cache_versions (
+        name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0
+    )""")
+    cursor.execute("INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('admins', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS admins_version_{event.lower()} AFTER {event} ON admins
+        BEGIN
+            UPDATE cache_versions SET version = version + 1 WHERE name = 'admins';
+        END""")
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        broadcast_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_id INTEGER NOT NULL, progress_message_id INTEGER,
+        message_text TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'running',
+        last_user_id INTEGER NOT NULL DEFAULT 0, total INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0,
+        blocked INTEGER NOT NULL DEFAULT 0, created_at TEXT NOT NULL, finished_at TEXT
+    )""")
+
+def _migration_2_indexes(cursor: sqlite3.Cursor) -> None:
+    """Secondary indexes for the hot lookups (see HOT_QUERIES)."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders (user_id, order_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, order_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payment_proofs_order_id ON payment_proofs (order_id, proof_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_status ON users (status, user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_last_refreshed ON users (last_refreshed)")
+
+def _migration_3_services_version(cursor: sqlite3.Cursor) -> None:
+    """Cache version counter for the services table (see ServiceCatalog)."""
+    cursor.execute("INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('services', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS services_version_{event.lower()} AFTER {event} ON services
+        BEGIN
+            UPDATE cache_versions SET version = version + 1 WHERE name = 'services';
+        END""")
+
+def _migration_4_persistence(cursor: sqlite3.Cursor) -> None:
+    """Tables for SQLitePersistence (conversation states and user_data)."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS bot_conversations (
+        name TEXT NOT NULL, conversation_key TEXT NOT NULL, state INTEGER NOT NULL,
+        PRIMARY KEY (name, conversation_key)
+    )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS bot_user_data (
+        user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at TEXT NOT NULL
+    )""")
+
+def _migration_5_proof_archive(cursor: sqlite3.Cursor) -> None:
+    """Columns for duplicate receipt detection and the local proof archive."""
+    for column in ("file_unique_id", "content_hash", "archive_path", "archived_at"):
+        cursor.execute(f"ALTER TABLE payment_proofs ADD COLUMN {column} TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payment_proofs_file_unique_id ON payment_proofs (file_unique_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payment_proofs_content_hash ON payment_proofs (content_hash)")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payment_proofs_unarchived ON payment_proofs (proof_id) "
+        "WHERE archive_path IS NULL"
+    )
+
+# Currency columns on services; orders snapshot them and the rollup sums them
+ROLLUP_CURRENCIES = ("usd", "btc", "stars", "eur", "uah")
+
+def _migration_6_order_rollups(cursor: sqlite3.Cursor) -> None:
+    """Daily order/revenue rollup kept current by triggers.
+
+    orders gets a snapshot of the service prices at creation time, so later
+    price edits don't skew historical revenue, and its status now follows the
+    latest proof decision. Existing orders are backfilled before the triggers
+    are created.
+    """
+    prices = ", ".join(f"price_{c}" for c in ROLLUP_CURRENCIES)
+    for currency in ROLLUP_CURRENCIES:
+        cursor.execute(f"ALTER TABLE orders ADD COLUMN price_{currency} REAL")
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS order_daily_stats (
+        day TEXT NOT NULL, status TEXT NOT NULL, service_id INTEGER NOT NULL, payment_method TEXT NOT NULL,
+        orders INTEGER NOT NULL DEFAULT 0,
+        {", ".join(f"revenue_{c} REAL NOT NULL DEFAULT 0" for c in ROLLUP_CURRENCIES)},
+        PRIMARY KEY (day, status, service_id, payment_method)
+    )""")
+
+    # Backfill: decided proofs, price snapshots, then the rollup itself
+    latest_proof_status = ("(SELECT status FROM payment_proofs WHERE proof_id = "
+                           "(SELECT MAX(proof_id) FROM payment_proofs WHERE order_id = orders.order_id))")
+    cursor.execute(f"""
+    UPDATE orders SET status = {latest_proof_status}
+    WHERE {latest_proof_status} IN ('approved', 'rejected')""")
+    cursor.execute(f"""
+    UPDATE orders SET ({prices}) = (SELECT {prices} FROM services s WHERE s.service_id = orders.service_id)""")
+    key = ("substr(creation_date, 1, 10), COALESCE(status, 'pending_payment'), "
+           "COALESCE(service_id, 0), COALESCE(payment_method, '')")
+    cursor.execute(f"""
+    INSERT INTO order_daily_stats
+    SELECT {key}, COUNT(*), {", ".join(f"COALESCE(SUM(price_{c}), 0)" for c in ROLLUP_CURRENCIES)}
+    FROM orders GROUP BY {key}""")
+
+    def bucket(row: str) -> str:
+        return (f"day = substr({row}.creation_date, 1, 10) AND status = COALESCE({row}.status, 'pending_payment') "
+                f"AND service_id = COALESCE({row}.service_id, 0) AND payment_method = COALESCE({row}.payment_method, '')")
+
+    def add(row: str) -> str:
+        return f"""
+            INSERT INTO order_daily_stats
+            SELECT substr(creation_date, 1, 10), COALESCE(status, 'pending_payment'), COALESCE(service_id, 0),
+                   COALESCE(payment_method, ''), 1, {", ".join(f"COALESCE(price_{c}, 0)" for c in ROLLUP_CURRENCIES)}
+            FROM orders WHERE order_id = {row}.order_id
+            ON CONFLICT (day, status, service_id, payment_method) DO UPDATE SET orders = orders + 1,
+                {", ".join(f"revenue_{c} = revenue_{c} + excluded.revenue_{c}" for c in ROLLUP_CURRENCIES)};"""
+
+    def subtract(row: str) -> str:
+        return f"""
+            UPDATE order_daily_stats SET orders = orders - 1,
+                {", ".join(f"revenue_{c} = revenue_{c} - COALESCE({row}.price_{c}, 0)" for c in ROLLUP_CURRENCIES)}
+            WHERE {bucket(row)};
+            DELETE FROM order_daily_stats WHERE {bucket(row)} AND orders <= 0;"""
+
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS orders_rollup_insert AFTER INSERT ON orders
+    BEGIN
+        UPDATE orders SET ({prices}) = (SELECT {prices} FROM services WHERE service_id = NEW.service_id)
+        WHERE order_id = NEW.order_id;
+        {add("NEW")}
+    END""")
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS orders_rollup_status AFTER UPDATE OF status ON orders
+    WHEN OLD.status IS NOT NEW.status
+    BEGIN
+        {subtract("OLD")}
+        {add("NEW")}
+    END""")
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS orders_rollup_delete AFTER DELETE ON orders
+    BEGIN
+        {subtract("OLD")}
+    END""")
+    # The admin's decision on the latest proof is the order's status
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS payment_proofs_order_status AFTER UPDATE OF status ON payment_proofs
+    WHEN NEW.status IN ('approved', 'rejected')
+    BEGIN
+        UPDATE orders SET status = NEW.status WHERE order_id = NEW.order_id;
+    END""")
+
+def _migration_7_shared_order_store(cursor: sqlite3.Cursor) -> None:
+    """Web orders and their change feed, shared with server.py (see storage.py)."""
+    storage.create_schema(cursor)
+
+def _migration_8_admin_notifications(cursor: sqlite3.Cursor) -> None:
+    """Each admin's copy of a proof notification, for finalizing all copies at once."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS admin_notifications (
+        notification_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL, admin_id INTEGER NOT NULL, message_id INTEGER NOT NULL,
+        caption TEXT NOT NULL, created_at TEXT NOT NULL
+    )""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_admin_notifications_order_id ON admin_notifications (order_id)")
+
+def _migration_9_proof_archive_retries(cursor: sqlite3.Cursor) -> None:
+    """Failed archive attempts per proof, so the sweep backs off instead of retrying them first forever."""
+    cursor.execute("ALTER TABLE payment_proofs ADD COLUMN archive_attempts INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE payment_proofs ADD COLUMN archive_error TEXT")
+    cursor.execute("ALTER TABLE payment_proofs ADD COLUMN archive_retry_at TEXT")
+
+# Append new migrations here; never edit one that has already shipped.
+MIGRATIONS = [
+    (1, _migration_1_base_schema),
+    (2, _migration_2_indexes),
+    (3, _migration_3_services_version),
+    (4, _migration_4_persistence),
+    (5, _migration_5_proof_archive),
+    (6, _migration_6_order_rollups),
+    (7, _migration_7_shared_order_store),
+    (8, _migration_8_admin_notifications),
+    (9, _migration_9_proof_archive_retries),
+]
+
+# (description, query, params, index the plan must use); checked by tests/test_query_plans.py
+HOT_QUERIES = [
+    ("my_account orders",
+     "SELECT o.order_id, o.status, s.name FROM orders o JOIN services s ON o.service_id = s.service_id "
+     "WHERE o.user_id = ? ORDER BY o.order_id DESC", (0,), "idx_orders_user_id"),
+    ("latest proof of an order",
+     "SELECT MAX(proof_id) FROM payment_proofs WHERE order_id = ?", (0,), "idx_payment_proofs_order_id"),
+    ("duplicate receipt",
+     "SELECT DISTINCT order_id FROM payment_proofs WHERE file_unique_id = ? AND order_id != ?",
+     ("", 0), "idx_payment_proofs_file_unique_id"),
+    ("stats by day",
+     "SELECT day, status, SUM(orders) FROM order_daily_stats WHERE day >= ? GROUP BY day, status",
+     ("",), "sqlite_autoindex_order_daily_stats_1"),
+    ("broadcast recipients",
+     "SELECT user_id FROM users WHERE status = 'active' AND user_id > ? ORDER BY user_id LIMIT ?",
+     (0, 1), "idx_users_status"),
+    ("orders page by status",
+     "SELECT o.order_id FROM orders o WHERE o.status = ? AND o.order_id < ? ORDER BY o.order_id DESC LIMIT ?",
+     ("", 0, 1), "idx_orders_status"),
+    ("stale profiles",
+     "SELECT user_id FROM users WHERE last_refreshed IS NULL OR last_refreshed < ? "
+     "ORDER BY last_refreshed LIMIT ?", ("", 1), "idx_users_last_refreshed"),
+    ("proofs to archive",
+     "SELECT proof_id FROM payment_proofs WHERE archive_path IS NULL AND archive_attempts < ? "
+     "AND (archive_retry_at IS NULL OR archive_retry_at <= ?) ORDER BY proof_id LIMIT ?",
+     (1, "", 1), "idx_payment_proofs_unarchived"),
+]
+
+def _seed_defaults(conn: sqlite3.Connection, initial_admin_id: int) -> None:
+    cursor = conn.cursor()
     cursor.execute("SELECT COUNT(*) FROM admins")
     if cursor.fetchone()[0] == 0 and initial_admin_id:
         cursor.execute("INSERT OR IGNORE INTO users (user_id, first_name, join_date) VALUES (?, ?, ?)",
@@ -139,8 +672,6 @@ CREATE TABLE IF NOT EXISTS payment_proofs (
         ]
         cursor.executemany("INSERT INTO services (name, description, price_usd, price_btc, price_stars, price_eur, price_uah, is_active) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", services_data)
         logger.info("Default services have been added.")
-    conn.commit()
-    conn.close()
 
 # --- Configuration & Constants ---
 INITIAL_ADMIN_ID = 7498691085  # !!! ЗАМЕНИТЕ НА ВАШ TELEGRAM ID !!!
@@ -150,7 +681,18 @@ PAYMENT_WALLET_USD = "UQCKtm0RoDtPCyObq18G-FKehsDPaVIiVX5Z8q78P_XfmTUh"
 PAYMENT_WALLET_BTC = "1DSxcGNMgtGE6i6ZALVn4g9kqc9F2ABtSp"
 PAYMENT_WALLET_EUR = "NOT ADDED YET"
 PAYMENT_WALLET_UAH = "4149 6090 1876 9549"
-ADMIN_CHAT_ID = INITIAL_ADMIN_ID
+
+# --- Update Delivery ---
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # "polling" or "webhook"
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+TELEGRAM_FILE_URL = os.getenv("TELEGRAM_FILE_URL", "https://api.telegram.org/file/bot")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # public base URL, e.g. https://example.onrender.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_MAX_BACKLOG = int(os.getenv("WEBHOOK_MAX_BACKLOG", "1000"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
 
 # --- НОВЫЕ СТАТУСЫ ДЛЯ ОБРАБОТЧИКА РАЗГОВОРА ---
 (STATE_MAIN_MENU, STATE_SELECTING_SERVICE, STATE_SELECTING_PAYMENT, STATE_UPLOADING_PROOF, 
@@ -159,13 +701,145 @@ ADMIN_CHAT_ID = INITIAL_ADMIN_ID
  STATE_ADMIN_EDIT_SERVICE_SELECT, STATE_ADMIN_EDIT_SERVICE_DATA, STATE_ADMIN_REJECT_PROOF) = range(14)
 
 
+CACHE_CHECK_INTERVAL = 15  # seconds between cache version checks
+
+
+# --- Admin Cache ---
+class AdminCache:
+    """In-memory set of admin IDs.
+
+    Loaded at startup and updated directly by the add/remove handlers. Every
+    change to the admins table bumps cache_versions.admins through a trigger,
+    so a periodic one-row version check picks up edits made outside the bot.
+    """
+
+    def __init__(self):
+        self._ids = frozenset()
+        self._version = None
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._ids
+
+    @property
+    def ids(self) -> frozenset:
+        return self._ids
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        """Reloads the admin set from the database."""
+        version = conn.execute("SELECT version FROM cache_versions WHERE name = 'admins'").fetchone()
+        rows = conn.execute("SELECT user_id FROM admins").fetchall()
+        self._ids = frozenset(row['user_id'] for row in rows)
+        self._version = version['version'] if version else None
+
+    async def refresh_if_changed(self) -> None:
+        """Reloads the admin set only if the admins table changed."""
+        row = await db.fetchone("SELECT version FROM cache_versions WHERE name = 'admins'")
+        if row is not None and row['version'] != self._version:
+            await db.read(self.load)
+            logger.info(f"Admin cache reloaded ({len(self._ids)} admins).")
+
+    def add(self, user_id: int) -> None:
+        self._ids = self._ids | {user_id}
+
+    def discard(self, user_id: int) -> None:
+        self._ids = self._ids - {user_id}
+
+
+admin_cache = AdminCache()
+
+
+# --- Service Catalog Cache ---
+class ServiceCatalog:
+    """Pre-rendered price list and service-selection keyboards.
+
+    Built from the active rows of `services` and rebuilt only after the
+    admin add/delete/toggle handlers call invalidate(), or when the
+    cache_versions.services counter (bumped by triggers) shows that the
+    table was changed from outside the bot.
+    """
+
+    def __init__(self):
+        self.price_list_text = ""
+        self.order_keyboard = None
+        self._services = {}
+        self._version = None
+        self._stale = True
+
+    @staticmethod
+    def _render_service(service: sqlite3.Row) -> dict:
+        def price(column: str, fmt: str = "") -> str:
+            value = service[column]
+            return escape_markdown(format(value, fmt), version=2) if value is not None else "N/A"
+
+        prices = {
+            'usd': price('price_usd', '.2f'), 'btc': price('price_btc', '.5f'),
+            'stars': price('price_stars'), 'eur': price('price_eur', '.2f'),
+            'uah': price('price_uah', '.2f'),
+        }
+        name = escape_markdown(service['name'], version=2)
+        description = escape_markdown(service['description'] or "", version=2)
+        price_list_entry = (f"🔹 *{name}*\\: _{description}_\n"
+                            f"   💵 USD: `{prices['usd']}`\n"
+                            f"   ₿ BTC: `{prices['btc']}`\n"
+                            f"   ⭐️ STARS: `{prices['stars']}`\n"
+                            f"   💶 EUR: `{prices['eur']}`\n"
+                            f"   ₴ UAH: `{prices['uah']}`\n\n")
+        selection_text = (f"Вы выбрали услугу: *{name}*\n\n"
+                          f"Цена:\n"
+                          f"💵 USD: `{prices['usd']}`\n"
+                          f"₿ BTC: `{prices['btc']}`\n"
+                          f"⭐️ STARS: `{prices['stars']}`\n"
+                          f"💶 EUR: `{prices['eur']}`\n"
+                          f"₴ UAH: `{prices['uah']}`\n\n"
+                          "Выберите способ оплаты:")
+        return {'name': service['name'], 'price_list_entry': price_list_entry, 'selection_text': selection_text}
+
+    def build(self, conn: sqlite3.Connection) -> None:
+        """Re-renders everything from the database."""
+        version = conn.execute("SELECT version FROM cache_versions WHERE name = 'services'").fetchone()
+        rows = conn.execute("SELECT * FROM services WHERE is_active = 1 ORDER BY service_id").fetchall()
+        services = {row['service_id']: self._render_service(row) for row in rows}
+
+        keyboard = [[InlineKeyboardButton(service['name'], callback_data=f"select_service_{service_id}")]
+                    for service_id, service in services.items()]
+        keyboard.append([InlineKeyboardButton("⬅️ Отмена", callback_data="cancel_order")])
+
+        self.price_list_text = "*📋 НАШ ПРАЙС\\-ЛИСТ 📋*\n\n" + "".join(
+            service['price_list_entry'] for service in services.values()
+        )
+        self.order_keyboard = InlineKeyboardMarkup(keyboard)
+        self._services = services
+        self._version = version['version'] if version else None
+        self._stale = False
+
+    async def ensure_fresh(self) -> None:
+        if self._stale:
+            await db.read(self.build)
+
+    async def refresh_if_changed(self) -> None:
+        """Marks the catalog stale if the services table changed."""
+        row = await db.fetchone("SELECT version FROM cache_versions WHERE name = 'services'")
+        if row is not None and row['version'] != self._version:
+            self.invalidate()
+
+    def invalidate(self) -> None:
+        self._stale = True
+
+    def get(self, service_id: int) -> Union[dict, None]:
+        return self._services.get(service_id)
+
+
+service_catalog = ServiceCatalog()
+
+async def refresh_caches() -> None:
+    """Picks up admin and service changes made outside the bot."""
+    await admin_cache.refresh_if_changed()
+    await service_catalog.refresh_if_changed()
+
 # --- Helper Functions ---
-async def is_admin(user_id: int) -> bool:
-    """Checks if a user is an administrator by querying the database."""
-    conn = get_db_connection()
-    admin = conn.execute("SELECT 1 FROM admins WHERE user_id = ?", (user_id,)).fetchone()
-    conn.close()
-    return admin is not None
+def is_admin(user_id: int) -> bool:
+    """Checks if a user is an administrator using the in-memory admin cache."""
+    return user_id in admin_cache
 
 def get_user_mention(user: Union[Update.effective_user, sqlite3.Row]) -> str:
     """Creates a MarkdownV2 mention for a user, handling both Telegram User objects and database rows."""
@@ -178,18 +852,193 @@ def get_user_mention(user: Union[Update.effective_user, sqlite3.Row]) -> str:
         safe_name = escape_markdown(user['first_name'] or str(user['user_id']), version=2)
         return f"[{safe_name}](tg://user?id={user['user_id']})"
 
+# --- Admin Notifications ---
+class AdminFilter(filters.MessageFilter):
+    """Matches messages sent by any current admin (follows admin_cache, unlike filters.User)."""
+
+    def filter(self, message) -> bool:
+        return message.from_user is not None and message.from_user.id in admin_cache
+
+
+async def notify_admins(send) -> dict:
+    """Runs send(admin_id) for every admin concurrently.
+
+    A failure for one admin (blocked bot, deleted chat) is logged and does
+    not affect the others. Returns {admin_id: result} for the deliveries
+    that succeeded.
+    """
+    admin_ids = sorted(admin_cache.ids)
+    results = await asyncio.gather(*(send(admin_id) for admin_id in admin_ids), return_exceptions=True)
+    delivered = {}
+    for admin_id, result in zip(admin_ids, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Failed to notify admin {admin_id}: {result}")
+        else:
+            delivered[admin_id] = result
+    return delivered
+
+
+# Telegram's caption limit; MarkdownV2 source is at least as long as the text it renders
+CAPTION_MAX_LENGTH = 1024
+REJECT_REASON_MAX_LENGTH = 1000  # keeps the reason within one message after escaping
+
+
+async def record_proof_notifications(order_id: int, caption: str, delivered: dict) -> None:
+    """Remembers every admin's copy of a proof notification so it can be finalized later."""
+    now = datetime.datetime.now().isoformat()
+    await db.executemany(
+        "INSERT INTO admin_notifications (order_id, admin_id, message_id, caption, created_at) VALUES (?, ?, ?, ?, ?)",
+        [(order_id, admin_id, message.message_id, caption, now) for admin_id, message in delivered.items()]
+    )
+
+
+async def decide_proof(order_id: int, status: str, admin_comment: str = None) -> bool:
+    """Sets the decision on the order's latest proof; False if an admin already decided."""
+    cursor = await db.execute(
+        "UPDATE payment_proofs SET status = ?, admin_comment = COALESCE(?, admin_comment) "
+        "WHERE proof_id = (SELECT MAX(proof_id) FROM payment_proofs WHERE order_id = ?) AND status = 'uploaded'",
+        (status, admin_comment, order_id)
+    )
+    return cursor.rowcount > 0
+
+
+async def finalize_proof_notifications(bot, order_id: int, result_text: str, fallback_message=None) -> None:
+    """Replaces the buttons on every admin's copy with the final decision.
+
+    `fallback_message` is the copy the deciding admin clicked; it is edited
+    directly when no copies were recorded (notifications sent before copies
+    were tracked). When the decision doesn't fit into the caption, only the
+    buttons are removed and the decision is sent as a reply to the copy.
+    """
+    copies = await db.fetchall(
+        "SELECT admin_id, message_id, caption FROM admin_notifications WHERE order_id = ?", (order_id,)
+    )
+
+    async def edit(chat_id: int, message_id: int, caption: str) -> None:
+        caption = f"{caption}\n\n{result_text}"
+        if len(caption) <= CAPTION_MAX_LENGTH:
+            await bot.edit_message_caption(
+                chat_id=chat_id, message_id=message_id, caption=caption,
+                parse_mode='MarkdownV2', reply_markup=None, rate_limit_args=OUTBOUND_ADMIN_ALERT
+            )
+            return
+        await bot.edit_message_reply_markup(
+            chat_id=chat_id, message_id=message_id, reply_markup=None, rate_limit_args=OUTBOUND_ADMIN_ALERT
+        )
+        await bot.send_message(
+            chat_id=chat_id, text=result_text, parse_mode='MarkdownV2',
+            reply_to_message_id=message_id, rate_limit_args=OUTBOUND_ADMIN_ALERT
+        )
+
+    edits = [edit(row['admin_id'], row['message_id'], row['caption']) for row in copies]
+    if not copies and fallback_message is not None and fallback_message.caption:
+        edits.append(edit(fallback_message.chat_id, fallback_message.message_id,
+                          fallback_message.caption_markdown_v2))
+    for result in await asyncio.gather(*edits, return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not update an admin's copy of order {order_id}: {result}")
+
+# --- Profile Refresh ---
+PROFILE_REFRESH_INTERVAL = 600     # seconds between background sweeps
+PROFILE_STALE_AFTER = datetime.timedelta(days=7)
+PROFILE_REFRESH_BATCH = 100        # stale profiles fetched per sweep
+PROFILE_REFRESH_CONCURRENCY = 5    # get_chat calls in flight at once
+PROFILE_FLUSH_INTERVAL = 30        # seconds between writes of observed profiles
+
+
+class ProfileRefresher:
+    """Keeps username/first_name/last_name in `users` up to date.
+
+    Profiles seen on incoming updates are collected for free and written in
+    batches. A background sweep calls get_chat only for rows whose
+    last_refreshed is older than PROFILE_STALE_AFTER, a bounded batch at a
+    time with bounded concurrency.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._known = {}
+
+    def observe(self, user) -> None:
+        """Queues a profile seen on an incoming update if it changed."""
+        profile = (user.username, user.first_name, user.last_name)
+        if self._known.get(user.id) != profile:
+            self._pending[user.id] = profile
+
+    async def flush_observed(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        now = datetime.datetime.now().isoformat()
+        await db.executemany(
+            "UPDATE users SET username = ?, first_name = ?, last_name = ?, last_refreshed = ? WHERE user_id = ?",
+            [(*profile, now, user_id) for user_id, profile in pending.items()]
+        )
+        self._known.update(pending)
+
+    async def refresh_stale(self, bot) -> None:
+        cutoff = (datetime.datetime.now() - PROFILE_STALE_AFTER).isoformat()
+        rows = await db.fetchall(
+            "SELECT user_id FROM users WHERE last_refreshed IS NULL OR last_refreshed < ? "
+            "ORDER BY last_refreshed LIMIT ?",
+            (cutoff, PROFILE_REFRESH_BATCH)
+        )
+        if not rows:
+            return
+
+        semaphore = asyncio.Semaphore(PROFILE_REFRESH_CONCURRENCY)
+        flood_wait = asyncio.Event()
+
+        async def fetch(user_id: int):
+            async with semaphore:
+                if flood_wait.is_set():
+                    return None
+                try:
+                    chat = await bot.get_chat(user_id, rate_limit_args=OUTBOUND_BULK)
+                    return (chat.username, chat.first_name, chat.last_name)
+                except telegram.error.RetryAfter as e:
+                    logger.warning(f"Profile refresh hit flood control, retry in {retry_after_seconds(e)}s")
+                    flood_wait.set()
+                    return None
+                except telegram.error.TelegramError as e:
+                    # Unreachable chats are marked as refreshed so they are not retried every sweep
+                    logger.debug(f"Не удалось обновить данные пользователя {user_id}: {e}")
+                    return False
+
+        user_ids = [row['user_id'] for row in rows]
+        results = await asyncio.gather(*(fetch(user_id) for user_id in user_ids))
+        now = datetime.datetime.now().isoformat()
+        updated = [(*profile, now, user_id) for user_id, profile in zip(user_ids, results) if profile]
+        unreachable = [(now, user_id) for user_id, profile in zip(user_ids, results) if profile is False]
+
+        def write(conn: sqlite3.Connection) -> None:
+            conn.executemany(
+                "UPDATE users SET username = ?, first_name = ?, last_name = ?, last_refreshed = ? WHERE user_id = ?",
+                updated
+            )
+            conn.executemany("UPDATE users SET last_refreshed = ? WHERE user_id = ?", unreachable)
+
+        await db.write(write)
+        logger.info(f"🔄 Profiles refreshed: {len(updated)} updated, {len(unreachable)} unreachable.")
+
+
+profile_refresher = ProfileRefresher()
+
+async def observe_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Records the sender's profile from every incoming update."""
+    if update.effective_user:
+        profile_refresher.observe(update.effective_user)
+
 # --- Core User Handlers (start, price list, my account) ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles /start, registers the user, and shows the main menu with a banner."""
     user = update.effective_user
-    conn = get_db_connection()
-    if conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user.id,)).fetchone() is None:
-        conn.execute(
-            "INSERT INTO users (user_id, username, first_name, last_name, join_date) VALUES (?, ?, ?, ?, ?)",
-            (user.id, user.username, user.first_name, user.last_name, datetime.datetime.now().isoformat())
-        )
-        conn.commit()
-    conn.close()
+    now = datetime.datetime.now().isoformat()
+    await db.execute(
+        "INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, join_date, last_refreshed) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (user.id, user.username, user.first_name, user.last_name, now, now)
+    )
     
     # --- БАННЕР ---
     safe_first_name = escape_markdown(user.first_name, version=2)
@@ -206,7 +1055,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         [InlineKeyboardButton("👤 Мой кабинет", callback_data="my_account")],
         [InlineKeyboardButton("💬 Связаться с админом", callback_data="contact_admin")],
     ]
-    if await is_admin(user.id):
+    if is_admin(user.id):
         keyboard.append([InlineKeyboardButton("👑 Админ-панель", callback_data="admin_panel")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -220,64 +1069,15 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def price_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
-    conn = get_db_connection()
-    services = conn.execute("SELECT * FROM services WHERE is_active = 1").fetchall()
-    conn.close()
-    message_text = "*📋 НАШ ПРАЙС\\-ЛИСТ 📋*\n\n"
-    for service in services:
-        name = escape_markdown(service['name'], version=2)
-        description = escape_markdown(service['description'], version=2)
-        price_usd = escape_markdown(f"{service['price_usd']:.2f}", version=2)
-        price_btc = escape_markdown(f"{service['price_btc']:.5f}", version=2)
-        price_stars = escape_markdown(str(service['price_stars']), version=2)
-        
-        # Check if EUR and UAH prices exist before trying to access them
-        try:
-            price_eur = escape_markdown(f"{service['price_eur']:.2f}", version=2)
-            price_uah = escape_markdown(f"{service['price_uah']:.2f}", version=2)
-        except (KeyError, TypeError):
-            price_eur = "N/A"
-            price_uah = "N/A"
-
-        message_text += (f"🔹 *{name}*\\: _{description}_\n"
-                         f"   💵 USD: `{price_usd}`\n"
-                         f"   ₿ BTC: `{price_btc}`\n"
-                         f"   ⭐️ STARS: `{price_stars}`\n"
-                         f"   💶 EUR: `{price_eur}`\n"
-                         f"   ₴ UAH: `{price_uah}`\n\n")
-
+    await service_catalog.ensure_fresh()
     keyboard = [[InlineKeyboardButton("⬅️ Назад в меню", callback_data="main_menu")]]
-    await query.edit_message_text(text=message_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='MarkdownV2')
-async def update_all_usernames(application: Application) -> None:
-    """Обновляет username всех пользователей в базе при запуске бота."""
-    logger.info("🔄 Updating user information...")
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    users = cursor.execute("SELECT user_id FROM users").fetchall()
+    await query.edit_message_text(text=service_catalog.price_list_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='MarkdownV2')
 
-    updated = 0
-    for user in users:
-        user_id = user['user_id']
-        try:
-            tg_user = await application.bot.get_chat(user_id)
-            cursor.execute(
-                "UPDATE users SET username = ?, first_name = ?, last_name = ? WHERE user_id = ?",
-                (tg_user.username, tg_user.first_name, tg_user.last_name, user_id)
-            )
-            updated += 1
-        except Exception as e:
-            logger.warning(f"Не удалось обновить данные пользователя {user_id}: {e}")
-
-    conn.commit()
-    conn.close()
-    logger.info(f"Usernames обновлены для {updated} пользователей.")
 async def my_account(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     user_id = query.from_user.id
     await query.answer()
-    conn = get_db_connection()
-    orders = conn.execute("SELECT o.order_id, o.status, s.name FROM orders o JOIN services s ON o.service_id = s.service_id WHERE o.user_id = ? ORDER BY o.order_id DESC", (user_id,)).fetchall()
-    conn.close()
+    orders = await db.fetchall("SELECT o.order_id, o.status, s.name FROM orders o JOIN services s ON o.service_id = s.service_id WHERE o.user_id = ? ORDER BY o.order_id DESC", (user_id,))
     message_text = "*👤 ВАШИ ЗАКАЗЫ 👤*\n\n"
     if not orders:
         message_text += "_У вас пока нет заказов\\._"
@@ -300,19 +1100,21 @@ async def cancel_flow(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     return ConversationHandler.END
 
 # --- ORDERING FLOW HANDLERS ---
+PAYMENT_METHOD_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💵 USD", callback_data="pay_usd")],
+    [InlineKeyboardButton("₿ BTC", callback_data="pay_btc")],
+    [InlineKeyboardButton("⭐️ TG Stars", callback_data="pay_stars")],
+    [InlineKeyboardButton("💶 EUR", callback_data="pay_eur")],
+    [InlineKeyboardButton("₴ UAH", callback_data="pay_uah")],
+    [InlineKeyboardButton("⬅️ Отмена", callback_data="cancel_order")]
+])
+
 async def order_service_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the ordering process by showing a list of services."""
     query = update.callback_query
     await query.answer()
-    conn = get_db_connection()
-    services = conn.execute("SELECT * FROM services WHERE is_active = 1").fetchall()
-    conn.close()
-    
-    keyboard = [[InlineKeyboardButton(service['name'], callback_data=f"select_service_{service['service_id']}")] for service in services]
-    keyboard.append([InlineKeyboardButton("⬅️ Отмена", callback_data="cancel_order")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text("Выберите услугу, которую хотите заказать:", reply_markup=reply_markup)
+    await service_catalog.ensure_fresh()
+    await query.edit_message_text("Выберите услугу, которую хотите заказать:", reply_markup=service_catalog.order_keyboard)
     return STATE_SELECTING_SERVICE
 
 async def select_service(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -321,34 +1123,16 @@ async def select_service(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await query.answer()
     
     service_id = int(query.data.split('_')[-1])
-    context.user_data['service_id'] = service_id
-    
-    conn = get_db_connection()
-    service = conn.execute("SELECT name, price_usd, price_btc, price_stars, price_eur, price_uah FROM services WHERE service_id = ?", (service_id,)).fetchone()
-    conn.close()
+    await service_catalog.ensure_fresh()
+    service = service_catalog.get(service_id)
+    if service is None:
+        await query.edit_message_text("Эта услуга больше недоступна. Выберите другую:", reply_markup=service_catalog.order_keyboard)
+        return STATE_SELECTING_SERVICE
 
+    context.user_data['service_id'] = service_id
     context.user_data['service_name'] = service['name']
-    
-    message_text = (f"Вы выбрали услугу: *{escape_markdown(service['name'], version=2)}*\n\n"
-                    f"Цена:\n"
-                    f"💵 USD: `{escape_markdown(f'{service['price_usd']:.2f}', version=2)}`\n"
-                    f"₿ BTC: `{escape_markdown(f'{service['price_btc']:.5f}', version=2)}`\n"
-                    f"⭐️ STARS: `{escape_markdown(str(service['price_stars']), version=2)}`\n"
-                    f"💶 EUR: `{escape_markdown(f'{service['price_eur']:.2f}', version=2)}`\n"
-                    f"₴ UAH: `{escape_markdown(f'{service['price_uah']:.2f}', version=2)}`\n\n"
-                    "Выберите способ оплаты:")
 
-    keyboard = [
-        [InlineKeyboardButton("💵 USD", callback_data="pay_usd")],
-        [InlineKeyboardButton("₿ BTC", callback_data="pay_btc")],
-        [InlineKeyboardButton("⭐️ TG Stars", callback_data="pay_stars")],
-        [InlineKeyboardButton("💶 EUR", callback_data="pay_eur")],
-        [InlineKeyboardButton("₴ UAH", callback_data="pay_uah")],
-        [InlineKeyboardButton("⬅️ Отмена", callback_data="cancel_order")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(message_text, reply_markup=reply_markup, parse_mode='MarkdownV2')
+    await query.edit_message_text(service['selection_text'], reply_markup=PAYMENT_METHOD_KEYBOARD, parse_mode='MarkdownV2')
     return STATE_SELECTING_PAYMENT
 
 async def select_payment(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -401,28 +1185,37 @@ async def upload_payment_proof(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text("📎 Пришлите фото или документ (pdf, скриншот) с чеком.")
         return STATE_UPLOADING_PROOF
         
-    file_id, file_type = None, None
+    file_id, file_unique_id, file_type = None, None, None
     if update.message.photo:
         file_id = update.message.photo[-1].file_id
+        file_unique_id = update.message.photo[-1].file_unique_id
         file_type = "photo"
     elif update.message.document:
         file_id = update.message.document.file_id
+        file_unique_id = update.message.document.file_unique_id
         file_type = update.message.document.mime_type
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO orders (user_id, service_id, payment_method, creation_date) VALUES (?, ?, ?, ?)",
-        (user.id, service_id, payment_method, datetime.datetime.now().isoformat())
-    )
-    new_order_id = cursor.lastrowid
-    
-    cursor.execute(
-        "INSERT INTO payment_proofs (order_id, file_id, file_type, upload_date) VALUES (?, ?, ?, ?)",
-        (new_order_id, file_id, file_type, datetime.datetime.now().isoformat())
-    )
-    conn.commit()
-    conn.close()
+    def create_order(conn: sqlite3.Connection) -> tuple:
+        now = datetime.datetime.now().isoformat()
+        cursor = conn.execute(
+            "INSERT INTO orders (user_id, service_id, payment_method, creation_date) VALUES (?, ?, ?, ?)",
+            (user.id, service_id, payment_method, now)
+        )
+        order_id = cursor.lastrowid
+        # The same Telegram file sent again keeps its file_unique_id
+        duplicates = [row['order_id'] for row in conn.execute(
+            "SELECT DISTINCT order_id FROM payment_proofs WHERE file_unique_id = ? AND order_id != ?",
+            (file_unique_id, order_id)
+        )]
+        cursor = conn.execute(
+            "INSERT INTO payment_proofs (order_id, file_id, file_unique_id, file_type, upload_date) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (order_id, file_id, file_unique_id, file_type, now)
+        )
+        return order_id, cursor.lastrowid, duplicates
+
+    new_order_id, proof_id, duplicate_orders = await db.write(create_order)
+    proof_archiver.schedule(context.bot, proof_id)
 
     await update.message.reply_text(
         f"Ваш заказ \\#{new_order_id} на услугу '{escape_markdown(service_name, version=2)}' принят\\.\n"
@@ -435,6 +1228,9 @@ async def upload_payment_proof(update: Update, context: ContextTypes.DEFAULT_TYP
                           f"🔹 Услуга: _{escape_markdown(service_name, version=2)}_\n"
                           f"💸 Метод оплаты: *{payment_method.upper()}*\n\n"
                           "Ожидает подтверждения\\.")
+    if duplicate_orders:
+        orders = ", ".join(f"\\#{order_id}" for order_id in duplicate_orders)
+        admin_message_text += f"\n\n⚠️ *Этот чек уже присылали к заказу {orders}\\!*"
                           
     keyboard = [[
         InlineKeyboardButton("✅ Одобрить", callback_data=f"approve_proof_{new_order_id}"),
@@ -442,46 +1238,52 @@ async def upload_payment_proof(update: Update, context: ContextTypes.DEFAULT_TYP
     ]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    if file_type == "photo":
-        await context.bot.send_photo(
-            chat_id=ADMIN_CHAT_ID,
-            photo=file_id,
-            caption=admin_message_text,
-            reply_markup=reply_markup,
-            parse_mode='MarkdownV2'
-        )
-    else:
-        await context.bot.send_document(
-            chat_id=ADMIN_CHAT_ID,
+    async def send_proof(admin_id: int):
+        if file_type == "photo":
+            return await context.bot.send_photo(
+                chat_id=admin_id,
+                photo=file_id,
+                caption=admin_message_text,
+                reply_markup=reply_markup,
+                parse_mode='MarkdownV2',
+                rate_limit_args=OUTBOUND_ADMIN_ALERT
+            )
+        return await context.bot.send_document(
+            chat_id=admin_id,
             document=file_id,
             caption=admin_message_text,
             reply_markup=reply_markup,
-            parse_mode='MarkdownV2'
+            parse_mode='MarkdownV2',
+            rate_limit_args=OUTBOUND_ADMIN_ALERT
         )
+
+    async def alert_admins() -> None:
+        delivered = await notify_admins(send_proof)
+        await record_proof_notifications(new_order_id, admin_message_text, delivered)
+
+    # Admin chats are limited to about one message per second, so the alert
+    # must not hold up the processing of other users' updates
+    context.application.create_task(alert_admins(), update=update)
     
     context.user_data.clear()
     return ConversationHandler.END
 
 async def admin_handle_proof(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Approves an order's proof from any admin's copy of the notification."""
     query = update.callback_query
-    await query.answer()
-
-    action, _, order_id = query.data.partition("_proof_")
-    order_id = int(order_id)
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    status = "approved" if action == "approve" else "rejected"
-    cursor.execute(
-        "UPDATE payment_proofs SET status = ? WHERE order_id = ? ORDER BY proof_id DESC LIMIT 1",
-        (status, order_id)
+    if not is_admin(query.from_user.id):
+        await query.answer("Access Denied.", show_alert=True)
+        return
+    order_id = int(query.data.rsplit("_", 1)[-1])
+
+    if not await decide_proof(order_id, "approved"):
+        await query.answer("Этот заказ уже обработан другим администратором.", show_alert=True)
+        return
+    await query.answer("✅ Одобрено")
+    await finalize_proof_notifications(
+        context.bot, order_id, f"✅ *Чек одобрен* — {get_user_mention(query.from_user)}", query.message
     )
-    conn.commit()
-    conn.close()
 
-    result_text = "✅ Чек одобрен" if status == "approved" else "❌ Чек отклонён"
-    await query.edit_message_caption(query.message.caption + f"\n\n{result_text}")
 # --- HANDLERS FOR CHAT WITH ADMIN ---
 async def start_admin_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Начинает диалог пользователя с администратором."""
@@ -503,30 +1305,35 @@ async def handle_user_to_admin_message(update: Update, context: ContextTypes.DEF
     """Перенаправляет сообщения от пользователя администратору."""
     user = update.effective_user
     
-    # Сначала пытаемся переслать сообщение. Это главное действие.
-    try:
-        await update.message.forward(chat_id=ADMIN_CHAT_ID)
-    except telegram.error.TelegramError as e:
-        logger.error(f"Failed to forward user message to admin: {e}")
+    # Пересылаем сообщение всем администраторам одновременно; сбой у одного не мешает остальным.
+    async def deliver(admin_id: int) -> None:
+        await context.bot.forward_message(
+            chat_id=admin_id,
+            from_chat_id=update.message.chat_id,
+            message_id=update.message.message_id,
+            rate_limit_args=OUTBOUND_ADMIN_ALERT
+        )
+        # Если Markdown не сработает, пробуем отправить простое сообщение.
+        try:
+            admin_mention_text = f"⬆️ _Сообщение от пользователя {get_user_mention(user)}._"
+            await context.bot.send_message(
+                chat_id=admin_id,
+                text=admin_mention_text,
+                parse_mode='MarkdownV2',
+                rate_limit_args=OUTBOUND_ADMIN_ALERT
+            )
+        except telegram.error.TelegramError as e:
+            logger.warning(f"Failed to send Markdown mention to admin {admin_id}: {e}. Sending without mention.")
+            await context.bot.send_message(
+                chat_id=admin_id,
+                text=f"⬆️ _Сообщение от пользователя {user.first_name} (ID: {user.id})_.",
+                rate_limit_args=OUTBOUND_ADMIN_ALERT
+            )
+
+    if not await notify_admins(deliver):
         await update.message.reply_text("❌ Произошла ошибка при пересылке вашего сообщения. Пожалуйста, попробуйте позже.")
         return STATE_USER_TO_ADMIN_CHAT
 
-    # Если пересылка удалась, отправляем уведомление администратору.
-    # Если Markdown не сработает, пробуем отправить простое сообщение.
-    try:
-        admin_mention_text = f"⬆️ _Сообщение от пользователя {get_user_mention(user)}._"
-        await context.bot.send_message(
-            chat_id=ADMIN_CHAT_ID,
-            text=admin_mention_text,
-            parse_mode='MarkdownV2'
-        )
-    except telegram.error.TelegramError as e:
-        logger.warning(f"Failed to send Markdown mention to admin: {e}. Sending without mention.")
-        await context.bot.send_message(
-            chat_id=ADMIN_CHAT_ID,
-            text=f"⬆️ _Сообщение от пользователя {user.first_name} (ID: {user.id})_."
-        )
-
     # И наконец, отправляем пользователю подтверждение, что всё в порядке.
     try:
         await update.message.reply_text("✅ Ваше сообщение отправлено администратору. Ожидайте ответа.")
@@ -557,7 +1364,7 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Displays the main admin control panel."""
     query = update.callback_query
-    if not await is_admin(query.from_user.id):
+    if not is_admin(query.from_user.id):
         await query.answer("Access Denied.", show_alert=True)
         return STATE_MAIN_MENU
 
@@ -566,6 +1373,7 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         [InlineKeyboardButton("📊 Статистика", callback_data="admin_stats")],
         [InlineKeyboardButton("👥 Пользователи", callback_data="admin_users_list")],
         [InlineKeyboardButton("📦 Все Заказы", callback_data="admin_orders_list")],
+        [InlineKeyboardButton("🌐 Заказы с сайта", callback_data="admin_web_orders_list")],
         [InlineKeyboardButton("🛠️ Управление Админами", callback_data="admin_manage_admins")],
         [InlineKeyboardButton("🔧 Управление услугами", callback_data="admin_manage_services")],
         [InlineKeyboardButton("📢 Рассылка", callback_data="admin_broadcast_start")],
@@ -575,95 +1383,280 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     await query.edit_message_text("👑 *Админ\\-панель*", reply_markup=reply_markup, parse_mode='MarkdownV2')
     return STATE_MAIN_MENU
 
+STATS_PERIODS = ((1, "Сегодня"), (7, "7 дней"), (30, "30 дней"))
+STATS_TREND_DAYS = 7
+STATS_TOP_SERVICES = 5
+
+def _format_amount(value: float, currency: str) -> str:
+    if currency == 'stars':
+        amount = str(int(value))
+    elif currency == 'btc':
+        amount = f"{value:.8f}".rstrip('0').rstrip('.')
+    else:
+        amount = format(value, '.2f')
+    return escape_markdown(f"{amount} {currency.upper()}", version=2)
+
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Displays bot statistics."""
+    """Displays bot statistics from the order_daily_stats rollup."""
     query = update.callback_query
     await query.answer()
-    conn = get_db_connection()
-    user_count = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
-    order_count = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
-    conn.close()
-    
-    text = (f"📊 *Статистика Бота*\n\n"
-            f"👥 Всего пользователей: *{user_count}*\n"
-            f"📦 Всего заказов: *{order_count}*")
+    today = datetime.date.today()
+    since = (today - datetime.timedelta(days=max(days for days, _ in STATS_PERIODS) - 1)).isoformat()
+    revenue_columns = ", ".join(f"SUM(revenue_{c}) AS revenue_{c}" for c in ROLLUP_CURRENCIES)
+
+    user_count = (await db.fetchone("SELECT COUNT(*) FROM users"))[0]
+    order_count = (await db.fetchone("SELECT COALESCE(SUM(orders), 0) FROM order_daily_stats"))[0]
+    web_stats = await db.read(storage.order_stats)
+    days = await db.fetchall(
+        "SELECT day, status, SUM(orders) AS orders FROM order_daily_stats WHERE day >= ? GROUP BY day, status",
+        (since,)
+    )
+    methods = await db.fetchall(
+        f"SELECT payment_method, SUM(orders) AS orders, {revenue_columns} FROM order_daily_stats "
+        "WHERE day >= ? AND status = 'approved' GROUP BY payment_method ORDER BY orders DESC",
+        (since,)
+    )
+    services = await db.fetchall(
+        "SELECT st.service_id, s.name, SUM(st.orders) AS orders, SUM(st.revenue_usd) AS revenue_usd "
+        "FROM order_daily_stats st LEFT JOIN services s ON s.service_id = st.service_id "
+        "WHERE st.day >= ? AND st.status = 'approved' GROUP BY st.service_id ORDER BY revenue_usd DESC LIMIT ?",
+        (since, STATS_TOP_SERVICES)
+    )
+
+    lines = ["📊 *Статистика Бота*\n",
+             f"👥 Всего пользователей: *{user_count}*",
+             f"📦 Всего заказов: *{order_count}*",
+             f"🌐 Заказов с сайта: *{web_stats['total']}*, ожидают *{web_stats['pending']}*, "
+             f"выручка *{escape_markdown(format(web_stats['revenue'], '.2f'), version=2)}*\n"]
+    for period, label in STATS_PERIODS:
+        start_day = (today - datetime.timedelta(days=period - 1)).isoformat()
+        total = sum(row['orders'] for row in days if row['day'] >= start_day)
+        approved = sum(row['orders'] for row in days if row['day'] >= start_day and row['status'] == 'approved')
+        lines.append(f"🗓 {escape_markdown(label, version=2)}: заказов *{total}*, одобрено *{approved}*")
+
+    lines.append("\n📈 *По дням* \\(заказов / одобрено\\):")
+    for offset in range(STATS_TREND_DAYS - 1, -1, -1):
+        day = (today - datetime.timedelta(days=offset)).isoformat()
+        total = sum(row['orders'] for row in days if row['day'] == day)
+        approved = sum(row['orders'] for row in days if row['day'] == day and row['status'] == 'approved')
+        lines.append(f"{escape_markdown(day[5:], version=2)}: {total} / {approved}")
+
+    if methods:
+        lines.append("\n💸 *Выручка за 30 дней по способам оплаты:*")
+        for row in methods:
+            method = row['payment_method']
+            revenue = _format_amount(row[f'revenue_{method}'], method) if method in ROLLUP_CURRENCIES else "—"
+            lines.append(f"{escape_markdown(method.upper() or '?', version=2)}: {row['orders']} шт\\., {revenue}")
+    if services:
+        lines.append("\n🏆 *Топ услуг за 30 дней* \\(в USD по прайсу\\):")
+        for row in services:
+            name = escape_markdown(row['name'] or f"#{row['service_id']}", version=2)
+            lines.append(f"{name}: {row['orders']} шт\\., {_format_amount(row['revenue_usd'], 'usd')}")
+
+    text = "\n".join(lines)
     
     keyboard = [[InlineKeyboardButton("⬅️ Назад в админку", callback_data="admin_panel")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='MarkdownV2')
     return STATE_MAIN_MENU
 
+ADMIN_PAGE_SIZE = 10
+USER_STATUS_FILTERS = [("all", "Все"), ("active", "Активные"), ("inactive", "Неактивные")]
+ORDER_STATUS_FILTERS = [("all", "Все"), ("pending_payment", "Ожидают"),
+                        ("approved", "Одобрены"), ("rejected", "Отклонены")]
+WEB_ORDER_STATUS_FILTERS = [("all", "Все"), ("pending", "Ожидают"),
+                            ("approved", "Одобрены"), ("rejected", "Отклонены")]
+
+
+async def fetch_keyset_page(select_sql: str, key: str, where: list, params: list,
+                            direction: str, cursor: Union[int, None]):
+    """Fetches one page ordered by `key` descending using keyset pagination.
+
+    `direction` is 'next' (older rows, key < cursor) or 'prev' (newer rows,
+    key > cursor). Returns (rows, has_prev, has_next).
+    """
+    where, params = list(where), list(params)
+    if cursor is not None:
+        where.append(f"{key} < ?" if direction == "next" else f"{key} > ?")
+        params.append(cursor)
+    order = "DESC" if direction == "next" else "ASC"
+    sql = select_sql
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {key} {order} LIMIT ?"
+    rows = await db.fetchall(sql, (*params, ADMIN_PAGE_SIZE + 1))
+
+    has_more = len(rows) > ADMIN_PAGE_SIZE
+    rows = rows[:ADMIN_PAGE_SIZE]
+    if direction == "next":
+        return rows, cursor is not None, has_more
+    return list(reversed(rows)), has_more, True
+
+
+def parse_page_callback(data: str, default_status: str = "all"):
+    """Parses '<prefix>:<status>:<direction>:<cursor>' callback data."""
+    parts = data.split(":")
+    if len(parts) != 4:
+        return default_status, "next", None
+    _, status, direction, cursor = parts
+    return status, direction, int(cursor) if cursor else None
+
+
+def page_keyboard(prefix: str, filters_: list, status: str, rows: list, key: str,
+                  has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
+    """Builds status filter buttons, prev/next navigation and a back button."""
+    keyboard = [[
+        InlineKeyboardButton(f"• {label}" if value == status else label, callback_data=f"{prefix}:{value}:next:")
+        for value, label in filters_
+    ]]
+    navigation = []
+    if has_prev and rows:
+        navigation.append(InlineKeyboardButton("◀️ Назад", callback_data=f"{prefix}:{status}:prev:{rows[0][key]}"))
+    if has_next and rows:
+        navigation.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f"{prefix}:{status}:next:{rows[-1][key]}"))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("⬅️ Назад в админку", callback_data="admin_panel")])
+    return InlineKeyboardMarkup(keyboard)
+
 async def admin_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Displays a list of users with ban/unban options."""
+    """Displays one page of users, optionally filtered by status."""
     query = update.callback_query
     await query.answer()
-    conn = get_db_connection()
-    users = conn.execute("SELECT user_id, first_name, username, status FROM users").fetchall()
-    conn.close()
+    status, direction, cursor = parse_page_callback(query.data)
+    where, params = ([], []) if status == "all" else (["status = ?"], [status])
+    users, has_prev, has_next = await fetch_keyset_page(
+        "SELECT user_id, first_name, username, status FROM users",
+        "user_id", where, params, direction, cursor
+    )
     
     text = "*👥 Список Пользователей*\n\n"
+    if not users:
+        text += "_Пользователей не найдено\\._"
     for user in users:
         mention = get_user_mention(user)
         status_emoji = "✅" if user['status'] == 'active' else "🚫"
-        text += f"{status_emoji} {mention} \\(ID: `{user['user_id']}`\\) \\- Статус: *{user['status']}*\n"
+        text += (f"{status_emoji} {mention} \\(ID: `{user['user_id']}`\\) \\- "
+                 f"Статус: *{escape_markdown(user['status'], version=2)}*\n")
     
-    keyboard = [[InlineKeyboardButton("⬅️ Назад в админку", callback_data="admin_panel")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = page_keyboard("admin_users_page", USER_STATUS_FILTERS, status, users, "user_id", has_prev, has_next)
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='MarkdownV2')
     return STATE_MAIN_MENU
 
-async def admin_reject_proof_with_comment(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data['rejecting_order'] = int(update.callback_query.data.split("_")[-1])
-    await update.callback_query.edit_message_text("Введите причину отклонения:")
+async def admin_reject_proof_with_comment(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Union[int, None]:
+    """Asks for a rejection reason; reachable from any state, which is kept if nothing is to be rejected."""
+    query = update.callback_query
+    if not is_admin(query.from_user.id):
+        await query.answer("Access Denied.", show_alert=True)
+        return None
+    order_id = int(query.data.split("_")[-1])
+    proof = await db.fetchone(
+        "SELECT status FROM payment_proofs WHERE proof_id = (SELECT MAX(proof_id) FROM payment_proofs WHERE order_id = ?)",
+        (order_id,)
+    )
+    if proof is None or proof['status'] != 'uploaded':
+        await query.answer("Этот заказ уже обработан другим администратором.", show_alert=True)
+        return None
+
+    await query.answer()
+    context.user_data['rejecting_order'] = order_id
+    await query.message.reply_text(f"Введите причину отклонения заказа #{order_id} (или /cancel):")
     return STATE_ADMIN_REJECT_PROOF
 
 async def save_reject_comment(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     order_id = context.user_data.pop('rejecting_order')
     comment = update.message.text
+    if len(comment) > REJECT_REASON_MAX_LENGTH:
+        comment = comment[:REJECT_REASON_MAX_LENGTH - 1] + "…"
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE payment_proofs
-        SET status = ?, admin_comment = ?
-        WHERE order_id = ?
-        ORDER BY proof_id DESC LIMIT 1
-    """, ("rejected", comment, order_id))
-    conn.commit()
-    conn.close()
+    if not await decide_proof(order_id, "rejected", comment):
+        await update.message.reply_text(f"Заказ #{order_id} уже обработан другим администратором.")
+        return ConversationHandler.END
 
     await update.message.reply_text(f"❌ Чек по заказу #{order_id} отклонён.\nПричина: {comment}")
+    await finalize_proof_notifications(
+        context.bot, order_id,
+        f"❌ *Чек отклонён* — {get_user_mention(update.effective_user)}\n"
+        f"Причина: {escape_markdown(comment, version=2)}"
+    )
     return ConversationHandler.END
 
 async def admin_orders_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Displays a list of all orders."""
+    """Displays one page of orders, optionally filtered by status."""
     query = update.callback_query
     await query.answer()
-    conn = get_db_connection()
-    orders = conn.execute("""
-        SELECT o.order_id, o.status, u.user_id, u.first_name, s.name as service_name
+    status, direction, cursor = parse_page_callback(query.data)
+    where, params = ([], []) if status == "all" else (["o.status = ?"], [status])
+    orders, has_prev, has_next = await fetch_keyset_page("""
+        SELECT o.order_id, o.status, o.user_id, u.first_name, s.name as service_name
         FROM orders o
-        JOIN users u ON o.user_id = u.user_id
-        JOIN services s ON o.service_id = s.service_id
-        ORDER BY o.order_id DESC
-    """).fetchall()
-    conn.close()
+        LEFT JOIN users u ON o.user_id = u.user_id
+        LEFT JOIN services s ON o.service_id = s.service_id
+    """, "o.order_id", where, params, direction, cursor)
 
-    text = "*📦 Список Всех Заказов*\n\n"
+    text = "*📦 Список Заказов*\n\n"
     if not orders:
-        text += "_Заказов пока нет\\._"
+        text += "_Заказов не найдено\\._"
     else:
         for order in orders:
             mention = get_user_mention(order)
+            service_name = order['service_name'] or "Удалённая услуга"
             text += (f"🔹 *Заказ `#{order['order_id']}`* от {mention}\n"
-                     f"   Услуга: _{escape_markdown(order['service_name'], version=2)}_\n"
+                     f"   Услуга: _{escape_markdown(service_name, version=2)}_\n"
                      f"   Статус: *{escape_markdown(order['status'], version=2)}*\n\n")
 
-    keyboard = [[InlineKeyboardButton("⬅️ Назад в админку", callback_data="admin_panel")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = page_keyboard("admin_orders_page", ORDER_STATUS_FILTERS, status, orders, "order_id", has_prev, has_next)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='MarkdownV2')
+    return STATE_MAIN_MENU
+
+async def admin_web_orders_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Displays one page of orders placed on the website (shared order store)."""
+    query = update.callback_query
+    await query.answer()
+    status, direction, cursor = parse_page_callback(query.data)
+    where, params = ([], []) if status == "all" else (["status = ?"], [status])
+    orders, has_prev, has_next = await fetch_keyset_page(
+        "SELECT seq, order_id, status, user_name, user_email, service_name, price FROM web_orders",
+        "seq", where, params, direction, cursor
+    )
+
+    text = "*🌐 Заказы с сайта*\n\n"
+    if not orders:
+        text += "_Заказов не найдено\\._"
+    for order in orders:
+        label = WEB_ORDER_STATUS_LABELS.get(order['status'], order['status'])
+        text += (f"🔹 *Заказ `#{order['order_id']}`* от {escape_markdown(order['user_name'] or '—', version=2)}\n"
+                 f"   Услуга: _{escape_markdown(order['service_name'] or '—', version=2)}_, "
+                 f"{escape_markdown(format(order['price'] or 0, '.2f'), version=2)}\n"
+                 f"   Статус: *{escape_markdown(label, version=2)}*\n\n")
+
+    reply_markup = page_keyboard("admin_web_orders_page", WEB_ORDER_STATUS_FILTERS, status, orders, "seq",
+                                 has_prev, has_next)
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='MarkdownV2')
     return STATE_MAIN_MENU
 
+METRICS_TOP = 10  # rows per table in /metrics
+
+async def show_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/metrics: slowest handlers, DB time and Bot API call stats (admins only)."""
+    if not is_admin(update.effective_user.id):
+        return
+    snapshot = metrics.snapshot()
+    handlers = sorted(snapshot['handlers'].items(), key=lambda item: item[1]['total_s'], reverse=True)
+    api = sorted(snapshot['api'].items(), key=lambda item: item[1]['total_s'], reverse=True)
+    lines = [f"📈 Метрики за {snapshot['uptime_s'] // 60} мин", "",
+             f"SQLite: {snapshot['db']['count']} запросов, {snapshot['db']['total_s']} с, "
+             f"avg {snapshot['db']['avg_ms']} мс, max {snapshot['db']['max_ms']} мс", "",
+             "Обработчики (вызовы / avg / max / ошибки / БД):"]
+    for name, stat in handlers[:METRICS_TOP]:
+        lines.append(f"{name}: {stat['count']} / {stat['avg_ms']} мс / {stat['max_ms']} мс / "
+                     f"{stat['errors']} / {stat['db_queries']} за {stat['db_s']} с")
+    lines += ["", "Bot API (вызовы / avg / max / ошибки / 429):"]
+    for name, stat in api[:METRICS_TOP]:
+        lines.append(f"{name}: {stat['count']} / {stat['avg_ms']} мс / {stat['max_ms']} мс / "
+                     f"{stat['errors']} / {stat['floods']}")
+    await update.message.reply_text("\n".join(lines))
+
 # --- ADMIN MANAGEMENT HANDLERS ---
 async def admin_manage_admins(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Shows the admin management menu."""
@@ -698,23 +1691,18 @@ async def admin_add_receive_id(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text("Пожалуйста, введите корректный числовой ID\\.")
         return STATE_ADMIN_ADD_ID
 
-    conn = get_db_connection()
-    user_exists = conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id_to_add,)).fetchone()
+    user_exists = await db.fetchone("SELECT 1 FROM users WHERE user_id = ?", (user_id_to_add,))
     if not user_exists:
         await update.message.reply_text("Пользователь с таким ID не найден в базе данных бота\\. Он должен сначала запустить /start\\.")
-        conn.close()
         return STATE_ADMIN_ADD_ID
         
-    is_already_admin = conn.execute("SELECT 1 FROM admins WHERE user_id = ?", (user_id_to_add,)).fetchone()
-    if is_already_admin:
+    if is_admin(user_id_to_add):
         await update.message.reply_text("Этот пользователь уже является администратором\\.")
-        conn.close()
         await start(update, context) 
         return ConversationHandler.END
 
-    conn.execute("INSERT INTO admins (user_id) VALUES (?)", (user_id_to_add,))
-    conn.commit()
-    conn.close()
+    await db.execute("INSERT INTO admins (user_id) VALUES (?)", (user_id_to_add,))
+    admin_cache.add(user_id_to_add)
     await update.message.reply_text(f"✅ Пользователь с ID `{user_id_to_add}` успешно назначен администратором\\.")
     await start(update, context)
     return ConversationHandler.END
@@ -743,21 +1731,347 @@ async def admin_remove_receive_id(update: Update, context: ContextTypes.DEFAULT_
         await start(update, context) 
         return ConversationHandler.END
         
-    conn = get_db_connection()
-    is_already_admin = conn.execute("SELECT 1 FROM admins WHERE user_id = ?", (user_id_to_remove,)).fetchone()
-    if not is_already_admin:
+    if not is_admin(user_id_to_remove):
         await update.message.reply_text("Этот пользователь не является администратором\\.")
-        conn.close()
         await start(update, context) 
         return ConversationHandler.END
     
-    conn.execute("DELETE FROM admins WHERE user_id = ?", (user_id_to_remove,))
-    conn.commit()
-    conn.close()
+    await db.execute("DELETE FROM admins WHERE user_id = ?", (user_id_to_remove,))
+    admin_cache.discard(user_id_to_remove)
     await update.message.reply_text(f"✅ Пользователь с ID `{user_id_to_remove}` успешно удален из администраторов\\.")
     await start(update, context)
     return ConversationHandler.END
 
+# --- Outbound Queue ---
+OUTBOUND_RATE = 28         # messages per second, under Telegram's ~30/s global limit
+OUTBOUND_BURST = 5         # tokens that may accumulate while idle
+OUTBOUND_CHAT_RATE = 1     # messages per second to one chat
+OUTBOUND_CHAT_BURST = 3
+OUTBOUND_CHAT_BUCKETS_MAX = 10000  # idle per-chat buckets are dropped beyond this
+OUTBOUND_OTHER_RATE = 300  # edits, callback answers and other non-message calls
+OUTBOUND_OTHER_BURST = 50
+
+# Priority classes passed as rate_limit_args; lower is served first.
+OUTBOUND_INTERACTIVE = 0   # replies to the user whose update is being handled (default)
+OUTBOUND_ADMIN_ALERT = 1   # order notifications and messages forwarded to admins
+OUTBOUND_BULK = 2          # broadcasts and background profile refreshes
+
+# Calls that send a new message; only these count against the global and per-chat limits
+OUTBOUND_MESSAGE_METHODS = frozenset({
+    "sendMessage", "sendPhoto", "sendDocument", "sendVideo", "sendAudio", "sendAnimation", "sendVoice",
+    "sendVideoNote", "sendSticker", "sendMediaGroup", "sendLocation", "sendVenue", "sendContact",
+    "sendPoll", "sendDice", "sendInvoice", "forwardMessage", "forwardMessages", "copyMessage", "copyMessages",
+})
+# Calls that must never wait
+OUTBOUND_UNLIMITED = frozenset({"getUpdates", "setWebhook", "deleteWebhook", "getMe", "getFile"})
+
+
+def retry_after_seconds(error: telegram.error.RetryAfter) -> float:
+    """Returns RetryAfter.retry_after in seconds (int or timedelta depending on PTB version)."""
+    retry_after = error.retry_after
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    """Async token bucket for outgoing Bot API calls.
+
+    pause() stops all acquirers until a flood wait reported by Telegram
+    (RetryAfter) has passed, since that limit applies to the whole bot.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    def is_full(self) -> bool:
+        """True once the bucket has been idle long enough to refill completely."""
+        now = time.monotonic()
+        self._refill(now)
+        return self._tokens >= self.capacity and now >= self._paused_until
+
+
+class PriorityBucket:
+    """TokenBucket whose waiters are served in (priority, arrival) order.
+
+    Callers wait in a heap; one dispatcher task takes tokens from the bucket
+    and hands each to the head of the heap, so a reply queued behind
+    thousands of broadcast sends is served with the next token.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.bucket = TokenBucket(rate, capacity)
+        self._waiting = []
+        self._arrival = itertools.count()
+        self._dispatcher = None
+
+    async def acquire(self, priority: int) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._arrival), waiter))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await waiter
+
+    async def _dispatch(self) -> None:
+        while self._waiting:
+            await self.bucket.acquire()
+            while self._waiting:
+                _, _, waiter = heapq.heappop(self._waiting)
+                if not waiter.done():  # skip callers that were cancelled while queued
+                    waiter.set_result(None)
+                    break
+
+    def pause(self, seconds: float) -> None:
+        self.bucket.pause(seconds)
+
+    def is_idle(self) -> bool:
+        return not self._waiting and self.bucket.is_full()
+
+    def close(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+        for _, _, waiter in self._waiting:
+            waiter.cancel()
+        self._waiting.clear()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+
+class OutboundQueue(BaseRateLimiter):
+    """Rate limiter for every Bot API call the application makes.
+
+    Only calls that send a message (OUTBOUND_MESSAGE_METHODS) count against
+    Telegram's limits: each waits for its chat's own bucket (about 1/s) and
+    then for the global one (~30/s), both served by priority. Edits,
+    callback answers and other calls take tokens from a separate, much
+    larger bucket and never queue behind messages. A RetryAfter pauses the
+    bucket of the call that got it. The priority comes from the
+    rate_limit_args argument of ExtBot methods; calls without it are
+    interactive.
+    """
+
+    def __init__(self, rate: float = OUTBOUND_RATE, burst: float = OUTBOUND_BURST):
+        self.messages = PriorityBucket(rate, burst)
+        self.other = TokenBucket(OUTBOUND_OTHER_RATE, OUTBOUND_OTHER_BURST)
+        self._chats = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self.messages.close()
+        for chat in self._chats.values():
+            chat.close()
+        self._chats.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        bucket = None
+        if endpoint in OUTBOUND_MESSAGE_METHODS:
+            priority = OUTBOUND_INTERACTIVE if rate_limit_args is None else rate_limit_args
+            chat_id = (data or {}).get("chat_id")
+            if chat_id is not None:
+                await self._chat(chat_id).acquire(priority)
+            bucket = self.messages
+            await bucket.acquire(priority)
+        elif endpoint not in OUTBOUND_UNLIMITED:
+            bucket = self.other
+            await bucket.acquire()
+        try:
+            return await callback(*args, **kwargs)
+        except telegram.error.RetryAfter as e:
+            if bucket is not None:
+                bucket.pause(retry_after_seconds(e))
+            raise
+
+    def _chat(self, chat_id) -> PriorityBucket:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) >= OUTBOUND_CHAT_BUCKETS_MAX:
+                self._chats = {key: c for key, c in self._chats.items() if not c.is_idle()}
+            chat = self._chats[chat_id] = PriorityBucket(OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST)
+        return chat
+
+    @property
+    def queued(self) -> int:
+        return self.messages.queued
+
+
+# --- Broadcast Engine ---
+BROADCAST_CONCURRENCY = 20        # sends in flight at once
+BROADCAST_BATCH_SIZE = 200        # recipients per checkpoint
+BROADCAST_MAX_ATTEMPTS = 5
+BROADCAST_PROGRESS_INTERVAL = 3   # seconds between progress message edits
+
+
+class BroadcastEngine:
+    """Sends broadcast campaigns concurrently within Telegram's rate limits.
+
+    Recipients are walked in user_id order in batches; after every batch the
+    campaign row in `broadcasts` records the last user_id and the counters,
+    so a restarted bot resumes where it stopped. Sends go through the
+    OutboundQueue at bulk priority, so they only use capacity that
+    interactive replies and admin alerts leave free. Users that blocked the
+    bot are marked inactive.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def start(self, bot, admin_id: int, message_text: str) -> int:
+        """Creates a campaign and starts sending it in the background."""
+        total = (await db.fetchone(
+            "SELECT COUNT(*) FROM users WHERE status = 'active' AND user_id != ?", (admin_id,)
+        ))[0]
+        progress = await bot.send_message(chat_id=admin_id, text=f"📢 Рассылка: 0/{total}")
+        cursor = await db.execute(
+            "INSERT INTO broadcasts (admin_id, progress_message_id, message_text, total, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (admin_id, progress.message_id, message_text, total, datetime.datetime.now().isoformat())
+        )
+        self._spawn(bot, cursor.lastrowid)
+        return cursor.lastrowid
+
+    async def resume_all(self, bot) -> None:
+        """Resumes campaigns interrupted by a restart."""
+        rows = await db.fetchall("SELECT broadcast_id FROM broadcasts WHERE status = 'running'")
+        for row in rows:
+            logger.info(f"📢 Resuming broadcast #{row['broadcast_id']}")
+            self._spawn(bot, row['broadcast_id'])
+
+    async def stop(self) -> None:
+        """Cancels running campaigns; their progress is already checkpointed."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, bot, broadcast_id: int) -> None:
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(bot, broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _run(self, bot, broadcast_id: int) -> None:
+        # The task inherits the starting handler's context; don't charge its DB time there
+        current_handler.set(None)
+        campaign = await db.fetchone("SELECT * FROM broadcasts WHERE broadcast_id = ?", (broadcast_id,))
+        counters = {key: campaign[key] for key in ('sent', 'failed', 'blocked')}
+        last_user_id = campaign['last_user_id']
+        semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        last_report = 0.0
+
+        async def send_one(user_id: int) -> str:
+            async with semaphore:
+                return await self._send(bot, user_id, campaign['message_text'])
+
+        try:
+            while True:
+                batch = await db.fetchall(
+                    "SELECT user_id FROM users WHERE status = 'active' AND user_id > ? "
+                    "ORDER BY user_id LIMIT ?",
+                    (last_user_id, BROADCAST_BATCH_SIZE)
+                )
+                if not batch:
+                    break
+                recipients = [row['user_id'] for row in batch if row['user_id'] != campaign['admin_id']]
+                results = await asyncio.gather(*(send_one(user_id) for user_id in recipients))
+                blocked_ids = [(user_id,) for user_id, result in zip(recipients, results) if result == 'blocked']
+                for result in results:
+                    counters[result] += 1
+                last_user_id = batch[-1]['user_id']
+                await db.write(self._checkpoint, broadcast_id, last_user_id, counters, blocked_ids)
+
+                if time.monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    await self._report(bot, campaign, counters, finished=False)
+
+            await db.execute(
+                "UPDATE broadcasts SET status = 'finished', finished_at = ? WHERE broadcast_id = ?",
+                (datetime.datetime.now().isoformat(), broadcast_id)
+            )
+            await self._report(bot, campaign, counters, finished=True)
+            logger.info(f"📢 Broadcast #{broadcast_id} finished: {counters}")
+        except asyncio.CancelledError:
+            logger.info(f"📢 Broadcast #{broadcast_id} paused at user {last_user_id}")
+            raise
+        except Exception as e:
+            logger.error(f"Broadcast #{broadcast_id} failed: {e}")
+
+    @staticmethod
+    def _checkpoint(conn: sqlite3.Connection, broadcast_id: int, last_user_id: int,
+                    counters: dict, blocked_ids: list) -> None:
+        if blocked_ids:
+            conn.executemany("UPDATE users SET status = 'inactive' WHERE user_id = ?", blocked_ids)
+        conn.execute(
+            "UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, blocked = ? WHERE broadcast_id = ?",
+            (last_user_id, counters['sent'], counters['failed'], counters['blocked'], broadcast_id)
+        )
+
+    async def _send(self, bot, chat_id: int, text: str) -> str:
+        """Sends one message; returns 'sent', 'blocked' or 'failed'."""
+        for attempt in range(BROADCAST_MAX_ATTEMPTS):
+            try:
+                await bot.send_message(
+                    chat_id=chat_id, text=text, parse_mode='MarkdownV2', rate_limit_args=OUTBOUND_BULK
+                )
+                return 'sent'
+            except telegram.error.RetryAfter:
+                pass  # the outbound queue is already paused for the flood wait
+            except telegram.error.Forbidden:
+                return 'blocked'
+            except (telegram.error.TimedOut, telegram.error.NetworkError):
+                await asyncio.sleep(2 ** attempt)
+            except telegram.error.TelegramError as e:
+                logger.warning(f"Could not send broadcast message to {chat_id}: {e}")
+                return 'failed'
+        return 'failed'
+
+    @staticmethod
+    async def _report(bot, campaign: sqlite3.Row, counters: dict, finished: bool) -> None:
+        done = counters['sent'] + counters['failed'] + counters['blocked']
+        text = (f"📢 Рассылка #{campaign['broadcast_id']}"
+                f"{' завершена' if finished else ''}: {done}/{campaign['total']}\n"
+                f"✅ Отправлено: {counters['sent']}\n"
+                f"🚫 Заблокировали бота: {counters['blocked']}\n"
+                f"❌ Ошибок: {counters['failed']}")
+        try:
+            await bot.edit_message_text(
+                text, chat_id=campaign['admin_id'], message_id=campaign['progress_message_id'],
+                rate_limit_args=OUTBOUND_BULK
+            )
+        except telegram.error.TelegramError as e:
+            logger.debug(f"Could not update broadcast progress: {e}")
+
+
+broadcast_engine = BroadcastEngine()
+
 # --- BROADCAST HANDLERS ---
 async def admin_broadcast_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the broadcast conversation."""
@@ -771,34 +2085,15 @@ async def admin_broadcast_start(update: Update, context: ContextTypes.DEFAULT_TY
     return STATE_ADMIN_BROADCAST_MESSAGE
     
 async def admin_broadcast_receive_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Receives and broadcasts the message to all users."""
+    """Receives the message and starts a broadcast campaign to all users."""
     message_text = update.message.text_markdown_v2
     admin_id = update.effective_user.id
     
-    await update.message.reply_text("Начинаю рассылку\\. Это может занять некоторое время\\.")
-    
-    conn = get_db_connection()
-    users = conn.execute("SELECT user_id FROM users WHERE status = 'active'").fetchall()
-    conn.close()
-    
-    success_count = 0
-    fail_count = 0
-    
-    for user in users:
-        if user['user_id'] == admin_id:
-            continue
-        try:
-            await context.bot.send_message(chat_id=user['user_id'], text=message_text, parse_mode='MarkdownV2')
-            success_count += 1
-            await asyncio.sleep(0.1) # Avoid hitting rate limits
-        except telegram.error.TelegramError as e:
-            fail_count += 1
-            logger.warning(f"Could not send broadcast message to {user['user_id']}: {e}")
-            
-    summary_text = (f"📢 *Рассылка завершена\\!*\n\n"
-                    f"✅ Успешно отправлено: *{success_count}*\n"
-                    f"❌ Не удалось отправить: *{fail_count}*")
-    await update.message.reply_text(summary_text, parse_mode='MarkdownV2')
+    broadcast_id = await broadcast_engine.start(context.bot, admin_id, message_text)
+    await update.message.reply_text(
+        f"Рассылка \\#{broadcast_id} запущена\\. Прогресс обновляется в сообщении выше\\.",
+        parse_mode='MarkdownV2'
+    )
     
     await start(update, context)
     return ConversationHandler.END
@@ -809,9 +2104,7 @@ async def admin_manage_services(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
 
-    conn = get_db_connection()
-    services = conn.execute("SELECT service_id, name, is_active FROM services").fetchall()
-    conn.close()
+    services = await db.fetchall("SELECT service_id, name, is_active FROM services")
 
     text = "*🔧 Управление услугами*\n\n"
     if not services:
@@ -824,6 +2117,7 @@ async def admin_manage_services(update: Update, context: ContextTypes.DEFAULT_TY
     keyboard = [
         [InlineKeyboardButton("➕ Добавить услугу", callback_data="admin_add_service")],
         [InlineKeyboardButton("✏️ Изменить услугу", callback_data="admin_edit_service_select")],
+        [InlineKeyboardButton("🔁 Вкл/выкл услугу", callback_data="admin_toggle_service_select")],
         [InlineKeyboardButton("❌ Удалить услугу", callback_data="admin_delete_service_start")],
         [InlineKeyboardButton("⬅️ Назад в админку", callback_data="admin_panel")]
     ]
@@ -863,48 +2157,70 @@ async def admin_add_service_start(update: Update, context: ContextTypes.DEFAULT_
 async def admin_add_service_receive_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Receives service data and adds a new service to the database."""
     try:
-        data = update.message.text.split('\n')
+        data = [line.strip() for line in update.message.text.split('\n')]
         if len(data) != 7:
-            # Enhanced services with better pricing
-
-            name, description, price_usd_str, price_btc_str, price_stars_str, price_eur_str, price_uah_str = data
-            price_usd = float(price_usd_str)
-            price_btc = float(price_btc_str)
-            price_stars = int(price_stars_str)
-            price_eur = float(price_eur_str)
-            price_uah = float(price_uah_str)
-
-            conn = get_db_connection()
-            conn.execute("INSERT INTO services (name, description, price_usd, price_btc, price_stars, price_eur, price_uah) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            raise ValueError("ожидается 7 строк")
+        name, description, price_usd_str, price_btc_str, price_stars_str, price_eur_str, price_uah_str = data
+        price_usd = float(price_usd_str)
+        price_btc = float(price_btc_str)
+        price_stars = int(price_stars_str)
+        price_eur = float(price_eur_str)
+        price_uah = float(price_uah_str)
+
+        await db.execute("INSERT INTO services (name, description, price_usd, price_btc, price_stars, price_eur, price_uah) VALUES (?, ?, ?, ?, ?, ?, ?)",
                          (name, description, price_usd, price_btc, price_stars, price_eur, price_uah))
-            
-            conn.commit()
-            conn.close()
-            logger.info("✅ Database setup completed successfully")
-        
-    except Exception as e:
-        logger.error(f"❌ Database setup failed: {e}")
-        raise
-        
-        await update.message.reply_text("✅ Услуга успешно добавлена\\!")
-    except (ValueError, IndexError) as e:
-        await update.message.reply_text(f"❌ Произошла ошибка: {e}\\. Пожалуйста, введите данные в правильном формате\\.")
+    except ValueError as e:
+        await update.message.reply_text(
+            f"❌ Произошла ошибка: {escape_markdown(str(e), version=2)}\\. Пожалуйста, введите данные в правильном формате\\.",
+            parse_mode='MarkdownV2'
+        )
         return STATE_ADMIN_ADD_SERVICE
     except sqlite3.IntegrityError:
-        await update.message.reply_text("❌ Услуга с таким названием уже существует\\.")
+        await update.message.reply_text("❌ Услуга с таким названием уже существует\\.", parse_mode='MarkdownV2')
         return STATE_ADMIN_ADD_SERVICE
-        
+
+    service_catalog.invalidate()
+    logger.info(f"✅ Service '{name}' added")
+    await update.message.reply_text("✅ Услуга успешно добавлена\\!", parse_mode='MarkdownV2')
     await start(update, context)
     return ConversationHandler.END
 
+async def _show_service_toggles(query) -> int:
+    services = await db.fetchall("SELECT service_id, name, is_active FROM services")
+    keyboard = [
+        [InlineKeyboardButton(f"{'✅' if service['is_active'] else '🚫'} {service['name']}",
+                              callback_data=f"admin_toggle_service_{service['service_id']}")]
+        for service in services
+    ]
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_manage_services")])
+    await query.edit_message_text("Нажмите на услугу, чтобы включить или выключить её:",
+                                  reply_markup=InlineKeyboardMarkup(keyboard))
+    return STATE_MAIN_MENU
+
+async def admin_toggle_service_select(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Shows services with their active state for toggling."""
+    query = update.callback_query
+    await query.answer()
+    return await _show_service_toggles(query)
+
+async def admin_toggle_service(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Enables or disables a service."""
+    query = update.callback_query
+    await query.answer()
+    service_id = int(query.data.split('_')[-1])
+    await db.execute(
+        "UPDATE services SET is_active = CASE WHEN is_active = 1 THEN 0 ELSE 1 END WHERE service_id = ?",
+        (service_id,)
+    )
+    service_catalog.invalidate()
+    return await _show_service_toggles(query)
+
 async def admin_delete_service_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the conversation to delete a service."""
     query = update.callback_query
     await query.answer()
     
-    conn = get_db_connection()
-    services = conn.execute("SELECT service_id, name FROM services").fetchall()
-    conn.close()
+    services = await db.fetchall("SELECT service_id, name FROM services")
     
     if not services:
         await query.edit_message_text("❌ Нет услуг для удаления\\.")
@@ -926,21 +2242,758 @@ async def admin_delete_service_confirm(update: Update, context: ContextTypes.DEF
         await update.message.reply_text("Пожалуйста, введите корректный числовой ID\\.")
         return STATE_ADMIN_MANAGE_SERVICES
         
-    conn = get_db_connection()
-    service = conn.execute("SELECT name FROM services WHERE service_id = ?", (service_id_to_delete,)).fetchone()
+    service = await db.fetchone("SELECT name FROM services WHERE service_id = ?", (service_id_to_delete,))
     if not service:
         await update.message.reply_text(f"❌ Услуга с ID `{service_id_to_delete}` не найдена\\.")
-        conn.close()
         return STATE_ADMIN_MANAGE_SERVICES
         
-    conn.execute("DELETE FROM services WHERE service_id = ?", (service_id_to_delete,))
-    conn.commit()
-    conn.close()
+    await db.execute("DELETE FROM services WHERE service_id = ?", (service_id_to_delete,))
+    service_catalog.invalidate()
     
     await update.message.reply_text(f"✅ Услуга `{service['name']}` успешно удалена\\.")
     await start(update, context)
     return STATE_MAIN_MENU
 
+# --- Proof Archive ---
+PROOF_ARCHIVE_DIR = os.getenv("PROOF_ARCHIVE_DIR", "proof_archive")
+PROOF_ARCHIVE_CONCURRENCY = 3    # downloads in flight at once
+PROOF_ARCHIVE_INTERVAL = 300     # seconds between sweeps for proofs not archived yet
+PROOF_ARCHIVE_BATCH = 50
+PROOF_ARCHIVE_MAX_ATTEMPTS = 8   # a proof that failed this often is left to the admins
+PROOF_ARCHIVE_RETRY_BASE = 600   # seconds before the first retry; doubles with every failure
+PROOF_ARCHIVE_RETRY_MAX = 86400
+
+
+class ProofArchiver:
+    """Downloads payment proofs into a local content-addressed archive.
+
+    Files are stored as <PROOF_ARCHIVE_DIR>/<sha256[:2]>/<sha256> (the MIME
+    type stays in payment_proofs.file_type), so a receipt uploaded twice is
+    kept once. After archiving, the proof's content_hash is compared with
+    the proofs of other orders; a match (the same file re-sent, e.g. once
+    as photo and once as document) is reported to the admin, unless the
+    notification of the upload already flagged that order by file_unique_id.
+    Uploads are archived right away; a periodic sweep retries whatever
+    failed or was missed by a restart. Each failure is recorded on the
+    proof (archive_attempts, archive_error) and pushes its next retry back
+    exponentially, so proofs that keep failing don't starve newer ones.
+    """
+
+    def __init__(self):
+        self._semaphore = asyncio.Semaphore(PROOF_ARCHIVE_CONCURRENCY)
+        self._tasks = {}
+
+    def schedule(self, bot, proof_id: int) -> None:
+        if proof_id in self._tasks:
+            return
+        task = asyncio.create_task(self._archive(bot, proof_id))
+        self._tasks[proof_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(proof_id, None))
+
+    async def archive_pending(self, bot) -> None:
+        rows = await db.fetchall(
+            "SELECT proof_id FROM payment_proofs WHERE archive_path IS NULL AND archive_attempts < ? "
+            "AND (archive_retry_at IS NULL OR archive_retry_at <= ?) ORDER BY proof_id LIMIT ?",
+            (PROOF_ARCHIVE_MAX_ATTEMPTS, datetime.datetime.now().isoformat(), PROOF_ARCHIVE_BATCH)
+        )
+        for row in rows:
+            self.schedule(bot, row['proof_id'])
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def _store(content: bytes) -> tuple:
+        """Writes content under its hash (atomically, once); returns (hash, path)."""
+        content_hash = hashlib.sha256(content).hexdigest()
+        path = os.path.join(PROOF_ARCHIVE_DIR, content_hash[:2], content_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        return content_hash, path
+
+    async def _archive(self, bot, proof_id: int) -> None:
+        current_handler.set(None)
+        async with self._semaphore:
+            proof = await db.fetchone(
+                "SELECT proof_id, order_id, file_id, file_unique_id, file_type FROM payment_proofs "
+                "WHERE proof_id = ? AND archive_path IS NULL", (proof_id,)
+            )
+            if proof is None:
+                return
+            try:
+                telegram_file = await bot.get_file(proof['file_id'], rate_limit_args=OUTBOUND_BULK)
+                content = bytes(await telegram_file.download_as_bytearray())
+            except telegram.error.TelegramError as e:
+                logger.warning(f"Could not download proof {proof_id} for archiving: {e}")
+                await self._record_failure(proof_id, e)
+                return
+
+        loop = asyncio.get_running_loop()
+        try:
+            content_hash, path = await loop.run_in_executor(None, self._store, content)
+        except OSError as e:
+            logger.error(f"Could not write proof {proof_id} to the archive: {e}")
+            await self._record_failure(proof_id, e)
+            return
+
+        def record(conn: sqlite3.Connection) -> list:
+            conn.execute(
+                "UPDATE payment_proofs SET content_hash = ?, archive_path = ?, archived_at = ? WHERE proof_id = ?",
+                (content_hash, path, datetime.datetime.now().isoformat(), proof_id)
+            )
+            # Orders sharing the file_unique_id were already flagged in the upload's notification
+            return [row['order_id'] for row in conn.execute(
+                "SELECT DISTINCT order_id FROM payment_proofs WHERE content_hash = ? AND order_id != ? "
+                "AND order_id NOT IN (SELECT order_id FROM payment_proofs WHERE file_unique_id = ?) "
+                "ORDER BY order_id",
+                (content_hash, proof['order_id'], proof['file_unique_id'])
+            )]
+
+        duplicates = await db.write(record)
+        if duplicates:
+            await self._alert_duplicate(bot, proof, duplicates)
+
+    @staticmethod
+    async def _record_failure(proof_id: int, error: Exception) -> None:
+        def record(conn: sqlite3.Connection) -> int:
+            attempts = conn.execute(
+                "SELECT archive_attempts FROM payment_proofs WHERE proof_id = ?", (proof_id,)
+            ).fetchone()[0] + 1
+            delay = min(PROOF_ARCHIVE_RETRY_MAX, PROOF_ARCHIVE_RETRY_BASE * 2 ** (attempts - 1))
+            retry_at = datetime.datetime.now() + datetime.timedelta(seconds=delay)
+            conn.execute(
+                "UPDATE payment_proofs SET archive_attempts = ?, archive_error = ?, archive_retry_at = ? "
+                "WHERE proof_id = ?",
+                (attempts, str(error)[:500], retry_at.isoformat(), proof_id)
+            )
+            return attempts
+
+        attempts = await db.write(record)
+        if attempts >= PROOF_ARCHIVE_MAX_ATTEMPTS:
+            logger.error(f"Giving up archiving proof {proof_id} after {attempts} attempts: {error}")
+
+    @staticmethod
+    async def _alert_duplicate(bot, proof: sqlite3.Row, duplicates: list) -> None:
+        orders = ", ".join(f"\\#{order_id}" for order_id in duplicates)
+        await notify_admins(lambda admin_id: bot.send_message(
+            chat_id=admin_id,
+            text=f"⚠️ Чек заказа \\#{proof['order_id']} совпадает с чеком заказа {orders}\\. "
+                 "Проверьте перед одобрением\\.",
+            parse_mode='MarkdownV2',
+            rate_limit_args=OUTBOUND_ADMIN_ALERT
+        ))
+
+
+proof_archiver = ProofArchiver()
+
+# --- Web Order Feed ---
+WEB_ORDER_FEED_CONSUMER = storage.BOT_FEED_CONSUMER
+WEB_ORDER_CHECK_INTERVAL = 60  # seconds; fallback for lost nudges
+WEB_ORDER_FEED_BATCH = 100
+WEB_ORDER_STATUS_LABELS = {"pending": "⏳ ожидает", "approved": "✅ одобрен", "rejected": "❌ отклонён",
+                           "cancelled": "🚫 отменён клиентом", "completed": "🏁 выполнен"}
+# Status changes made by customers; changes made by admins on the site go into one digest per check
+WEB_ORDER_ALERT_STATUSES = frozenset({"cancelled"})
+WEB_ORDER_DIGEST_IDS = 10  # order IDs listed per status in the digest
+
+
+class WebOrderFeed:
+    """Delivers web orders from the shared order store to the admin chat.
+
+    The web server nudges the bot over a Unix datagram socket
+    (storage.ORDER_EVENTS_SOCKET) after each commit; the bot then reads
+    order_events after its stored position. New and cancelled orders get a
+    notification each; other status changes (admins' own decisions on the
+    site, including bulk actions) are summed up in one digest per check.
+    A periodic check covers nudges lost while the bot was down.
+    """
+
+    def __init__(self):
+        self._socket = None
+        self._bot = None
+        self._task = None
+        self._pending = False
+
+    def start(self, bot) -> None:
+        self._bot = bot
+        if not hasattr(socket, "AF_UNIX"):
+            return
+        try:
+            if os.path.exists(storage.ORDER_EVENTS_SOCKET):
+                os.unlink(storage.ORDER_EVENTS_SOCKET)
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._socket.bind(storage.ORDER_EVENTS_SOCKET)
+            self._socket.setblocking(False)
+            asyncio.get_running_loop().add_reader(self._socket.fileno(), self._on_nudge)
+        except OSError as e:
+            logger.warning(f"Web order nudges unavailable, relying on periodic checks: {e}")
+            self._socket = None
+
+    def stop(self) -> None:
+        if self._socket is not None:
+            asyncio.get_running_loop().remove_reader(self._socket.fileno())
+            self._socket.close()
+            self._socket = None
+            try:
+                os.unlink(storage.ORDER_EVENTS_SOCKET)
+            except OSError:
+                pass
+
+    def _on_nudge(self) -> None:
+        try:
+            while self._socket.recv(64):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        self.schedule()
+
+    def schedule(self) -> None:
+        """Runs a check now, or once more after the one in progress."""
+        if self._task is not None and not self._task.done():
+            self._pending = True
+            return
+        self._task = asyncio.create_task(self._check())
+
+    async def check(self) -> None:
+        """Schedules a check and waits for it; used by the periodic job."""
+        self.schedule()
+        await asyncio.shield(self._task)
+
+    async def _check(self) -> None:
+        current_handler.set(None)
+        digest = {}
+        while True:
+            self._pending = False
+            position = await db.read(storage.get_consumer_position, WEB_ORDER_FEED_CONSUMER)
+            if position is None:
+                position = await db.write(storage.register_consumer, WEB_ORDER_FEED_CONSUMER)
+            events = await db.read(storage.events_after, position, WEB_ORDER_FEED_BATCH)
+            for event in events:
+                if event['kind'] == 'created' or event['event_status'] in WEB_ORDER_ALERT_STATUSES:
+                    await self._notify(event)
+                else:
+                    digest.setdefault(event['event_status'], []).append(event['order_id'])
+                # Acknowledge one by one so a crash re-sends at most one notification
+                await db.write(storage.set_consumer_position, WEB_ORDER_FEED_CONSUMER, event['event_id'])
+            if len(events) < WEB_ORDER_FEED_BATCH and not self._pending:
+                break
+        if digest:
+            await self._notify_digest(digest)
+
+    async def _notify(self, event: sqlite3.Row) -> None:
+        order_ref = escape_markdown(event['order_id'], version=2)
+        if event['kind'] == 'created':
+            text = (f"🌐 *НОВЫЙ ЗАКАЗ С САЙТА \\#{order_ref}*\n\n"
+                    f"👤 Клиент: {escape_markdown(event['user_name'] or '—', version=2)} "
+                    f"\\({escape_markdown(event['user_email'] or '—', version=2)}\\)\n"
+                    f"🔹 Услуга: _{escape_markdown(event['service_name'] or '—', version=2)}_\n"
+                    f"💰 Сумма: *{escape_markdown(format(event['price'] or 0, '.2f'), version=2)}*\n"
+                    f"💸 Метод оплаты: *{escape_markdown((event['payment_method'] or '').upper(), version=2)}*")
+            if event['comments']:
+                text += f"\n💬 {escape_markdown(event['comments'], version=2)}"
+        else:
+            label = WEB_ORDER_STATUS_LABELS.get(event['event_status'], event['event_status'])
+            text = f"🌐 Заказ с сайта \\#{order_ref}: {escape_markdown(label, version=2)}"
+        await notify_admins(lambda admin_id: self._bot.send_message(
+            chat_id=admin_id, text=text, parse_mode='MarkdownV2', rate_limit_args=OUTBOUND_ADMIN_ALERT
+        ))
+
+    async def _notify_digest(self, digest: dict) -> None:
+        """Sends one message summing up status changes as {status: [order_id, ...]}."""
+        lines = ["🌐 *Изменения заказов с сайта*"]
+        for status, order_ids in digest.items():
+            label = WEB_ORDER_STATUS_LABELS.get(status, status)
+            order_ids = list(dict.fromkeys(order_ids))
+            refs = ", ".join(f"#{order_id}" for order_id in order_ids[:WEB_ORDER_DIGEST_IDS])
+            if len(order_ids) > WEB_ORDER_DIGEST_IDS:
+                refs += f" и ещё {len(order_ids) - WEB_ORDER_DIGEST_IDS}"
+            lines.append(f"{escape_markdown(label, version=2)}: *{len(order_ids)}* "
+                         f"\\({escape_markdown(refs, version=2)}\\)")
+        text = "\n".join(lines)
+        await notify_admins(lambda admin_id: self._bot.send_message(
+            chat_id=admin_id, text=text, parse_mode='MarkdownV2', rate_limit_args=OUTBOUND_ADMIN_ALERT
+        ))
+
+
+web_order_feed = WebOrderFeed()
+
+# --- Conversation Persistence ---
+PERSISTENCE_UPDATE_INTERVAL = 5   # seconds between PTB persistence runs
+PERSISTENCE_FLUSH_DELAY = 0.5     # coalesces one run's updates into a single write
+
+
+class SQLitePersistence(BasePersistence):
+    """Stores conversation states and user_data in the bot database.
+
+    Only user_data and conversations are persisted. PTB hands over every
+    user it saw since the last run; values are compared with what was last
+    stored, and only keys that really changed are queued and written in one
+    debounced transaction. Empty user_data and ended conversations delete
+    their rows instead of storing empty values.
+    """
+
+    def __init__(self):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=PERSISTENCE_UPDATE_INTERVAL,
+        )
+        self._stored_user_data = {}
+        self._stored_states = {}
+        self._dirty_user_data = {}
+        self._dirty_states = {}
+        self._flush_task = None
+
+    # --- Loading ---
+    async def get_user_data(self) -> dict:
+        rows = await db.fetchall("SELECT user_id, data FROM bot_user_data")
+        self._stored_user_data = {row['user_id']: row['data'] for row in rows}
+        return {user_id: json.loads(data) for user_id, data in self._stored_user_data.items()}
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await db.fetchall(
+            "SELECT conversation_key, state FROM bot_conversations WHERE name = ?", (name,)
+        )
+        conversations = {}
+        for row in rows:
+            self._stored_states[(name, row['conversation_key'])] = row['state']
+            conversations[tuple(json.loads(row['conversation_key']))] = row['state']
+        return conversations
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    # --- Updates ---
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        payload = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str) if data else None
+        if self._stored_user_data.get(user_id) != payload:
+            self._dirty_user_data[user_id] = payload
+            self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self.update_user_data(user_id, {})
+
+    async def update_conversation(self, name: str, key, new_state: Union[int, None]) -> None:
+        state_key = (name, json.dumps(list(key)))
+        if self._stored_states.get(state_key) != new_state:
+            self._dirty_states[state_key] = new_state
+            self._schedule_flush()
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    # --- Writing ---
+    def _schedule_flush(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        # Changes queued while a write was in flight found this task still running
+        # and did not schedule their own, so they are written by another round
+        while True:
+            await asyncio.sleep(PERSISTENCE_FLUSH_DELAY)
+            if not await self._write_dirty() or not (self._dirty_user_data or self._dirty_states):
+                return
+
+    async def _write_dirty(self) -> bool:
+        """Writes the queued changes; False if the write failed and they stay queued."""
+        user_data, self._dirty_user_data = self._dirty_user_data, {}
+        states, self._dirty_states = self._dirty_states, {}
+        if not user_data and not states:
+            return True
+        now = datetime.datetime.now().isoformat()
+
+        def write(conn: sqlite3.Connection) -> None:
+            conn.executemany(
+                "INSERT INTO bot_user_data (user_id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                [(user_id, data, now) for user_id, data in user_data.items() if data is not None]
+            )
+            conn.executemany(
+                "DELETE FROM bot_user_data WHERE user_id = ?",
+                [(user_id,) for user_id, data in user_data.items() if data is None]
+            )
+            conn.executemany(
+                "INSERT INTO bot_conversations (name, conversation_key, state) VALUES (?, ?, ?) "
+                "ON CONFLICT (name, conversation_key) DO UPDATE SET state = excluded.state",
+                [(name, key, state) for (name, key), state in states.items() if state is not None]
+            )
+            conn.executemany(
+                "DELETE FROM bot_conversations WHERE name = ? AND conversation_key = ?",
+                [(name, key) for (name, key), state in states.items() if state is None]
+            )
+
+        try:
+            await db.write(write)
+        except asyncio.CancelledError:
+            # flush() cancelled this run; it writes the changes itself
+            self._requeue(user_data, states)
+            raise
+        except sqlite3.Error as e:
+            logger.error(f"Failed to persist conversation data: {e}")
+            self._requeue(user_data, states)
+            return False
+        for user_id, data in user_data.items():
+            if data is None:
+                self._stored_user_data.pop(user_id, None)
+            else:
+                self._stored_user_data[user_id] = data
+        self._stored_states.update(states)
+        return True
+
+    def _requeue(self, user_data: dict, states: dict) -> None:
+        """Queues unwritten changes again unless newer values arrived meanwhile."""
+        self._dirty_user_data = {**user_data, **self._dirty_user_data}
+        self._dirty_states = {**states, **self._dirty_states}
+
+    async def flush(self) -> None:
+        """Writes everything still queued; called by PTB on shutdown."""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            # Let it put back whatever it had taken but not written
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self._write_dirty()
+
+# --- Webhook Delivery ---
+class WebhookReceiver:
+    """Minimal HTTP/1.1 receiver for Telegram webhook updates.
+
+    Checks the X-Telegram-Bot-Api-Secret-Token header, answers 200 as soon
+    as the body is read and hands the update to application.update_queue,
+    so handler time never delays the acknowledgement. When more than
+    `max_backlog` updates are already queued it answers 503 and Telegram
+    redelivers later instead of the bot buffering without bound.
+    """
+
+    MAX_BODY_SIZE = 1024 * 1024
+    IDLE_TIMEOUT = 75  # seconds a keep-alive connection may stay idle
+
+    def __init__(self, application: Application, path: str, secret: str, max_backlog: int):
+        self.application = application
+        self.path = path
+        self.secret = secret
+        self.max_backlog = max_backlog
+        self.received = 0
+        self.rejected = 0
+        self._server = None
+        self._connections = set()
+
+    async def start(self, host: str, port: int) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"🌐 Webhook receiver listening on {host}:{port}{self.path}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections.add(writer)
+        try:
+            while True:
+                request = await asyncio.wait_for(self._read_request(reader), self.IDLE_TIMEOUT)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = self._dispatch(method, path, headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: text/plain\r\nContent-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > self.MAX_BODY_SIZE:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, path.split("?", 1)[0], headers, body
+
+    def _dispatch(self, method: str, path: str, headers: dict, body: bytes):
+        if path != self.path:
+            return "404 Not Found", b"not found"
+        if method != "POST":
+            return "405 Method Not Allowed", b"method not allowed"
+        token = headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            self.rejected += 1
+            return "403 Forbidden", b"forbidden"
+        if self.application.update_queue.qsize() >= self.max_backlog:
+            self.rejected += 1
+            return "503 Service Unavailable", b"busy"
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Malformed webhook update: {e}")
+            return "400 Bad Request", b"bad request"
+        self.application.update_queue.put_nowait(update)
+        self.received += 1
+        return "200 OK", b"ok"
+
+
+async def run_webhook(application: Application) -> None:
+    """Runs the application in webhook mode until SIGINT/SIGTERM."""
+    receiver = WebhookReceiver(application, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_BACKLOG)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await receiver.start(WEBHOOK_LISTEN, WEBHOOK_PORT)
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        logger.info("✅ Webhook registered, waiting for updates...")
+        try:
+            await stop_event.wait()
+        finally:
+            await receiver.stop()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+async def on_startup(application: Application) -> None:
+    """Starts background work that needs the running event loop."""
+    await broadcast_engine.resume_all(application.bot)
+    web_order_feed.start(application.bot)
+    web_order_feed.schedule()
+
+async def on_shutdown(application: Application) -> None:
+    """Stops background work before the application exits."""
+    web_order_feed.stop()
+    await broadcast_engine.stop()
+    await proof_archiver.stop()
+    await profile_refresher.flush_observed()
+
+def build_application() -> Application:
+    """Creates the application with all handlers and background jobs registered."""
+    # Create the application
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .base_file_url(TELEGRAM_FILE_URL)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .get_updates_request(InstrumentedRequest(connection_pool_size=1))
+        .rate_limiter(OutboundQueue())
+        .persistence(SQLitePersistence())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    
+    # ConversationHandler for the entire bot
+    conv_handler = ConversationHandler(
+        entry_points=[
+            CommandHandler("start", start),
+            CallbackQueryHandler(admin_reject_proof_with_comment, pattern="^reject_proof_")
+        ],
+        states={
+            STATE_MAIN_MENU: [
+                CallbackQueryHandler(start, pattern="^main_menu$"),
+                CallbackQueryHandler(price_list, pattern="^price_list$"),
+                CallbackQueryHandler(my_account, pattern="^my_account$"),
+                CallbackQueryHandler(order_service_start, pattern="^order_service_start$"),
+                CallbackQueryHandler(start_admin_chat, pattern="^contact_admin$"),
+                CallbackQueryHandler(admin_panel, pattern="^admin_panel$"),
+                CallbackQueryHandler(admin_stats, pattern="^admin_stats$"),
+                CallbackQueryHandler(admin_users_list, pattern="^admin_users_(list$|page:)"),
+                CallbackQueryHandler(admin_orders_list, pattern="^admin_orders_(list$|page:)"),
+                CallbackQueryHandler(admin_web_orders_list, pattern="^admin_web_orders_(list$|page:)"),
+                CallbackQueryHandler(admin_manage_services, pattern="^admin_manage_services$"),
+                CallbackQueryHandler(admin_add_service_start, pattern="^admin_add_service$"),
+                CallbackQueryHandler(admin_delete_service_start, pattern="^admin_delete_service_start$"),
+                CallbackQueryHandler(admin_toggle_service_select, pattern="^admin_toggle_service_select$"),
+                CallbackQueryHandler(admin_toggle_service, pattern="^admin_toggle_service_\\d+$"),
+                CallbackQueryHandler(admin_manage_admins, pattern="^admin_manage_admins$"),
+                CallbackQueryHandler(admin_add_start, pattern="^admin_add_start$"),
+                CallbackQueryHandler(admin_remove_start, pattern="^admin_remove_start$"),
+                CallbackQueryHandler(admin_broadcast_start, pattern="^admin_broadcast_start$"),
+            ],
+            STATE_SELECTING_SERVICE: [
+                CallbackQueryHandler(select_service, pattern="^select_service_"),
+                CallbackQueryHandler(cancel_flow, pattern="^cancel_order$")
+            ],
+            STATE_SELECTING_PAYMENT: [
+                CallbackQueryHandler(select_payment, pattern="^pay_"),
+                CallbackQueryHandler(cancel_flow, pattern="^cancel_order$")
+            ],
+            STATE_UPLOADING_PROOF: [
+                MessageHandler(filters.PHOTO | filters.Document.ALL & ~filters.COMMAND, upload_payment_proof),
+                CommandHandler("cancel", cancel_flow)
+            ],
+            STATE_USER_TO_ADMIN_CHAT: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_user_to_admin_message),
+                CallbackQueryHandler(cancel_flow, pattern="^main_menu$")
+            ],
+            STATE_ADMIN_ADD_ID: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, admin_add_receive_id),
+                CommandHandler("cancel", cancel_flow)
+            ],
+            STATE_ADMIN_REMOVE_ID: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, admin_remove_receive_id),
+                CommandHandler("cancel", cancel_flow)
+            ],
+            STATE_ADMIN_BROADCAST_MESSAGE: [  # Corrected state name
+                MessageHandler(filters.TEXT & ~filters.COMMAND, admin_broadcast_receive_message),
+                CommandHandler("cancel", cancel_flow)
+            ],
+            STATE_ADMIN_ADD_SERVICE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, admin_add_service_receive_data),
+                CommandHandler("cancel", cancel_flow)
+            ],
+            STATE_ADMIN_MANAGE_SERVICES: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, admin_delete_service_confirm),
+                CommandHandler("cancel", cancel_flow)
+            ],
+            STATE_ADMIN_REJECT_PROOF: [ # Added handler for rejecting proof
+                MessageHandler(filters.TEXT & ~filters.COMMAND, save_reject_comment),
+                CommandHandler("cancel", cancel_flow)
+            ],
+        },
+        fallbacks=[
+            CommandHandler("start", start),
+            CommandHandler("cancel", cancel_flow),
+            # Rejecting a proof starts its own state from wherever the admin is, like approving it
+            CallbackQueryHandler(admin_reject_proof_with_comment, pattern="^reject_proof_"),
+        ],
+        name="main_conversation",
+        persistent=True,
+    )
+
+    # Register the ConversationHandler
+    application.add_handler(conv_handler)
+    
+    # Register the admin reply handler, which should work outside the conversation
+    application.add_handler(MessageHandler(filters.REPLY & AdminFilter() & filters.TEXT, handle_admin_reply))
+
+    # Proof approval works from every admin's copy, whatever state their chat is in
+    application.add_handler(CallbackQueryHandler(admin_handle_proof, pattern="^approve_proof_\\d+$"))
+
+    # Admin-only handler statistics
+    application.add_handler(CommandHandler("metrics", show_metrics))
+
+    # Record profiles seen on incoming updates before any other handler runs
+    application.add_handler(TypeHandler(Update, observe_user), group=-1)
+
+    # Time every handler registered above
+    for group_handlers in application.handlers.values():
+        instrument_handlers(group_handlers)
+
+    # Refresh stale user profiles in the background and write observed ones in batches
+    application.job_queue.run_repeating(
+        lambda ctx: profile_refresher.refresh_stale(ctx.bot),
+        interval=PROFILE_REFRESH_INTERVAL,
+        first=60
+    )
+    application.job_queue.run_repeating(
+        lambda ctx: profile_refresher.flush_observed(),
+        interval=PROFILE_FLUSH_INTERVAL,
+        first=PROFILE_FLUSH_INTERVAL
+    )
+    
+    # Archive payment proofs that were not downloaded yet (failures, restarts)
+    application.job_queue.run_repeating(
+        lambda ctx: proof_archiver.archive_pending(ctx.bot),
+        interval=PROOF_ARCHIVE_INTERVAL,
+        first=30
+    )
+
+    # Catch up on web orders in case a nudge from the server was lost
+    application.job_queue.run_repeating(
+        lambda ctx: web_order_feed.check(),
+        interval=WEB_ORDER_CHECK_INTERVAL,
+        first=WEB_ORDER_CHECK_INTERVAL
+    )
+
+    # Keep the admin and service caches in sync with changes made outside the bot
+    application.job_queue.run_repeating(
+        lambda ctx: refresh_caches(),
+        interval=CACHE_CHECK_INTERVAL,
+        first=CACHE_CHECK_INTERVAL
+    )
+
+    # Export handler and API statistics for external monitoring
+    application.job_queue.run_repeating(
+        metrics.export_job,
+        interval=METRICS_EXPORT_INTERVAL,
+        first=METRICS_EXPORT_INTERVAL
+    )
+
+    # Schedule periodic status updates
+    application.job_queue.run_repeating(
+        lambda ctx: asyncio.to_thread(update_status_file),
+        interval=30,  # Update every 30 seconds
+        first=10
+    )
+    return application
+
 def main() -> None:
     """The main function to set up and run the bot."""
     logger.info("🤖 Starting Rootzsu Telegram Bot...")
@@ -952,99 +3005,24 @@ def main() -> None:
     try:
         # Setup database
         setup_database(initial_admin_id=INITIAL_ADMIN_ID)
+        admin_cache.load(database.connection())
         
-        # Create the application
-        application = Application.builder().token(BOT_TOKEN).build()
+        application = build_application()
         
         # Update status file
         update_status_file()
 
-        # ConversationHandler for the entire bot
-        conv_handler = ConversationHandler(
-            entry_points=[CommandHandler("start", start)],
-            states={
-                STATE_MAIN_MENU: [
-                    CallbackQueryHandler(start, pattern="^main_menu$"),
-                    CallbackQueryHandler(price_list, pattern="^price_list$"),
-                    CallbackQueryHandler(my_account, pattern="^my_account$"),
-                    CallbackQueryHandler(order_service_start, pattern="^order_service_start$"),
-                    CallbackQueryHandler(start_admin_chat, pattern="^contact_admin$"),
-                    CallbackQueryHandler(admin_panel, pattern="^admin_panel$"),
-                    CallbackQueryHandler(admin_stats, pattern="^admin_stats$"),
-                    CallbackQueryHandler(admin_users_list, pattern="^admin_users_list$"),
-                    CallbackQueryHandler(admin_orders_list, pattern="^admin_orders_list$"),
-                    CallbackQueryHandler(admin_manage_services, pattern="^admin_manage_services$"),
-                    CallbackQueryHandler(admin_add_service_start, pattern="^admin_add_service$"),
-                    CallbackQueryHandler(admin_delete_service_start, pattern="^admin_delete_service_start$"),
-                    CallbackQueryHandler(admin_manage_admins, pattern="^admin_manage_admins$"),
-                    CallbackQueryHandler(admin_add_start, pattern="^admin_add_start$"),
-                    CallbackQueryHandler(admin_remove_start, pattern="^admin_remove_start$"),
-                    CallbackQueryHandler(admin_broadcast_start, pattern="^admin_broadcast_start$"),
-                    # Admin action for rejecting a proof, which starts a new state
-                    CallbackQueryHandler(admin_reject_proof_with_comment, pattern="^reject_proof_")
-                ],
-                STATE_SELECTING_SERVICE: [
-                    CallbackQueryHandler(select_service, pattern="^select_service_"),
-                    CallbackQueryHandler(cancel_flow, pattern="^cancel_order$")
-                ],
-                STATE_SELECTING_PAYMENT: [
-                    CallbackQueryHandler(select_payment, pattern="^pay_"),
-                    CallbackQueryHandler(cancel_flow, pattern="^cancel_order$")
-                ],
-                STATE_UPLOADING_PROOF: [
-                    MessageHandler(filters.PHOTO | filters.Document.ALL & ~filters.COMMAND, upload_payment_proof),
-                    CommandHandler("cancel", cancel_flow)
-                ],
-                STATE_USER_TO_ADMIN_CHAT: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_user_to_admin_message),
-                    CallbackQueryHandler(cancel_flow, pattern="^main_menu$")
-                ],
-                STATE_ADMIN_ADD_ID: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, admin_add_receive_id),
-                    CommandHandler("cancel", cancel_flow)
-                ],
-                STATE_ADMIN_REMOVE_ID: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, admin_remove_receive_id),
-                    CommandHandler("cancel", cancel_flow)
-                ],
-                STATE_ADMIN_BROADCAST_MESSAGE: [  # Corrected state name
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, admin_broadcast_receive_message),
-                    CommandHandler("cancel", cancel_flow)
-                ],
-                STATE_ADMIN_REJECT_PROOF: [ # Added handler for rejecting proof
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, save_reject_comment),
-                    CommandHandler("cancel", cancel_flow)
-                ],
-            },
-            fallbacks=[CommandHandler("start", start), CommandHandler("cancel", cancel_flow)],
-        )
-
-        # Register the ConversationHandler
-        application.add_handler(conv_handler)
-        
-        # Register the admin reply handler, which should work outside the conversation
-        application.add_handler(MessageHandler(filters.REPLY & filters.User(ADMIN_CHAT_ID) & filters.TEXT, handle_admin_reply))
-
-        # Schedule the username update task
-        application.job_queue.run_once(
-            lambda ctx: update_all_usernames(application),
-            when=1
-        )
-        
-        # Schedule periodic status updates
-        application.job_queue.run_repeating(
-            lambda ctx: update_status_file(),
-            interval=30,  # Update every 30 seconds
-            first=10
-        )
-
-        logger.info("✅ Bot setup completed, starting polling...")
-        
-        # Start the bot
-        application.run_polling(
-            drop_pending_updates=True,
-            allowed_updates=Update.ALL_TYPES
-        )
+        if BOT_MODE == "webhook":
+            if not WEBHOOK_URL:
+                raise RuntimeError("WEBHOOK_URL must be set when BOT_MODE=webhook")
+            logger.info("✅ Bot setup completed, starting webhook receiver...")
+            asyncio.run(run_webhook(application))
+        else:
+            logger.info("✅ Bot setup completed, starting polling...")
+            application.run_polling(
+                drop_pending_updates=True,
+                allowed_updates=Update.ALL_TYPES
+            )
         
     except Exception as e:
         logger.error(f"❌ Bot startup failed: {e}")
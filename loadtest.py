@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+"""
+Offline load test for the Telegram bot.
+
+Starts a fake Telegram Bot API on localhost, points bot.py at it through
+TELEGRAM_API_URL / TELEGRAM_FILE_URL and drives virtual users through
+/start -> order_service_start -> select_service -> pay -> proof upload,
+while admins approve the incoming proofs. A broadcast to every virtual user
+runs at the end. Everything runs against a throwaway database.
+
+Reports update throughput, per-step latency percentiles (update sent ->
+bot's answer seen by the fake API), Bot API call counts and the bot's own
+handler and SQLite metrics.
+
+    python loadtest.py --users 2000 --concurrency 200
+    python loadtest.py --users 500 --mode webhook --api-latency 0.05 --flood-limit 30
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import itertools
+import collections
+import urllib.parse
+
+import httpx
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger("loadtest")
+
+BOT_USER = {"id": 1000000, "is_bot": True, "first_name": "LoadTestBot", "username": "loadtest_bot"}
+FIRST_USER_ID = 5000000
+STEP_TIMEOUT = 60  # seconds to wait for the bot's answer to one step
+
+# Form parameters that PTB sends JSON-encoded
+JSON_PARAMS = {"chat_id", "from_chat_id", "message_id", "offset", "limit", "timeout", "reply_markup",
+               "allowed_updates", "entities", "caption_entities", "show_alert"}
+SENDING_METHODS = {"sendMessage", "sendPhoto", "sendDocument", "forwardMessage", "copyMessage",
+                   "editMessageText", "editMessageCaption", "editMessageReplyMarkup"}
+
+
+class FakeBotAPI:
+    """Just enough of the Bot API for bot.py, served over HTTP/1.1 keep-alive.
+
+    Messages the bot sends or edits are published per chat, so the simulator
+    can wait for the answer to a step and read its inline keyboard.
+    `latency` delays every response; `flood_limit` answers 429 once more
+    than that many messages per second are sent.
+    """
+
+    def __init__(self, latency: float = 0.0, flood_limit: int = 0):
+        self.latency = latency
+        self.flood_limit = flood_limit
+        self.calls = collections.Counter()
+        self.floods = 0
+        self.updates = asyncio.Queue()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._outboxes = collections.defaultdict(asyncio.Queue)
+        self._window = collections.deque()
+        self._server = None
+        self._connections = set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+
+    async def stop(self) -> None:
+        self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    def outbox(self, chat_id: int) -> asyncio.Queue:
+        return self._outboxes[chat_id]
+
+    def make_update(self, **payload) -> dict:
+        return {"update_id": next(self._update_ids), **payload}
+
+    def new_message_id(self) -> int:
+        return next(self._message_ids)
+
+    # --- HTTP ---
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                http_method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                status, content_type, payload = await self._route(http_method, path, headers, body)
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n"
+                    f"Connection: keep-alive\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, asyncio.CancelledError):
+            pass  # client went away, or the API is stopping
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _route(self, http_method: str, path: str, headers: dict, body: bytes):
+        path = path.split("?", 1)[0]
+        if path.startswith("/file/"):
+            # Downloads of proofs; content depends on file_id so duplicates can be provoked
+            file_id = path.rsplit("/", 1)[-1].split(".", 1)[0]
+            return "200 OK", "application/octet-stream", f"receipt:{file_id}".encode()
+        api_method = path.rsplit("/", 1)[-1]
+        params = self._parse_params(headers.get("content-type", ""), body)
+        self.calls[api_method] += 1
+        if api_method in SENDING_METHODS and self._flooded():
+            self.floods += 1
+            payload = {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                       "parameters": {"retry_after": 1}}
+            return "429 Too Many Requests", "application/json", json.dumps(payload).encode()
+        result = await self._call(api_method, params)
+        return "200 OK", "application/json", json.dumps({"ok": True, "result": result}).encode()
+
+    @staticmethod
+    def _parse_params(content_type: str, body: bytes) -> dict:
+        if "application/json" in content_type:
+            return json.loads(body or b"{}")
+        params = {}
+        for key, value in urllib.parse.parse_qsl(body.decode(), keep_blank_values=True):
+            params[key] = json.loads(value) if key in JSON_PARAMS else value
+        return params
+
+    def _flooded(self) -> bool:
+        if not self.flood_limit:
+            return False
+        now = time.monotonic()
+        while self._window and now - self._window[0] > 1:
+            self._window.popleft()
+        if len(self._window) >= self.flood_limit:
+            return True
+        self._window.append(now)
+        return False
+
+    # --- Bot API methods ---
+    async def _call(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method == "getChat":
+            chat_id = params["chat_id"]
+            return {"id": chat_id, "type": "private", "first_name": f"User{chat_id}", "username": f"user{chat_id}",
+                    "accent_color_id": 0, "max_reaction_count": 11}
+        if method == "getFile":
+            file_id = params["file_id"]
+            return {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_size": 16,
+                    "file_path": f"photos/{file_id}.jpg"}
+        if method in ("sendMessage", "sendPhoto", "sendDocument", "forwardMessage", "copyMessage"):
+            return self._publish(method, params, new=True)
+        if method in ("editMessageText", "editMessageCaption", "editMessageReplyMarkup"):
+            return self._publish(method, params, new=False)
+        return True  # answerCallbackQuery, setWebhook, deleteWebhook, setMyCommands, ...
+
+    async def _get_updates(self, params: dict) -> list:
+        if self.updates.empty():
+            try:
+                first = await asyncio.wait_for(self.updates.get(), params.get("timeout") or 0.01)
+            except asyncio.TimeoutError:
+                return []
+            batch = [first]
+        else:
+            batch = []
+        while len(batch) < (params.get("limit") or 100) and not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    def _publish(self, method: str, params: dict, new: bool) -> dict:
+        chat_id = params["chat_id"]
+        message = {
+            "message_id": self.new_message_id() if new else params["message_id"],
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        if method == "sendPhoto":
+            message["photo"] = [{"file_id": params["photo"], "file_unique_id": f"u{params['photo']}",
+                                 "width": 1, "height": 1}]
+        if method == "sendDocument":
+            message["document"] = {"file_id": params["document"], "file_unique_id": f"u{params['document']}"}
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        self.outbox(chat_id).put_nowait((method, message, time.perf_counter()))
+        return message
+
+
+def buttons(message: dict) -> list:
+    """callback_data of every inline button in a message."""
+    keyboard = (message.get("reply_markup") or {}).get("inline_keyboard", [])
+    return [button.get("callback_data") for row in keyboard for button in row if button.get("callback_data")]
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+class Simulator:
+    """Drives virtual users and admins by injecting updates and waiting for answers."""
+
+    def __init__(self, api: FakeBotAPI, deliver, step_timeout: float = STEP_TIMEOUT):
+        self.api = api
+        self.deliver = deliver
+        self.step_timeout = step_timeout
+        self.latencies = collections.defaultdict(list)
+        self.updates_sent = 0
+        self.completed = 0
+        self.failed = collections.Counter()
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    async def send_text(self, user_id: int, text: str, photo: str = None) -> float:
+        message = {"message_id": self.api.new_message_id(), "date": int(time.time()),
+                   "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id)}
+        if photo:
+            message["photo"] = [{"file_id": photo, "file_unique_id": f"u{photo}", "width": 1, "height": 1}]
+        else:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return await self._deliver(self.api.make_update(message=message))
+
+    async def click(self, user_id: int, message: dict, data: str) -> float:
+        query = {"id": str(self.api.new_message_id()), "from": self._user(user_id),
+                 "chat_instance": str(user_id), "data": data, "message": message}
+        return await self._deliver(self.api.make_update(callback_query=query))
+
+    async def _deliver(self, update: dict) -> float:
+        sent_at = time.perf_counter()
+        await self.deliver(update)
+        self.updates_sent += 1
+        return sent_at
+
+    async def expect(self, chat_id: int, predicate, step: str, sent_at: float) -> dict:
+        """Waits for the bot's message in chat_id that satisfies predicate; records the step latency."""
+        outbox = self.api.outbox(chat_id)
+        deadline = time.monotonic() + self.step_timeout
+        while True:
+            method, message, seen_at = await asyncio.wait_for(outbox.get(), max(0.0, deadline - time.monotonic()))
+            if predicate(method, message):
+                self.latencies[step].append(seen_at - sent_at)
+                return message
+
+    async def user_flow(self, user_id: int, duplicate_receipt: bool) -> None:
+        step = "start"
+        try:
+            sent = await self.send_text(user_id, "/start")
+            menu = await self.expect(user_id, lambda m, msg: "order_service_start" in buttons(msg), step, sent)
+
+            step = "order_service_start"
+            sent = await self.click(user_id, menu, "order_service_start")
+            services = await self.expect(user_id, lambda m, msg: any(
+                b.startswith("select_service_") for b in buttons(msg)), step, sent)
+
+            step = "select_service"
+            choice = random.choice([b for b in buttons(services) if b.startswith("select_service_")])
+            sent = await self.click(user_id, services, choice)
+            payment = await self.expect(user_id, lambda m, msg: "pay_usd" in buttons(msg), step, sent)
+
+            step = "select_payment"
+            sent = await self.click(user_id, payment, random.choice(["pay_usd", "pay_btc", "pay_uah"]))
+            await self.expect(user_id, lambda m, msg: m.startswith("edit"), step, sent)
+
+            step = "upload_payment_proof"
+            receipt = "shared-receipt" if duplicate_receipt else f"receipt{user_id}"
+            sent = await self.send_text(user_id, "", photo=receipt)
+            await self.expect(user_id, lambda m, msg: "принят" in (msg.get("text") or ""), step, sent)
+            self.completed += 1
+        except asyncio.TimeoutError:
+            self.failed[step] += 1
+
+    async def approver(self, admin_id: int) -> None:
+        """Approves every proof notification that reaches this admin."""
+        outbox = self.api.outbox(admin_id)
+        pending = {}
+        while True:
+            method, message, seen_at = await outbox.get()
+            if message["message_id"] in pending and method.startswith("edit"):
+                # The admin's copy is edited once the decision is recorded
+                self.latencies["approve_proof"].append(seen_at - pending.pop(message["message_id"]))
+                continue
+            approve = next((b for b in buttons(message) if b.startswith("approve_proof_")), None)
+            if approve is not None and method in ("sendPhoto", "sendDocument"):
+                pending[message["message_id"]] = await self.click(admin_id, message, approve)
+
+    async def broadcast(self, admin_id: int, text: str) -> dict:
+        """Runs a broadcast as the admin and waits until its progress message says it finished."""
+        sent = await self.send_text(admin_id, "/start")
+        menu = await self.expect(admin_id, lambda m, msg: "admin_panel" in buttons(msg), "admin_start", sent)
+        sent = await self.click(admin_id, menu, "admin_panel")
+        panel = await self.expect(admin_id, lambda m, msg: "admin_broadcast_start" in buttons(msg), "admin_panel", sent)
+        sent = await self.click(admin_id, panel, "admin_broadcast_start")
+        await self.expect(admin_id, lambda m, msg: m.startswith("edit"), "admin_broadcast_start", sent)
+        started = await self.send_text(admin_id, text)
+        progress = await self.expect(admin_id, lambda m, msg: "Рассылка" in (msg.get("text") or ""),
+                                     "broadcast_accepted", started)
+        old_timeout, self.step_timeout = self.step_timeout, 3600
+        try:
+            await self.expect(admin_id, lambda m, msg: msg["message_id"] == progress["message_id"]
+                              and "завершена" in (msg.get("text") or ""), "broadcast_total", started)
+        finally:
+            self.step_timeout = old_timeout
+        return progress
+
+
+def report(args, sim: Simulator, api: FakeBotAPI, elapsed: float, bot_metrics: dict, broadcast_time) -> dict:
+    steps = {}
+    for step, values in sim.latencies.items():
+        steps[step] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+            "max_ms": round(max(values) * 1000, 1),
+        }
+    handler_time = sum(stat["total_s"] for stat in bot_metrics["handlers"].values())
+    handler_db_time = sum(stat["db_s"] for stat in bot_metrics["handlers"].values())
+    return {
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 2),
+        "updates_sent": sim.updates_sent,
+        "updates_per_s": round(sim.updates_sent / elapsed, 1) if elapsed else 0.0,
+        "flows_completed": sim.completed,
+        "flows_failed": dict(sim.failed),
+        "steps": steps,
+        "broadcast_s": round(broadcast_time, 2) if broadcast_time is not None else None,
+        "api_calls": dict(api.calls.most_common()),
+        "api_floods": api.floods,
+        "db": bot_metrics["db"],
+        "db_share_of_handler_time": round(handler_db_time / handler_time, 3) if handler_time else 0.0,
+        "handlers": bot_metrics["handlers"],
+    }
+
+
+def print_report(result: dict) -> None:
+    print(f"\n=== Load test: {result['config']['users']} users, mode={result['config']['mode']} ===")
+    print(f"Elapsed {result['elapsed_s']} s, {result['updates_sent']} updates, "
+          f"{result['updates_per_s']} updates/s, completed {result['flows_completed']}, "
+          f"failed {result['flows_failed'] or 0}")
+    print(f"\n{'step':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step, stat in result["steps"].items():
+        print(f"{step:<24}{stat['count']:>8}{stat['p50_ms']:>10}{stat['p95_ms']:>10}"
+              f"{stat['p99_ms']:>10}{stat['max_ms']:>10}")
+    if result["broadcast_s"] is not None:
+        print(f"\nBroadcast to {result['config']['users']} users took {result['broadcast_s']} s")
+    db = result["db"]
+    print(f"\nSQLite: {db['count']} statements, avg {db['avg_ms']} ms, max {db['max_ms']} ms "
+          f"(includes executor queue wait); {result['db_share_of_handler_time'] * 100:.1f}% of handler time")
+    print(f"\n{'handler':<36}{'calls':>8}{'avg ms':>10}{'max ms':>10}{'db q':>8}{'errors':>8}")
+    for name, stat in sorted(result["handlers"].items(), key=lambda item: -item[1]["total_s"]):
+        print(f"{name:<36}{stat['count']:>8}{stat['avg_ms']:>10}{stat['max_ms']:>10}"
+              f"{stat['db_queries']:>8}{stat['errors']:>8}")
+    print(f"\nBot API calls: {result['api_calls']}, 429 answers: {result['api_floods']}")
+
+
+async def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="bot-loadtest-")
+    api = FakeBotAPI(latency=args.api_latency, flood_limit=args.flood_limit)
+    await api.start()
+
+    # bot.py reads its configuration at import time
+    os.environ.update({
+        "BOT_DB_FILE": os.path.join(workdir, "bot.db"),
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{api.port}/bot",
+        "TELEGRAM_FILE_URL": f"http://127.0.0.1:{api.port}/file/bot",
+        "PROOF_ARCHIVE_DIR": os.path.join(workdir, "proof_archive"),
+        "ORDER_EVENTS_SOCKET": os.path.join(workdir, "order_events.sock"),
+    })
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    import bot
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    admin_ids = [bot.INITIAL_ADMIN_ID] + [FIRST_USER_ID - 1 - i for i in range(args.admins - 1)]
+    bot.setup_database(initial_admin_id=bot.INITIAL_ADMIN_ID)
+    with bot.database.transaction() as conn:
+        for admin_id in admin_ids:
+            conn.execute("INSERT OR IGNORE INTO users (user_id, first_name, join_date) VALUES (?, ?, ?)",
+                         (admin_id, f"Admin{admin_id}", time.strftime("%Y-%m-%dT%H:%M:%S")))
+            conn.execute("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (admin_id,))
+    bot.admin_cache.load(bot.database.connection())
+    application = bot.build_application()
+
+    receiver = None
+    if args.mode == "webhook":
+        receiver = bot.WebhookReceiver(application, "/webhook", "loadtest-secret", bot.WEBHOOK_MAX_BACKLOG)
+        client = httpx.AsyncClient(limits=httpx.Limits(max_connections=args.concurrency))
+
+        async def deliver(update: dict) -> None:
+            while True:
+                response = await client.post(f"http://127.0.0.1:{receiver.port}/webhook", json=update,
+                                             headers={"X-Telegram-Bot-Api-Secret-Token": "loadtest-secret"})
+                if response.status_code != 503:
+                    return
+                await asyncio.sleep(0.05)  # backlog full; Telegram would redeliver later
+    else:
+        async def deliver(update: dict) -> None:
+            api.updates.put_nowait(update)
+
+    sim = Simulator(api, deliver)
+    broadcast_time = None
+    async with application:
+        await application.post_init(application)
+        await application.start()
+        if receiver is not None:
+            await receiver.start("127.0.0.1", 0)
+        else:
+            await application.updater.start_polling(poll_interval=0, timeout=10)
+        approvers = [asyncio.create_task(sim.approver(admin_ids[0]))]
+        # Other admins' copies are drained so their queues don't grow
+        approvers += [asyncio.create_task(drain(api.outbox(a))) for a in admin_ids[1:]]
+
+        logger.info(f"Running {args.users} user flows with concurrency {args.concurrency}...")
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited(user_id: int) -> None:
+            async with semaphore:
+                await sim.user_flow(user_id, random.random() < args.duplicate_share)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(FIRST_USER_ID + i) for i in range(args.users)))
+        deadline = time.monotonic() + STEP_TIMEOUT
+        while len(sim.latencies["approve_proof"]) < sim.completed and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)  # let the last approvals land
+        elapsed = time.perf_counter() - started
+        for task in approvers:
+            task.cancel()
+
+        if not args.no_broadcast:
+            logger.info("Running broadcast...")
+            broadcast_started = time.perf_counter()
+            drains = [asyncio.create_task(drain(api.outbox(FIRST_USER_ID + i))) for i in range(args.users)]
+            await sim.broadcast(admin_ids[0], "Load test broadcast")
+            broadcast_time = time.perf_counter() - broadcast_started
+            for task in drains:
+                task.cancel()
+
+        if receiver is not None:
+            await receiver.stop()
+            await client.aclose()
+        else:
+            await application.updater.stop()
+        await application.stop()
+    await application.post_shutdown(application)
+    await api.stop()
+    result = report(args, sim, api, elapsed, bot.metrics.snapshot(), broadcast_time)
+    bot.db.close()
+    return result
+
+
+async def drain(queue: asyncio.Queue) -> None:
+    while True:
+        await queue.get()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for bot.py against a fake Bot API")
+    parser.add_argument("--users", type=int, default=1000, help="virtual users going through the order flow")
+    parser.add_argument("--concurrency", type=int, default=100, help="user flows in progress at once")
+    parser.add_argument("--admins", type=int, default=2, help="admins receiving proof notifications")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds added to every Bot API call")
+    parser.add_argument("--flood-limit", type=int, default=0, help="messages/s before the fake API answers 429")
+    parser.add_argument("--duplicate-share", type=float, default=0.0,
+                        help="fraction of users uploading the same receipt")
+    parser.add_argument("--no-broadcast", action="store_true", help="skip the broadcast phase")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    result = asyncio.run(run(args))
+    print_report(result)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,21 @@ Professional IT Services Platform
 """
 
 import os
+import re
 import sys
 import time
 import json
 import csv
+import bisect
+import fcntl
+import sqlite3
+import tempfile
 import hashlib
 import secrets
+import signal
 import logging
 import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from functools import wraps
 from pathlib import Path
@@ -20,12 +27,15 @@ from pathlib import Path
 import requests
 from flask import Flask, request, jsonify, send_from_directory, g, render_template_string, redirect, url_for
 from flask_cors import CORS
+from werkzeug.serving import make_server, WSGIRequestHandler
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 
+import storage
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -37,6 +47,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+PROCESS_STARTED = time.monotonic()
+
 # Flask app configuration
 app = Flask(__name__, static_folder='static', static_url_path='/static')
 
@@ -70,6 +82,9 @@ os.makedirs(DATABASE_FOLDER, exist_ok=True)
 os.makedirs(UPLOADS_FOLDER, exist_ok=True)
 os.makedirs('static/images', exist_ok=True)
 
+# Orders are shared with the Telegram bot (see storage.py)
+order_store = storage.OrderStore()
+
 # CSV Database setup
 def get_csv_path(table_name):
     """Get CSV file path for table"""
@@ -89,6 +104,16 @@ def read_csv_table(table_name):
         logger.error(f"Error reading CSV {table_name}: {e}")
         return []
 
+@contextmanager
+def csv_write_lock(table_name):
+    """Serializes writes to a CSV table across web worker processes"""
+    with open(get_csv_path(table_name) + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 def write_csv_table(table_name, data, fieldnames=None):
     """Write CSV table"""
     csv_path = get_csv_path(table_name)
@@ -99,11 +124,15 @@ def write_csv_table(table_name, data, fieldnames=None):
     if fieldnames is None:
         fieldnames = data[0].keys() if data else []
     
+    # Write a temporary file and swap it in, so other workers never read a partial table
+    tmp_path = f"{csv_path}.{os.getpid()}.tmp"
     try:
-        with open(csv_path, 'w', encoding='utf-8', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(data)
+        with csv_write_lock(table_name):
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(data)
+            os.replace(tmp_path, csv_path)
     except Exception as e:
         logger.error(f"Error writing CSV {table_name}: {e}")
 
@@ -111,27 +140,74 @@ def append_csv_table(table_name, row, fieldnames=None):
     """Append row to CSV table"""
     csv_path = get_csv_path(table_name)
     
-    # If file doesn't exist, create with header
-    if not os.path.exists(csv_path):
-        if fieldnames is None:
-            fieldnames = row.keys()
-        with open(csv_path, 'w', encoding='utf-8', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
-    
     try:
-        with open(csv_path, 'a', encoding='utf-8', newline='') as file:
-            if fieldnames is None:
-                # Read existing fieldnames
-                with open(csv_path, 'r', encoding='utf-8') as read_file:
-                    reader = csv.DictReader(read_file)
-                    fieldnames = reader.fieldnames
+        with csv_write_lock(table_name):
+            # If file doesn't exist, create with header
+            if not os.path.exists(csv_path):
+                if fieldnames is None:
+                    fieldnames = row.keys()
+                with open(csv_path, 'w', encoding='utf-8', newline='') as file:
+                    writer = csv.DictWriter(file, fieldnames=fieldnames)
+                    writer.writeheader()
             
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writerow(row)
+            with open(csv_path, 'a', encoding='utf-8', newline='') as file:
+                if fieldnames is None:
+                    # Read existing fieldnames
+                    with open(csv_path, 'r', encoding='utf-8') as read_file:
+                        reader = csv.DictReader(read_file)
+                        fieldnames = reader.fieldnames
+                
+                writer = csv.DictWriter(file, fieldnames=fieldnames)
+                writer.writerow(row)
     except Exception as e:
         logger.error(f"Error appending to CSV {table_name}: {e}")
 
+class TableIndex:
+    """Primary-key index over a CSV table, rebuilt only when the file changes.
+
+    The file's (mtime, size, inode) is checked on every lookup; a rewrite by
+    this or another worker process changes it and triggers one re-read.
+    """
+
+    def __init__(self, table_name, key_field):
+        self.table_name = table_name
+        self.key_field = key_field
+        self.rows = {}
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        try:
+            stat = os.stat(get_csv_path(self.table_name))
+            signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except OSError:
+            signature = None
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    self.rows = {row[self.key_field]: row for row in read_csv_table(self.table_name)}
+                    self._signature = signature
+        row = self.rows.get(key)
+        return dict(row) if row is not None else None
+
+table_indexes = {
+    'users': TableIndex('users', 'user_id'),
+    'services': TableIndex('services', 'service_id'),
+    'programs': TableIndex('programs', 'program_id'),
+    'news': TableIndex('news', 'news_id'),
+}
+
+def conditional_json(payload, private=False):
+    """JSON response with an ETag of its content; 304 if the client already has it"""
+    etag = hashlib.sha1(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache' if private else 'no-cache'
+    return response
+
 def init_database():
     """Initialize CSV database with tables"""
     
@@ -301,10 +377,17 @@ def init_database():
         write_csv_table('services', services_data)
     
     # Initialize other tables
-    for table in ['programs', 'news', 'orders', 'chat_messages', 'downloads']:
+    for table in ['programs', 'news', 'chat_messages', 'downloads']:
         if not os.path.exists(get_csv_path(table)):
             write_csv_table(table, [])
     
+    # Orders moved to the shared order store; import a leftover orders.csv once
+    orders_csv = get_csv_path('orders')
+    if os.path.exists(orders_csv):
+        imported = order_store.import_orders(read_csv_table('orders'))
+        os.replace(orders_csv, orders_csv + '.migrated')
+        logger.info(f"Imported {imported} orders from {orders_csv} into the order store")
+    
     logger.info("CSV Database initialized successfully")
 
 # Utility functions
@@ -379,6 +462,13 @@ def auth_required(f):
     
     return decorated_function
 
+def current_user_is_admin():
+    """Whether the authenticated user is an admin; None if the user doesn't exist"""
+    user = table_indexes['users'].get(g.current_user_id)
+    if user is None:
+        return None
+    return user.get('is_admin') == 'True' or user.get('email') in ADMIN_EMAILS
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -386,14 +476,10 @@ def admin_required(f):
             if not hasattr(g, 'current_user_id'):
                 return jsonify({'error': 'Authentication required'}), 401
             
-            users = read_csv_table('users')
-            user = next((u for u in users if u['user_id'] == g.current_user_id), None)
+            is_admin = current_user_is_admin()
             
-            if not user:
+            if is_admin is None:
                 return jsonify({'error': 'User not found'}), 401
-                
-            is_admin = (user.get('is_admin') == 'True' or 
-                       user.get('email') in ADMIN_EMAILS)
             
             if not is_admin:
                 return jsonify({'error': 'Admin access required'}), 403
@@ -427,31 +513,40 @@ def serve_spa(path):
 
 @app.route('/health')
 def health_check():
-    """Health check endpoint"""
+    """Liveness: answers from memory, no disk or database access"""
     return jsonify({
         'status': 'healthy',
         'service': 'Phantom Services',
         'timestamp': datetime.now().isoformat(),
+        'uptime': round(time.monotonic() - PROCESS_STARTED, 1),
         'version': '2.0.0'
     })
 
+@app.route('/ready')
+def readiness_check():
+    """Readiness from the status monitor's last checks"""
+    snapshot = status_monitor.snapshot
+    ready = status_monitor.is_ready() and not in_flight.draining
+    return jsonify({
+        'status': 'ready' if ready else 'not ready',
+        'draining': in_flight.draining,
+        'checked_at': snapshot['checked_at'],
+        'checks': snapshot['checks'],
+        'workers': snapshot['workers'],
+        'queues': {**snapshot['queues'], 'in_flight_requests': in_flight.count},
+    }), 200 if ready else 503
+
 @app.route('/api/status')
 def system_status():
-    """System status endpoint"""
-    try:
-        users = read_csv_table('users')
-        orders = read_csv_table('orders')
-        
-        return jsonify({
-            'status': 'online',
-            'users': len(users),
-            'orders': len(orders),
-            'uptime': time.time(),
-            'crypto_wallets': CRYPTO_WALLETS
-        })
-    except Exception as e:
-        logger.error(f"Status check error: {e}")
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+    """System status endpoint (counts are cached by the status monitor)"""
+    counts = status_monitor.snapshot['counts']
+    return jsonify({
+        'status': 'online',
+        'users': counts['users'],
+        'orders': counts['orders'],
+        'uptime': round(time.monotonic() - PROCESS_STARTED, 1),
+        'crypto_wallets': CRYPTO_WALLETS
+    })
 
 # Google OAuth routes
 @app.route('/auth/google')
@@ -582,8 +677,7 @@ def register():
         token = generate_token(user_id)
         
         # Get orders count
-        orders = read_csv_table('orders')
-        orders_count = len([o for o in orders if o['user_id'] == user_id])
+        orders_count = order_store.read(storage.count_user_orders, str(user_id))
         
         user_data = new_user.copy()
         user_data['orders_count'] = orders_count
@@ -626,8 +720,7 @@ def login():
         token = generate_token(user['user_id'])
         
         # Get orders count
-        orders = read_csv_table('orders')
-        orders_count = len([o for o in orders if o['user_id'] == user['user_id']])
+        orders_count = order_store.read(storage.count_user_orders, user['user_id'])
         
         user_data = user.copy()
         user_data['orders_count'] = orders_count
@@ -705,8 +798,7 @@ def google_login():
         token = generate_token(user_id)
         
         # Get orders count
-        orders = read_csv_table('orders')
-        orders_count = len([o for o in orders if o['user_id'] == user_id])
+        orders_count = order_store.read(storage.count_user_orders, str(user_id))
         
         user_data = user.copy()
         user_data['orders_count'] = orders_count
@@ -736,8 +828,7 @@ def get_current_user():
         is_admin = user['email'] in ADMIN_EMAILS if user['email'] else user['is_admin'] == 'True'
         
         # Get orders count
-        orders = read_csv_table('orders')
-        orders_count = len([o for o in orders if o['user_id'] == g.current_user_id])
+        orders_count = order_store.read(storage.count_user_orders, g.current_user_id)
         
         user_data = user.copy()
         user_data['orders_count'] = orders_count
@@ -756,6 +847,186 @@ def logout():
     """User logout"""
     return jsonify({'message': 'Logged out successfully'})
 
+# Catalog search
+# table -> (id field, visibility field, {indexed field: weight}, title field, snippet field)
+SEARCH_SOURCES = {
+    'services': ('service_id', 'is_active', {'name': 3, 'category': 2, 'description': 1}, 'name', 'description'),
+    'programs': ('program_id', 'is_active', {'name': 3, 'language': 2, 'description': 1}, 'name', 'description'),
+    'news': ('news_id', 'is_published', {'title': 3, 'content': 1}, 'title', 'content'),
+}
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+SEARCH_MIN_TOKEN = 2
+SEARCH_SNIPPET_LENGTH = 160
+SEARCH_TOKEN_RE = re.compile(r'[0-9a-zа-яіїєґ]+')
+# Endings stripped before indexing and matching, longest first ("stemming-lite")
+SEARCH_SUFFIXES = sorted([
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ых', 'их', 'ой', 'ей', 'ом', 'ем',
+    'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ые', 'ие', 'ую', 'юю', 'ая', 'яя', 'ий', 'ый',
+    'а', 'я', 'ы', 'и', 'у', 'ю', 'е', 'о', 'ь', 'й',
+    'ing', 'es', 's', 'ed',
+], key=len, reverse=True)
+SEARCH_MIN_STEM = 4
+# Query words are prefix-matched, so they may be cut shorter: "боты" -> "бот" still finds "бот" and "боты"
+SEARCH_MIN_QUERY_STEM = 3
+
+def search_terms(text, min_stem=SEARCH_MIN_STEM):
+    """Lowercased word stems of text; Cyrillic aware, ё folded to е"""
+    terms = []
+    for token in SEARCH_TOKEN_RE.findall(text.lower().replace('ё', 'е')):
+        for suffix in SEARCH_SUFFIXES:
+            if token.endswith(suffix) and len(token) - len(suffix) >= min_stem:
+                token = token[:-len(suffix)]
+                break
+        terms.append(token)
+    return terms
+
+class SearchIndex:
+    """In-memory inverted index over services, programs and news.
+
+    Postings map a stem to {(table, id): weight}; stems are also kept in a
+    sorted list so a query word matches every stem it is a prefix of.
+    Admin create/delete calls add()/remove() directly. Changes made by
+    other web workers are picked up by rebuilding a table when its CSV
+    mtime no longer matches the one recorded at the last sync.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.terms = []
+        self.docs = {}
+        self.synced_mtime = {}
+        self._lock = threading.Lock()
+
+    def _mtime(self, table):
+        try:
+            return os.stat(get_csv_path(table)).st_mtime_ns
+        except OSError:
+            return None
+
+    def ensure_fresh(self):
+        for table in SEARCH_SOURCES:
+            mtime = self._mtime(table)
+            if mtime != self.synced_mtime.get(table):
+                self.rebuild(table, mtime)
+
+    def rebuild(self, table, mtime):
+        rows = read_csv_table(table)
+        with self._lock:
+            for key in [key for key in self.docs if key[0] == table]:
+                self._remove(key)
+            for row in rows:
+                self._add(table, row)
+            self.synced_mtime[table] = mtime
+
+    def add(self, table, row):
+        with self._lock:
+            self._add(table, row)
+            self.synced_mtime[table] = self._mtime(table)
+
+    def remove(self, table, doc_id):
+        with self._lock:
+            self._remove((table, doc_id))
+            self.synced_mtime[table] = self._mtime(table)
+
+    def _add(self, table, row):
+        id_field, visible_field, fields, title_field, snippet_field = SEARCH_SOURCES[table]
+        if row.get(visible_field) != 'True':
+            return
+        key = (table, row[id_field])
+        self._remove(key)
+        weights = {}
+        for field, weight in fields.items():
+            for term in search_terms(row.get(field) or ''):
+                weights[term] = weights.get(term, 0) + weight
+        for term, weight in weights.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                bisect.insort(self.terms, term)
+            self.postings[term][key] = weight
+        self.docs[key] = {
+            'type': table,
+            'id': row[id_field],
+            'title': row.get(title_field, ''),
+            'snippet': (row.get(snippet_field) or '')[:SEARCH_SNIPPET_LENGTH],
+            'terms': list(weights),
+        }
+
+    def _remove(self, key):
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        for term in doc['terms']:
+            posting = self.postings[term]
+            posting.pop(key, None)
+            if not posting:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+
+    def search(self, query, table=None):
+        """Ranked matches for every query word (AND); exact stems score higher than prefixes"""
+        # (prefix to match, stem as indexed) per query word
+        words = [(word, stem) for word, stem in zip(search_terms(query, SEARCH_MIN_QUERY_STEM), search_terms(query))
+                 if len(word) >= SEARCH_MIN_TOKEN]
+        if not words:
+            return []
+        with self._lock:
+            scores = None
+            for word, stem in words:
+                word_scores = {}
+                index = bisect.bisect_left(self.terms, word)
+                while index < len(self.terms) and self.terms[index].startswith(word):
+                    term = self.terms[index]
+                    factor = 1.0 if term in (word, stem) else 0.5
+                    for key, weight in self.postings[term].items():
+                        if table is None or key[0] == table:
+                            word_scores[key] = max(word_scores.get(key, 0), weight * factor)
+                    index += 1
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {key: score + word_scores[key] for key, score in scores.items() if key in word_scores}
+                if not scores:
+                    return []
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], self.docs[item[0]]['title']))
+            return [
+                {**{k: v for k, v in self.docs[key].items() if k != 'terms'}, 'score': score}
+                for key, score in ranked
+            ]
+
+search_index = SearchIndex()
+
+@app.route('/api/search', methods=['GET'])
+def search_catalog():
+    """Search services, programs and news"""
+    query = request.args.get('q', '').strip()
+    table = request.args.get('type') or None
+    if table is not None and table not in SEARCH_SOURCES:
+        return jsonify({'error': f"type must be one of: {', '.join(SEARCH_SOURCES)}"}), 400
+    if len(query) < SEARCH_MIN_TOKEN:
+        return jsonify({'error': f'Query must be at least {SEARCH_MIN_TOKEN} characters'}), 400
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = min(SEARCH_MAX_PAGE_SIZE, max(1, int(request.args.get('per_page', SEARCH_PAGE_SIZE))))
+    except ValueError:
+        return jsonify({'error': 'page and per_page must be integers'}), 400
+    
+    try:
+        search_index.ensure_fresh()
+        results = search_index.search(query, table)
+        start = (page - 1) * per_page
+        return jsonify({
+            'query': query,
+            'total': len(results),
+            'page': page,
+            'per_page': per_page,
+            'results': results[start:start + per_page]
+        })
+        
+    except Exception as e:
+        logger.error(f"Search error: {e}")
+        return jsonify({'error': 'Search failed'}), 500
+
 # Services routes
 @app.route('/api/services', methods=['GET'])
 def get_services():
@@ -774,6 +1045,21 @@ def get_services():
         logger.error(f"Get services error: {e}")
         return jsonify({'error': 'Failed to get services'}), 500
 
+@app.route('/api/services/<service_id>', methods=['GET'])
+def get_service(service_id):
+    """Get one active service"""
+    try:
+        service = table_indexes['services'].get(service_id)
+        if not service or service.get('is_active') != 'True':
+            return jsonify({'error': 'Service not found'}), 404
+        
+        service['price'] = float(service['price'])
+        return conditional_json(service)
+        
+    except Exception as e:
+        logger.error(f"Get service error: {e}")
+        return jsonify({'error': 'Failed to get service'}), 500
+
 # Programs routes
 @app.route('/api/programs', methods=['GET'])
 def get_programs():
@@ -787,6 +1073,19 @@ def get_programs():
         logger.error(f"Get programs error: {e}")
         return jsonify({'error': 'Failed to get programs'}), 500
 
+@app.route('/api/programs/<program_id>', methods=['GET'])
+def get_program(program_id):
+    """Get one active program"""
+    try:
+        program = table_indexes['programs'].get(program_id)
+        if not program or program.get('is_active') != 'True':
+            return jsonify({'error': 'Program not found'}), 404
+        return conditional_json(program)
+        
+    except Exception as e:
+        logger.error(f"Get program error: {e}")
+        return jsonify({'error': 'Failed to get program'}), 500
+
 # News routes
 @app.route('/api/news', methods=['GET'])
 def get_news():
@@ -800,6 +1099,19 @@ def get_news():
         logger.error(f"Get news error: {e}")
         return jsonify({'error': 'Failed to get news'}), 500
 
+@app.route('/api/news/<news_id>', methods=['GET'])
+def get_news_item(news_id):
+    """Get one published news item"""
+    try:
+        news_item = table_indexes['news'].get(news_id)
+        if not news_item or news_item.get('is_published') != 'True':
+            return jsonify({'error': 'News not found'}), 404
+        return conditional_json(news_item)
+        
+    except Exception as e:
+        logger.error(f"Get news item error: {e}")
+        return jsonify({'error': 'Failed to get news'}), 500
+
 # Orders routes
 @app.route('/api/orders', methods=['POST'])
 @auth_required
@@ -906,10 +1218,13 @@ def create_order():
                 'payment_proof_path': payment_proof_path or '',
                 'admin_comment': '',
                 'created_at': datetime.now().isoformat(),
-                'updated_at': datetime.now().isoformat()
+                'updated_at': datetime.now().isoformat(),
+                'service_name': service['name'],
+                'user_name': user['name'],
+                'user_email': user['email']
             }
             
-            append_csv_table('orders', new_order)
+            order_store.create_order(new_order)
             
             return jsonify({
                 'success': True,
@@ -939,19 +1254,13 @@ def create_order():
 def get_user_orders():
     """Get user's orders"""
     try:
-        orders = read_csv_table('orders')
+        user_orders = order_store.list_orders(user_id=g.current_user_id)  # newest first
         services = read_csv_table('services')
         
-        user_orders = [o for o in orders if o['user_id'] == g.current_user_id]
-        
-        # Add service names
+        # Add current service names
         for order in user_orders:
             service = next((s for s in services if s['service_id'] == order['service_id']), None)
-            order['service_name'] = service['name'] if service else 'Unknown Service'
-            order['price'] = float(order['price'])
-        
-        # Sort by creation date (newest first)
-        user_orders.sort(key=lambda x: x['created_at'], reverse=True)
+            order['service_name'] = service['name'] if service else order['service_name'] or 'Unknown Service'
         
         return jsonify(user_orders)
         
@@ -959,26 +1268,41 @@ def get_user_orders():
         logger.error(f"Get user orders error: {e}")
         return jsonify({'error': 'Failed to get orders'}), 500
 
+@app.route('/api/orders/<order_id>', methods=['GET'])
+@auth_required
+def get_order(order_id):
+    """Get one order; visible to its owner and to admins"""
+    try:
+        row = order_store.get_order(order_id)
+        if row is None:
+            return jsonify({'error': 'Order not found'}), 404
+        order = dict(row)
+        
+        if order['user_id'] != g.current_user_id and not current_user_is_admin():
+            return jsonify({'error': 'Order not found'}), 404  # don't reveal other users' orders
+        
+        service = table_indexes['services'].get(order['service_id'])
+        order['service_name'] = service['name'] if service else order['service_name'] or 'Unknown Service'
+        return conditional_json(order, private=True)
+        
+    except Exception as e:
+        logger.error(f"Get order error: {e}")
+        return jsonify({'error': 'Failed to get order'}), 500
+
 @app.route('/api/orders/<order_id>/cancel', methods=['POST'])
 @auth_required
 def cancel_order(order_id):
     """Cancel order"""
     try:
-        orders = read_csv_table('orders')
-        order = next((o for o in orders if o['order_id'] == order_id and o['user_id'] == g.current_user_id), None)
+        order = order_store.get_order(order_id)
         
-        if not order:
+        if not order or order['user_id'] != g.current_user_id:
             return jsonify({'error': 'Order not found'}), 404
         
-        if order['status'] != 'pending':
+        # Update order status only if it is still pending
+        if not order_store.set_status(order_id, 'cancelled', expected_status='pending', user_id=g.current_user_id):
             return jsonify({'error': 'Order cannot be cancelled'}), 400
         
-        # Update order status
-        order['status'] = 'cancelled'
-        order['updated_at'] = datetime.now().isoformat()
-        
-        write_csv_table('orders', orders)
-        
         return jsonify({'message': 'Order cancelled successfully'})
         
     except Exception as e:
@@ -993,21 +1317,17 @@ def get_admin_stats():
     """Get admin statistics"""
     try:
         users = read_csv_table('users')
-        orders = read_csv_table('orders')
+        order_stats = order_store.read(storage.order_stats)
         programs = read_csv_table('programs')
         news = read_csv_table('news')
         
-        # Calculate revenue
-        approved_orders = [o for o in orders if o['status'] in ['approved', 'completed']]
-        total_revenue = sum(float(o['price']) for o in approved_orders)
-        
         stats = {
             'total_users': len(users),
-            'total_orders': len(orders),
+            'total_orders': order_stats['total'],
             'total_programs': len([p for p in programs if p.get('is_active') == 'True']),
             'total_news': len([n for n in news if n.get('is_published') == 'True']),
-            'pending_orders': len([o for o in orders if o['status'] == 'pending']),
-            'total_revenue': total_revenue
+            'pending_orders': order_stats['pending'],
+            'total_revenue': order_stats['revenue']
         }
         
         return jsonify(stats)
@@ -1022,22 +1342,18 @@ def get_admin_stats():
 def get_all_orders():
     """Get all orders for admin"""
     try:
-        orders = read_csv_table('orders')
-        services = read_csv_table('services')
-        users = read_csv_table('users')
+        orders = order_store.list_orders()  # newest first
+        services = {s['service_id']: s for s in read_csv_table('services')}
+        users = {u['user_id']: u for u in read_csv_table('users')}
         
-        # Add service and user names
+        # Add current service and user names
         for order in orders:
-            service = next((s for s in services if s['service_id'] == order['service_id']), None)
-            user = next((u for u in users if u['user_id'] == order['user_id']), None)
+            service = services.get(order['service_id'])
+            user = users.get(order['user_id'])
             
-            order['service_name'] = service['name'] if service else 'Unknown Service'
-            order['user_name'] = user['name'] if user else 'Unknown User'
-            order['user_email'] = user['email'] if user else 'Unknown Email'
-            order['price'] = float(order['price'])
-        
-        # Sort by creation date (newest first)
-        orders.sort(key=lambda x: x['created_at'], reverse=True)
+            order['service_name'] = service['name'] if service else order['service_name'] or 'Unknown Service'
+            order['user_name'] = user['name'] if user else order['user_name'] or 'Unknown User'
+            order['user_email'] = user['email'] if user else order['user_email'] or 'Unknown Email'
         
         return jsonify(orders)
         
@@ -1051,18 +1367,9 @@ def get_all_orders():
 def approve_order(order_id):
     """Approve order"""
     try:
-        orders = read_csv_table('orders')
-        order = next((o for o in orders if o['order_id'] == order_id), None)
-        
-        if not order:
+        if not order_store.set_status(order_id, 'approved'):
             return jsonify({'error': 'Order not found'}), 404
         
-        # Update order status
-        order['status'] = 'approved'
-        order['updated_at'] = datetime.now().isoformat()
-        
-        write_csv_table('orders', orders)
-        
         return jsonify({'message': 'Order approved successfully'})
         
     except Exception as e:
@@ -1078,25 +1385,63 @@ def reject_order(order_id):
         data = request.get_json()
         reason = data.get('reason', 'Не указана')
         
-        orders = read_csv_table('orders')
-        order = next((o for o in orders if o['order_id'] == order_id), None)
-        
-        if not order:
+        if not order_store.set_status(order_id, 'rejected', admin_comment=reason):
             return jsonify({'error': 'Order not found'}), 404
         
-        # Update order status
-        order['status'] = 'rejected'
-        order['admin_comment'] = reason
-        order['updated_at'] = datetime.now().isoformat()
-        
-        write_csv_table('orders', orders)
-        
         return jsonify({'message': 'Order rejected successfully'})
         
     except Exception as e:
         logger.error(f"Reject order error: {e}")
         return jsonify({'error': 'Failed to reject order'}), 500
 
+# Bulk order actions: action -> (new status, statuses it may be applied to)
+BULK_ORDER_ACTIONS = {
+    'approve': ('approved', ('pending',)),
+    'reject': ('rejected', ('pending',)),
+}
+BULK_ORDER_LIMIT = 500
+BULK_REASON_MAX_LENGTH = 500
+
+@app.route('/api/admin/orders/bulk', methods=['POST'])
+@auth_required
+@admin_required
+def bulk_order_action():
+    """Approve or reject many pending orders in one transaction"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Request body must be a JSON object'}), 400
+        action = data.get('action')
+        order_ids = data.get('order_ids')
+        reason = data.get('reason')
+        
+        if action not in BULK_ORDER_ACTIONS:
+            return jsonify({'error': f"action must be one of: {', '.join(BULK_ORDER_ACTIONS)}"}), 400
+        if (not isinstance(order_ids, list) or not order_ids
+                or not all(isinstance(order_id, str) and order_id for order_id in order_ids)):
+            return jsonify({'error': 'order_ids must be a non-empty list of order IDs'}), 400
+        order_ids = list(dict.fromkeys(order_ids))  # drop duplicates, keep order
+        if len(order_ids) > BULK_ORDER_LIMIT:
+            return jsonify({'error': f'At most {BULK_ORDER_LIMIT} orders per request'}), 400
+        if reason is not None and (not isinstance(reason, str) or len(reason) > BULK_REASON_MAX_LENGTH):
+            return jsonify({'error': f'reason must be a string of at most {BULK_REASON_MAX_LENGTH} characters'}), 400
+        if action == 'reject':
+            reason = reason or 'Не указана'
+        
+        status, from_statuses = BULK_ORDER_ACTIONS[action]
+        results = order_store.bulk_set_status(order_ids, status, from_statuses, admin_comment=reason)
+        applied = all(result['ok'] for result in results)
+        
+        return jsonify({
+            'applied': applied,
+            'changed': sum(1 for result in results if result['changed']),
+            'results': results
+        }), 200 if applied else 409
+        
+    except Exception as e:
+        logger.error(f"Bulk order action error: {e}")
+        return jsonify({'error': 'Failed to process orders'}), 500
+
 # Admin program management
 @app.route('/api/admin/programs', methods=['POST'])
 @auth_required
@@ -1122,6 +1467,7 @@ def create_program():
         }
         
         append_csv_table('programs', new_program)
+        search_index.add('programs', new_program)
         
         return jsonify({'program_id': program_id, 'message': 'Program created successfully'})
         
@@ -1143,6 +1489,7 @@ def delete_program(program_id):
         
         program['is_active'] = 'False'
         write_csv_table('programs', programs)
+        search_index.remove('programs', program_id)
         
         return jsonify({'message': 'Program deleted successfully'})
         
@@ -1173,6 +1520,7 @@ def create_news():
         }
         
         append_csv_table('news', new_news)
+        search_index.add('news', new_news)
         
         return jsonify({'news_id': news_id, 'message': 'News created successfully'})
         
@@ -1194,6 +1542,7 @@ def delete_news(news_id):
         
         news_item['is_published'] = 'False'
         write_csv_table('news', news)
+        search_index.remove('news', news_id)
         
         return jsonify({'message': 'News deleted successfully'})
         
@@ -1209,12 +1558,11 @@ def get_all_users():
     """Get all users for admin"""
     try:
         users = read_csv_table('users')
-        orders = read_csv_table('orders')
+        order_counts = order_store.read(storage.order_counts_by_user)
         
         # Add orders count for each user
         for user in users:
-            user_orders = [o for o in orders if o['user_id'] == user['user_id']]
-            user['orders_count'] = len(user_orders)
+            user['orders_count'] = order_counts.get(user['user_id'], 0)
             # Remove sensitive data
             if 'password_hash' in user:
                 del user['password_hash']
@@ -1235,20 +1583,194 @@ def not_found(error):
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
+# Status monitor
+STATUS_REFRESH_INTERVAL = 10    # seconds between background status checks
+BOT_HEARTBEAT_FILE = 'bot_status.txt'
+BOT_HEARTBEAT_MAX_AGE = 120     # bot.py rewrites its status file every 30 seconds
+
+class StatusMonitor:
+    """Keeps readiness checks and counters fresh in a background thread.
+
+    /ready and /api/status only read `snapshot`, which is replaced as a
+    whole after each refresh, so they never touch the disk or parse tables.
+    The users table is recounted only when users.csv changes.
+    """
+
+    def __init__(self, interval=STATUS_REFRESH_INTERVAL):
+        self.interval = interval
+        self.snapshot = {
+            'checked_at': None, 'checks': {}, 'workers': {}, 'queues': {},
+            'counts': {'users': 0, 'orders': 0},
+        }
+        self._checked_monotonic = None
+        self._users_mtime = None
+        self._users_count = 0
+
+    def start(self):
+        """Run the first refresh now, then keep refreshing in the background"""
+        self.refresh()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def is_ready(self):
+        if self._checked_monotonic is None or time.monotonic() - self._checked_monotonic > 3 * self.interval:
+            return False  # the monitor itself is stuck
+        return all(self.snapshot['checks'].values())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Status refresh failed: {e}")
+
+    def refresh(self):
+        checks = {
+            'data_writable': self._dir_writable(DATABASE_FOLDER),
+            'uploads_writable': self._dir_writable(UPLOADS_FOLDER),
+        }
+        queues = {}
+        orders = self.snapshot['counts']['orders']
+        try:
+            order_store.read(storage.check_writable)
+            orders = order_store.read(storage.order_stats)['total']
+            queues['order_feed_backlog'] = order_store.read(storage.feed_backlog, storage.BOT_FEED_CONSUMER)
+            checks['order_store_writable'] = True
+        except sqlite3.Error as e:
+            logger.warning(f"Order store check failed: {e}")
+            checks['order_store_writable'] = False
+
+        try:
+            heartbeat_age = time.time() - os.path.getmtime(BOT_HEARTBEAT_FILE)
+        except OSError:
+            heartbeat_age = None
+        workers = {
+            'telegram_bot': {
+                'alive': heartbeat_age is not None and heartbeat_age < BOT_HEARTBEAT_MAX_AGE,
+                'heartbeat_age': round(heartbeat_age, 1) if heartbeat_age is not None else None,
+            },
+        }
+
+        self.snapshot = {
+            'checked_at': datetime.now().isoformat(),
+            'checks': checks,
+            'workers': workers,
+            'queues': queues,
+            'counts': {'users': self._count_users(), 'orders': orders},
+        }
+        self._checked_monotonic = time.monotonic()
+
+    @staticmethod
+    def _dir_writable(path):
+        try:
+            with tempfile.TemporaryFile(dir=path):
+                return True
+        except OSError:
+            return False
+
+    def _count_users(self):
+        try:
+            mtime = os.stat(get_csv_path('users')).st_mtime_ns
+        except OSError:
+            return 0
+        if mtime != self._users_mtime:
+            self._users_count = len(read_csv_table('users'))
+            self._users_mtime = mtime
+        return self._users_count
+
+status_monitor = StatusMonitor()
+
+# Graceful worker shutdown
+WORKER_DRAIN_TIMEOUT = int(os.getenv('WORKER_DRAIN_TIMEOUT', 30))  # seconds to finish in-flight requests
+
+class InFlightRequests:
+    """Counts requests being handled so a stopping worker can wait for them"""
+
+    def __init__(self):
+        self.count = 0
+        self.draining = False
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def track(self):
+        with self._cond:
+            self.count += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.count -= 1
+                self._cond.notify_all()
+
+    def wait_idle(self, timeout):
+        """True if all requests finished within timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.count == 0, timeout)
+
+in_flight = InFlightRequests()
+
+class DrainingRequestHandler(WSGIRequestHandler):
+    """Tracks each request; keep-alive connections are closed once draining"""
+
+    def run_wsgi(self):
+        with in_flight.track():
+            super().run_wsgi()
+        if in_flight.draining:
+            self.close_connection = True
+
+def serve_worker(listen_fd, port, health_port=None):
+    """Serve as one of start.py's web workers.
+
+    Connections are accepted on the listening socket inherited from the
+    supervisor; /health is also answered on health_port so the supervisor
+    can probe this worker specifically. On SIGTERM the worker stops
+    accepting (other workers keep the shared socket), waits up to
+    WORKER_DRAIN_TIMEOUT for in-flight requests, then flushes and exits.
+    """
+    server = make_server('0.0.0.0', port, app, threaded=True,
+                         request_handler=DrainingRequestHandler, fd=listen_fd)
+    if health_port:
+        health_server = make_server('127.0.0.1', health_port, app, threaded=True)
+        threading.Thread(target=health_server.serve_forever, daemon=True).start()
+
+    def stop_accepting(signum, frame):
+        in_flight.draining = True
+        # shutdown() waits for serve_forever, which this handler interrupted
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop_accepting)
+    server.serve_forever()
+    server.server_close()
+
+    logger.info(f"🛑 Worker {os.getpid()} draining {in_flight.count} request(s)...")
+    if not in_flight.wait_idle(WORKER_DRAIN_TIMEOUT):
+        logger.warning(f"⚠️ {in_flight.count} request(s) still running after {WORKER_DRAIN_TIMEOUT}s, exiting anyway")
+    order_store.close()
+    logger.info(f"✅ Worker {os.getpid()} stopped")
+    logging.shutdown()
+
 # Initialize and run
 if __name__ == '__main__':
-    # Initialize database
-    init_database()
+    # Initialize database (once, when several workers start together)
+    with open(os.path.join(DATABASE_FOLDER, '.init.lock'), 'a') as init_lock:
+        fcntl.flock(init_lock, fcntl.LOCK_EX)
+        init_database()
+    status_monitor.start()
     
     # Get port from environment
     port = int(os.getenv('PORT', 5000))
+    listen_fd = os.getenv('SERVER_SOCKET_FD')
     
-    logger.info(f"🚀 Phantom Services server starting on port {port}")
-    
-    # Run the app
-    app.run(
-        host='0.0.0.0',
-        port=port,
-        debug=False,
-        threaded=True
-    )
+    if listen_fd:
+        logger.info(f"🚀 Phantom Services worker {os.getpid()} serving port {port}")
+        serve_worker(int(listen_fd), port, int(os.getenv('HEALTH_PORT', 0)))
+    else:
+        logger.info(f"🚀 Phantom Services server starting on port {port}")
+        
+        # Run the app
+        app.run(
+            host='0.0.0.0',
+            port=port,
+            debug=False,
+            threaded=True
+        )
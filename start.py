@@ -7,10 +7,17 @@ Manages both web server and Telegram bot processes
 import os
 import sys
 import time
+import queue
+import socket
+import shlex
 import signal
+import functools
+import selectors
+import collections
 import logging
 import threading
 import subprocess
+import urllib.request
 from pathlib import Path
 
 # Configure logging
@@ -24,33 +31,217 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Supervision
+RESTART_BACKOFF_BASE = 1        # seconds before the first restart
+RESTART_BACKOFF_MAX = 300       # longest wait between restarts
+STABLE_AFTER = 60               # a child that ran this long starts over with the shortest backoff
+PROBE_INTERVAL = 10             # seconds between health probes
+PROBE_TIMEOUT = 5
+PROBE_GRACE = 60                # no probes while a child is starting up
+PROBE_FAILURES = 3              # consecutive failed probes before a hung child is restarted
+BOT_HEARTBEAT_FILE = 'bot_status.txt'
+BOT_HEARTBEAT_MAX_AGE = 120     # bot.py rewrites its status file every 30 seconds
+
+# Web workers
+WEB_PORT = int(os.getenv('PORT', 5000))
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', min(4, os.cpu_count() or 1)))
+WEB_LISTEN_BACKLOG = 1024
+WORKER_READY_TIMEOUT = 60       # seconds a replacement worker gets to pass /health
+WORKER_DRAIN_TIMEOUT = int(os.getenv('WORKER_DRAIN_TIMEOUT', 30))  # server.py reads the same variable
+STOP_TIMEOUT = 10               # seconds other children get to exit after SIGTERM
+
+def http_probe(url):
+    """Probe that passes when url answers 200 within PROBE_TIMEOUT"""
+    def probe():
+        try:
+            with urllib.request.urlopen(url, timeout=PROBE_TIMEOUT) as response:
+                return response.status == 200
+        except (OSError, ValueError):
+            return False
+    return probe
+
+def heartbeat_probe(path, max_age):
+    """Probe that passes when path was modified less than max_age seconds ago"""
+    def probe():
+        try:
+            return time.time() - os.path.getmtime(path) < max_age
+        except OSError:
+            return False
+    return probe
+
+def free_port():
+    """A currently unused localhost port"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# Child output
+LOG_READ_SIZE = 65536           # bytes per read from a child's pipe
+LOG_WRITE_BUFFER = 65536
+LOG_QUEUE_CHUNKS = 256          # chunks waiting for the writer before new output is dropped
+LOG_MAX_LINE = 16384            # longer lines are split
+
+class LogPump:
+    """Copies every child's output to stdout and startup.log with a [name] prefix.
+
+    One reader thread drains all pipes through a selector in large
+    non-blocking reads, so a child never blocks on a full pipe. Complete
+    lines are prefixed and passed in chunks to one writer thread through a
+    bounded queue; when the writer falls behind (slow stdout or disk), new
+    lines are dropped and counted instead of stalling the reader.
+    """
+
+    def __init__(self, targets):
+        self.targets = targets
+        self.selector = selectors.DefaultSelector()
+        self.chunks = queue.Queue(maxsize=LOG_QUEUE_CHUNKS)
+        self.dropped = collections.Counter()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def add(self, name, pipe):
+        """Start pumping a child's stdout; safe to call from any thread"""
+        with self._lock:
+            self._pending.append((name, pipe))
+        os.write(self._wakeup_w, b"\0")
+
+    def close(self):
+        """Flush queued output and stop the writer"""
+        self.chunks.put(None)
+        self._writer.join(timeout=5)
+
+    def _read(self):
+        partial = {}
+        while True:
+            for key, _ in self.selector.select():
+                if key.fileobj == self._wakeup_r:
+                    os.read(self._wakeup_r, 4096)
+                    with self._lock:
+                        pending, self._pending = self._pending, []
+                    for name, pipe in pending:
+                        os.set_blocking(pipe.fileno(), False)
+                        self.selector.register(pipe, selectors.EVENT_READ, name)
+                        partial[pipe] = b""
+                    continue
+
+                name, pipe = key.data, key.fileobj
+                try:
+                    data = os.read(pipe.fileno(), LOG_READ_SIZE)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b""
+                if not data:  # child exited
+                    self.selector.unregister(pipe)
+                    pipe.close()
+                    rest = partial.pop(pipe)
+                    self._emit(name, [rest] if rest else [])
+                    continue
+                lines = (partial[pipe] + data).split(b"\n")
+                partial[pipe] = lines.pop()
+                if len(partial[pipe]) > LOG_MAX_LINE:
+                    lines.append(partial[pipe])
+                    partial[pipe] = b""
+                self._emit(name, lines)
+
+    def _emit(self, name, lines):
+        if not lines:
+            return
+        prefix = f"[{name}] ".encode()
+        chunk = b"".join(prefix + line.rstrip(b"\r") + b"\n" for line in lines)
+        if self.dropped[name]:
+            chunk = f"[{name}] ... {self.dropped[name]} lines dropped, log writer was too slow\n".encode() + chunk
+        try:
+            self.chunks.put_nowait(chunk)
+            self.dropped[name] = 0
+        except queue.Full:
+            self.dropped[name] += len(lines)
+
+    def _write(self):
+        outputs = []
+        for target in self.targets:
+            try:
+                if isinstance(target, int):
+                    outputs.append(open(target, 'wb', buffering=LOG_WRITE_BUFFER, closefd=False))
+                else:
+                    outputs.append(open(target, 'ab', buffering=LOG_WRITE_BUFFER))
+            except OSError as e:
+                logger.error(f"Cannot write child output to {target}: {e}")
+        while True:
+            chunk = self.chunks.get()
+            for output in outputs:
+                try:
+                    if chunk is not None:
+                        output.write(chunk)
+                    if chunk is None or self.chunks.empty():
+                        output.flush()
+                except OSError:
+                    pass
+            if chunk is None:
+                return
+
 class ProcessManager:
+    """Starts children and restarts them when they exit or stop answering probes.
+
+    A waiter thread per child blocks in wait() and reports the exit on a
+    queue, so a crash is handled immediately. Restarts back off
+    exponentially; a child that stayed up for STABLE_AFTER seconds is
+    considered healthy again and its backoff resets.
+
+    Web workers all accept on one listening socket bound here and inherited
+    by each child, so the kernel spreads connections across them. Each
+    worker also answers /health on its own localhost port, which is how it
+    is probed individually.
+    """
+
     def __init__(self):
         self.processes = {}
-        self.running = True
+        self.launchers = {}
+        self.probes = {}
+        self.started_at = {}
         self.restart_count = {}
-        self.max_restarts = 5
+        self.probe_failures = {}
+        self.restart_due = {}
+        self.exits = queue.Queue()
+        self.log_pump = LogPump([sys.stdout.fileno(), 'startup.log'])
+        self.listen_socket = None
+        self.replacing = set()
+        self._rollout_lock = threading.Lock()
+        self.running = True
         
-    def start_process(self, name, command, cwd=None):
+    def start_process(self, name, command, probe=None, cwd=None, env=None, pass_fds=()):
         """Start a process and monitor it"""
+        self.launchers.setdefault(name, functools.partial(
+            self.start_process, name, command, probe, cwd, env, pass_fds
+        ))
+        self.probes[name] = probe
+        self.restart_count.setdefault(name, 0)
         try:
             logger.info(f"Starting {name}...")
+            # No shell in between, so signals reach the child itself
             process = subprocess.Popen(
-                command,
-                shell=True,
+                shlex.split(command),
                 cwd=cwd,
+                env=env,
+                pass_fds=pass_fds,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                bufsize=1
+                stderr=subprocess.STDOUT
             )
             
             self.processes[name] = process
-            self.restart_count[name] = 0
+            self.started_at[name] = time.monotonic()
+            self.probe_failures[name] = 0
             
-            # Start output monitoring thread
+            # Hand the output to the log pump and start the exit waiter thread
+            self.log_pump.add(name, process.stdout)
             threading.Thread(
-                target=self._monitor_output,
+                target=self._wait_for_exit,
                 args=(name, process),
                 daemon=True
             ).start()
@@ -60,65 +251,196 @@ class ProcessManager:
             
         except Exception as e:
             logger.error(f"❌ Failed to start {name}: {e}")
+            # A replacement that fails to start is abandoned by rolling_restart
+            # while the old instance keeps serving
+            if name not in self.replacing:
+                self._schedule_restart(name)
             return None
     
-    def _monitor_output(self, name, process):
-        """Monitor process output and log it"""
+    def start_bot(self):
+        """Start the Telegram bot, probed through its status file heartbeat"""
+        return self.start_process(
+            "telegram_bot", "python bot.py", heartbeat_probe(BOT_HEARTBEAT_FILE, BOT_HEARTBEAT_MAX_AGE)
+        )
+    
+    def start_web_workers(self, count):
+        """Start count web workers sharing one listening socket on WEB_PORT"""
+        if self.listen_socket is None:
+            self.listen_socket = socket.create_server(('0.0.0.0', WEB_PORT), backlog=WEB_LISTEN_BACKLOG)
+            self.listen_socket.set_inheritable(True)
+            logger.info(f"🌐 Listening on port {WEB_PORT} for {count} web worker(s)")
+        for index in range(1, count + 1):
+            name = f"web_{index}"
+            self.launchers[name] = functools.partial(self._start_web_worker, name)
+            self.launchers[name]()
+    
+    def _start_web_worker(self, name):
+        fd = self.listen_socket.fileno()
+        health_port = free_port()
+        env = dict(os.environ, SERVER_SOCKET_FD=str(fd), HEALTH_PORT=str(health_port))
+        return self.start_process(
+            name, "python server.py", http_probe(f"http://127.0.0.1:{health_port}/health"),
+            env=env, pass_fds=(fd,)
+        )
+    
+    def rolling_restart(self):
+        """Replace web workers one at a time without losing capacity.
+
+        The new instance of a worker starts next to the old one and must
+        pass /health; only then is the old one sent SIGTERM, which makes it
+        stop accepting and drain its in-flight requests. If the new
+        instance never becomes healthy it is stopped, the old one keeps
+        serving and the rollout is abandoned.
+        """
+        if not self._rollout_lock.acquire(blocking=False):
+            logger.warning("⚠️ A rolling restart is already in progress")
+            return
         try:
-            for line in iter(process.stdout.readline, ''):
-                if line:
-                    logger.info(f"[{name}] {line.strip()}")
-        except Exception as e:
-            logger.error(f"Error monitoring {name} output: {e}")
+            for name in sorted(name for name in self.launchers if name.startswith('web_')):
+                if not self.running:
+                    return
+                logger.info(f"🔁 Replacing {name}...")
+                old, old_probe = self.processes.get(name), self.probes.get(name)
+                old_started_at = self.started_at.get(name)
+                self.replacing.add(name)  # exits and start failures are handled here, not by the monitor loop
+                try:
+                    new = self.launchers[name]()
+                    if new is None or not self._wait_ready(name, old):
+                        if new is None:
+                            logger.error(f"❌ New {name} could not be started, keeping the old one")
+                        else:
+                            logger.error(f"❌ New {name} did not become healthy, keeping the old one")
+                            if new.poll() is None:
+                                self._terminate(name, new)
+                        if old is not None:
+                            self.processes[name], self.probes[name] = old, old_probe
+                            self.started_at[name] = old_started_at
+                        return
+                finally:
+                    self.replacing.discard(name)
+                if old is not None and old.poll() is None:
+                    self._terminate(name, old, WORKER_DRAIN_TIMEOUT + STOP_TIMEOUT)
+                logger.info(f"✅ {name} replaced")
+        finally:
+            self._rollout_lock.release()
+    
+    def _wait_ready(self, name, old):
+        """Wait until a new instance of name is running and passes its probe"""
+        deadline = time.monotonic() + WORKER_READY_TIMEOUT
+        while self.running and time.monotonic() < deadline:
+            process = self.processes.get(name)
+            if process is not old and process.poll() is not None:
+                return False
+            if process is not old and self.probes[name]():
+                return True
+            time.sleep(0.5)
+        return False
+    
+    def _wait_for_exit(self, name, process):
+        """Block until the process exits and report it to the monitor loop"""
+        process.wait()
+        self.exits.put((name, process))
     
     def monitor_processes(self):
-        """Monitor all processes and restart if needed"""
+        """Handle child exits as they happen, run due restarts and probes"""
+        next_probe = time.monotonic() + PROBE_INTERVAL
         while self.running:
             try:
-                for name, process in list(self.processes.items()):
-                    if process.poll() is not None:  # Process has terminated
-                        logger.warning(f"⚠️ {name} has stopped (exit code: {process.returncode})")
-                        
-                        if self.restart_count[name] < self.max_restarts:
-                            self.restart_count[name] += 1
-                            logger.info(f"🔄 Restarting {name} (attempt {self.restart_count[name]}/{self.max_restarts})")
-                            
-                            # Restart based on process type
-                            if name == "web_server":
-                                self.start_process("web_server", "python server.py")
-                            elif name == "telegram_bot":
-                                self.start_process("telegram_bot", "python bot.py")
-                        else:
-                            logger.error(f"❌ {name} has failed too many times, not restarting")
-                            del self.processes[name]
+                wake_at = min([next_probe, *self.restart_due.values()])
+                try:
+                    name, process = self.exits.get(timeout=max(0, wake_at - time.monotonic()))
+                    self._handle_exit(name, process)
+                except queue.Empty:
+                    pass
+                
+                now = time.monotonic()
+                for name, due in list(self.restart_due.items()):
+                    if due <= now and self.running:
+                        del self.restart_due[name]
+                        self.launchers[name]()
                 
-                time.sleep(10)  # Check every 10 seconds
+                if now >= next_probe:
+                    self.probe_processes()
+                    next_probe = time.monotonic() + PROBE_INTERVAL
                 
             except Exception as e:
                 logger.error(f"Error in process monitoring: {e}")
                 time.sleep(5)
     
+    def _handle_exit(self, name, process):
+        """Schedule a restart for a child that exited"""
+        if not self.running or self.processes.get(name) is not process:
+            return  # shutting down, or an old instance that was already replaced
+        if name in self.replacing:
+            return  # a replacement that failed to start; rolling_restart deals with it
+        uptime = time.monotonic() - self.started_at[name]
+        logger.warning(f"⚠️ {name} has stopped (exit code: {process.returncode}) after {uptime:.0f}s")
+        if uptime >= STABLE_AFTER:
+            self.restart_count[name] = 0
+        self._schedule_restart(name)
+    
+    def _schedule_restart(self, name):
+        self.restart_count[name] += 1
+        delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_BASE * 2 ** (self.restart_count[name] - 1))
+        self.restart_due[name] = time.monotonic() + delay
+        logger.info(f"🔄 Restarting {name} in {delay}s (attempt {self.restart_count[name]})")
+    
+    def probe_processes(self):
+        """Restart children that are running but fail their health probe"""
+        for name, probe in self.probes.items():
+            process = self.processes.get(name)
+            if probe is None or process is None or process.poll() is not None:
+                continue
+            if time.monotonic() - self.started_at[name] < PROBE_GRACE:
+                continue
+            
+            if probe():
+                self.probe_failures[name] = 0
+                continue
+            
+            self.probe_failures[name] += 1
+            logger.warning(f"⚠️ {name} failed its health probe ({self.probe_failures[name]}/{PROBE_FAILURES})")
+            if self.probe_failures[name] >= PROBE_FAILURES:
+                logger.error(f"❌ {name} is not responding, terminating it")
+                self._terminate(name, process)  # the waiter thread reports the exit
+    
+    def _terminate(self, name, process, timeout=STOP_TIMEOUT):
+        process.terminate()
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"⚠️ Force killing {name}")
+            process.kill()
+            process.wait()
+    
     def stop_all(self):
         """Stop all processes gracefully"""
         logger.info("🛑 Stopping all processes...")
         self.running = False
         
+        # Signal everyone first so web workers drain in parallel
+        stopping = {}
         for name, process in self.processes.items():
+            if process.poll() is not None:
+                continue  # already exited, restart pending
+            logger.info(f"Stopping {name}...")
+            process.terminate()
+            timeout = WORKER_DRAIN_TIMEOUT + STOP_TIMEOUT if name.startswith('web_') else STOP_TIMEOUT
+            stopping[name] = (process, time.monotonic() + timeout)
+        
+        for name, (process, deadline) in stopping.items():
             try:
-                logger.info(f"Stopping {name}...")
-                process.terminate()
-                
-                # Wait for graceful shutdown
-                try:
-                    process.wait(timeout=10)
-                    logger.info(f"✅ {name} stopped gracefully")
-                except subprocess.TimeoutExpired:
-                    logger.warning(f"⚠️ Force killing {name}")
-                    process.kill()
-                    process.wait()
-                    
+                process.wait(timeout=max(0, deadline - time.monotonic()))
+                logger.info(f"✅ {name} stopped")
+            except subprocess.TimeoutExpired:
+                logger.warning(f"⚠️ Force killing {name}")
+                process.kill()
+                process.wait()
             except Exception as e:
                 logger.error(f"Error stopping {name}: {e}")
+        
+        if self.listen_socket is not None:
+            self.listen_socket.close()
 
 def setup_environment():
     """Setup environment and check dependencies"""
@@ -162,6 +484,12 @@ def signal_handler(signum, frame):
         manager.stop_all()
     sys.exit(0)
 
+def reload_handler(signum, frame):
+    """Reload web workers without downtime on SIGHUP"""
+    logger.info("📡 Received SIGHUP, reloading web workers one at a time...")
+    if 'manager' in globals():
+        threading.Thread(target=manager.rolling_restart, daemon=True).start()
+
 def main():
     """Main startup function"""
     logger.info("🚀 Starting Rootzsu application...")
@@ -169,6 +497,7 @@ def main():
     # Setup signal handlers
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGHUP, reload_handler)
     
     # Setup environment
     if not setup_environment():
@@ -186,25 +515,25 @@ def main():
     if os.getenv('DYNO'):  # Heroku
         dyno_type = os.getenv('DYNO', '').split('.')[0]
         if dyno_type == 'web':
-            manager.start_process("web_server", "python server.py")
+            manager.start_web_workers(WEB_WORKERS)
         elif dyno_type == 'worker':
-            manager.start_process("telegram_bot", "python bot.py")
+            manager.start_bot()
     elif os.getenv('RENDER_SERVICE_TYPE'):  # Render
         service_type = os.getenv('RENDER_SERVICE_TYPE')
         if service_type == 'web':
             # On Render web service, run both server and bot
-            manager.start_process("web_server", "python server.py")
+            manager.start_web_workers(WEB_WORKERS)
             time.sleep(5)  # Give server time to start
-            manager.start_process("telegram_bot", "python bot.py")
+            manager.start_bot()
         else:
             # Background service - run bot only
-            manager.start_process("telegram_bot", "python bot.py")
+            manager.start_bot()
     else:
         # Local development - run both
         logger.info("🏠 Running in local development mode")
-        manager.start_process("web_server", "python server.py")
+        manager.start_web_workers(WEB_WORKERS)
         time.sleep(3)
-        manager.start_process("telegram_bot", "python bot.py")
+        manager.start_bot()
     
     # Start monitoring
     logger.info("👀 Starting process monitoring...")
@@ -216,6 +545,7 @@ def main():
         logger.error(f"❌ Unexpected error: {e}")
     finally:
         manager.stop_all()
+        manager.log_pump.close()
         logger.info("🏁 Shutdown complete")
 
 if __name__ == "__main__":
@@ -0,0 +1,345 @@
+"""
+Shared order storage for the web server and the Telegram bot.
+
+Web orders live in the same SQLite database as the bot (WAL mode, so both
+processes read concurrently while writes are serialized by SQLite's lock).
+Every insert or status change of a web order appends a row to
+`order_events` through a trigger; consumers read the feed after their last
+seen event_id. Writers send a datagram to ORDER_EVENTS_SOCKET after each
+commit so the bot picks changes up immediately instead of polling.
+
+Query helpers take a sqlite3.Connection so the bot can run them on its own
+executor threads; the server uses OrderStore, which owns its connections.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from datetime import datetime
+
+DB_FILE = os.getenv("ORDERS_DB_FILE") or os.getenv("BOT_DB_FILE", "rootzsu_bot_v3.db")
+ORDER_EVENTS_SOCKET = os.getenv("ORDER_EVENTS_SOCKET", "order_events.sock")
+BOT_FEED_CONSUMER = "bot"
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+)
+
+# Columns of the former data/orders.csv, in the same order
+ORDER_FIELDS = (
+    "order_id", "user_id", "service_id", "comments", "price", "payment_method", "status",
+    "payment_proof_path", "admin_comment", "created_at", "updated_at",
+)
+# Denormalized at creation so the bot can show orders without the site's CSV tables
+DISPLAY_FIELDS = ("service_name", "user_name", "user_email")
+
+
+def create_schema(cursor) -> None:
+    """Creates the shared tables and feed triggers (idempotent)."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS web_orders (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id TEXT NOT NULL UNIQUE, user_id TEXT NOT NULL, service_id TEXT,
+        comments TEXT, price REAL, payment_method TEXT,
+        status TEXT NOT NULL DEFAULT 'pending', payment_proof_path TEXT, admin_comment TEXT,
+        service_name TEXT, user_name TEXT, user_email TEXT,
+        created_at TEXT NOT NULL, updated_at TEXT NOT NULL
+    )""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_web_orders_user_id ON web_orders (user_id, seq)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_web_orders_status ON web_orders (status, seq)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS order_events (
+        event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id TEXT NOT NULL, kind TEXT NOT NULL, status TEXT, created_at TEXT NOT NULL
+    )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS order_event_consumers (
+        name TEXT PRIMARY KEY, last_event_id INTEGER NOT NULL
+    )""")
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS web_orders_event_insert AFTER INSERT ON web_orders
+    BEGIN
+        INSERT INTO order_events (order_id, kind, status, created_at)
+        VALUES (NEW.order_id, 'created', NEW.status, NEW.updated_at);
+    END""")
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS web_orders_event_status AFTER UPDATE OF status ON web_orders
+    WHEN OLD.status IS NOT NEW.status
+    BEGIN
+        INSERT INTO order_events (order_id, kind, status, created_at)
+        VALUES (NEW.order_id, 'status', NEW.status, NEW.updated_at);
+    END""")
+
+
+# --- Queries (take a connection) ---
+def insert_order(conn: sqlite3.Connection, order: dict) -> None:
+    columns = [field for field in ORDER_FIELDS + DISPLAY_FIELDS if field in order]
+    conn.execute(
+        f"INSERT INTO web_orders ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+        [order[field] for field in columns]
+    )
+
+
+def get_order(conn: sqlite3.Connection, order_id: str):
+    return conn.execute("SELECT * FROM web_orders WHERE order_id = ?", (order_id,)).fetchone()
+
+
+def list_orders(conn: sqlite3.Connection, user_id: str = None) -> list:
+    """Orders newest first, optionally for one user."""
+    if user_id is None:
+        return conn.execute("SELECT * FROM web_orders ORDER BY seq DESC").fetchall()
+    return conn.execute(
+        "SELECT * FROM web_orders WHERE user_id = ? ORDER BY seq DESC", (user_id,)
+    ).fetchall()
+
+
+def set_status(conn: sqlite3.Connection, order_id: str, status: str, admin_comment: str = None,
+               expected_status: str = None, user_id: str = None) -> bool:
+    """Changes an order's status; False if no order matched the conditions."""
+    sql = "UPDATE web_orders SET status = ?, updated_at = ?"
+    params = [status, datetime.now().isoformat()]
+    if admin_comment is not None:
+        sql += ", admin_comment = ?"
+        params.append(admin_comment)
+    sql += " WHERE order_id = ?"
+    params.append(order_id)
+    if expected_status is not None:
+        sql += " AND status = ?"
+        params.append(expected_status)
+    if user_id is not None:
+        sql += " AND user_id = ?"
+        params.append(user_id)
+    return conn.execute(sql, params).rowcount > 0
+
+
+def bulk_set_status(conn: sqlite3.Connection, order_ids: list, status: str, from_statuses,
+                    admin_comment: str = None) -> list:
+    """Moves many orders to `status` all-or-nothing; run it inside a transaction.
+
+    Each order must exist and be in one of from_statuses (orders already at
+    `status` are left as they are). Returns a result per ID; if any ID
+    fails, no order is changed and every result has applied False and the
+    order's unchanged status.
+    """
+    current = {row["order_id"]: row["status"] for row in conn.execute(
+        f"SELECT order_id, status FROM web_orders WHERE order_id IN ({', '.join('?' for _ in order_ids)})",
+        order_ids
+    )}
+    results, to_change = [], []
+    for order_id in order_ids:
+        old_status = current.get(order_id)
+        if old_status is None:
+            results.append({"order_id": order_id, "ok": False, "error": "not found"})
+        elif old_status != status and old_status not in from_statuses:
+            results.append({"order_id": order_id, "ok": False, "error": f"order is {old_status}",
+                            "status": old_status})
+        else:
+            results.append({"order_id": order_id, "ok": True, "status": old_status})
+            if old_status != status:
+                to_change.append(order_id)
+
+    applied = all(result["ok"] for result in results)
+    if to_change and applied:
+        now = datetime.now().isoformat()
+        if admin_comment is None:
+            conn.executemany("UPDATE web_orders SET status = ?, updated_at = ? WHERE order_id = ?",
+                             [(status, now, order_id) for order_id in to_change])
+        else:
+            conn.executemany(
+                "UPDATE web_orders SET status = ?, updated_at = ?, admin_comment = ? WHERE order_id = ?",
+                [(status, now, admin_comment, order_id) for order_id in to_change]
+            )
+    changed = set(to_change) if applied else set()
+    for result in results:
+        result["applied"] = applied
+        result["changed"] = result["order_id"] in changed
+        if result["changed"]:
+            result["status"] = status
+    return results
+
+
+def order_stats(conn: sqlite3.Connection) -> dict:
+    row = conn.execute("""
+        SELECT COUNT(*) AS total,
+               COALESCE(SUM(status = 'pending'), 0) AS pending,
+               COALESCE(SUM(CASE WHEN status IN ('approved', 'completed') THEN price END), 0) AS revenue
+        FROM web_orders
+    """).fetchone()
+    return {"total": row["total"], "pending": row["pending"], "revenue": row["revenue"]}
+
+
+def order_counts_by_user(conn: sqlite3.Connection) -> dict:
+    return {row["user_id"]: row["count"] for row in conn.execute(
+        "SELECT user_id, COUNT(*) AS count FROM web_orders GROUP BY user_id"
+    )}
+
+
+def count_user_orders(conn: sqlite3.Connection, user_id: str) -> int:
+    return conn.execute("SELECT COUNT(*) FROM web_orders WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def events_after(conn: sqlite3.Connection, event_id: int, limit: int = 100) -> list:
+    """Feed rows after event_id, joined with the order's current data."""
+    return conn.execute("""
+        SELECT e.event_id, e.kind, e.status AS event_status, w.*
+        FROM order_events e JOIN web_orders w ON w.order_id = e.order_id
+        WHERE e.event_id > ? ORDER BY e.event_id LIMIT ?
+    """, (event_id, limit)).fetchall()
+
+
+def get_consumer_position(conn: sqlite3.Connection, name: str):
+    """Last event_id acknowledged by `name`, or None for an unknown consumer."""
+    row = conn.execute("SELECT last_event_id FROM order_event_consumers WHERE name = ?", (name,)).fetchone()
+    return row[0] if row is not None else None
+
+
+def register_consumer(conn: sqlite3.Connection, name: str) -> int:
+    """Registers `name` at the end of the feed (history is not replayed); returns its position."""
+    conn.execute(
+        "INSERT OR IGNORE INTO order_event_consumers (name, last_event_id) "
+        "SELECT ?, COALESCE(MAX(event_id), 0) FROM order_events", (name,)
+    )
+    return get_consumer_position(conn, name)
+
+
+def set_consumer_position(conn: sqlite3.Connection, name: str, event_id: int) -> None:
+    conn.execute(
+        "INSERT INTO order_event_consumers (name, last_event_id) VALUES (?, ?) "
+        "ON CONFLICT (name) DO UPDATE SET last_event_id = excluded.last_event_id",
+        (name, event_id)
+    )
+
+
+def feed_backlog(conn: sqlite3.Connection, name: str) -> int:
+    """Events `name` has not acknowledged yet (all of them for an unknown consumer)."""
+    return conn.execute(
+        "SELECT COUNT(*) FROM order_events WHERE event_id > "
+        "COALESCE((SELECT last_event_id FROM order_event_consumers WHERE name = ?), 0)", (name,)
+    ).fetchone()[0]
+
+
+def check_writable(conn: sqlite3.Connection) -> None:
+    """Takes and releases the write lock; raises sqlite3.Error if the database is not writable."""
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("ROLLBACK")
+
+
+def notify_subscribers() -> None:
+    """Nudges the feed consumer; losing the datagram only delays it until its next check."""
+    if not hasattr(socket, "AF_UNIX"):
+        return
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            sock.sendto(b"1", ORDER_EVENTS_SOCKET)
+    except OSError:
+        pass  # nobody listening (bot not running) or its buffer is full
+
+
+# --- Store for the web server ---
+class _Connection(sqlite3.Connection):
+    """sqlite3.Connection that can be weakly referenced."""
+
+
+class OrderStore:
+    """Thread-safe access to web orders for the threaded Flask server.
+
+    Each thread keeps its own connection; writes run in BEGIN IMMEDIATE
+    transactions and nudge the feed consumer after commit. Connections are
+    tracked weakly: the threaded server starts a thread per HTTP connection,
+    and a connection is closed with the thread that opened it.
+    """
+
+    def __init__(self, path: str = DB_FILE):
+        self.path = path
+        self._local = threading.local()
+        self._connections = weakref.WeakSet()
+        self._lock = threading.Lock()
+        with self.transaction() as conn:
+            create_schema(conn)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, factory=_Connection)
+            conn.row_factory = sqlite3.Row
+            for pragma in SQLITE_PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.add(conn)
+        return conn
+
+    def close(self) -> None:
+        """Closes the connections of live threads; the last close checkpoints the WAL."""
+        with self._lock:
+            connections, self._connections = list(self._connections), weakref.WeakSet()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def read(self, fn, *args):
+        return fn(self.connection(), *args)
+
+    def write(self, fn, *args, **kwargs):
+        """Runs fn(conn, *args, **kwargs) in a transaction, then nudges the bot."""
+        with self.transaction() as conn:
+            result = fn(conn, *args, **kwargs)
+        notify_subscribers()
+        return result
+
+    def create_order(self, order: dict) -> None:
+        self.write(insert_order, order)
+
+    def get_order(self, order_id: str):
+        return self.read(get_order, order_id)
+
+    def list_orders(self, user_id: str = None) -> list:
+        return [dict(row) for row in self.read(list_orders, user_id)]
+
+    def set_status(self, order_id: str, status: str, **kwargs) -> bool:
+        return self.write(set_status, order_id, status, **kwargs)
+
+    def bulk_set_status(self, order_ids: list, status: str, from_statuses, admin_comment: str = None) -> list:
+        return self.write(bulk_set_status, order_ids, status, from_statuses, admin_comment)
+
+    def import_orders(self, rows: list) -> int:
+        """Copies rows from the former orders CSV; existing order_ids are kept.
+
+        Imported orders are history, so their feed events are dropped.
+        """
+        def run(conn: sqlite3.Connection) -> int:
+            imported = 0
+            first_event = conn.execute("SELECT COALESCE(MAX(event_id), 0) FROM order_events").fetchone()[0]
+            for row in rows:
+                if get_order(conn, row["order_id"]) is None:
+                    order = {field: row.get(field) or "" for field in ORDER_FIELDS}
+                    order["price"] = float(order["price"] or 0)
+                    order["status"] = order["status"] or "pending"
+                    order["created_at"] = order["created_at"] or datetime.now().isoformat()
+                    order["updated_at"] = order["updated_at"] or order["created_at"]
+                    insert_order(conn, order)
+                    imported += 1
+            conn.execute("DELETE FROM order_events WHERE event_id > ?", (first_event,))
+            return imported
+        return self.write(run)
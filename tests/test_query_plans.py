@@ -0,0 +1,24 @@
+"""Every query in bot.HOT_QUERIES must be served by its index on a freshly migrated database."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def conn():
+    conn = bot.Database(":memory:").connection()
+    bot.run_migrations(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("description, sql, params, index", bot.HOT_QUERIES, ids=[q[0] for q in bot.HOT_QUERIES])
+def test_hot_query_uses_index(conn, description, sql, params, index):
+    plan = [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+    assert any(f"USING INDEX {index}" in step or f"USING COVERING INDEX {index}" in step for step in plan), plan